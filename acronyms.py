@@ -0,0 +1,61 @@
+import re
+
+# "(ABBR)": 2-10 characters starting with a capital and containing at least two capitals or digits
+PARENTHESISED_ABBREVIATION = re.compile(r"\(([A-Z][A-Za-z0-9&\-]{1,9})\)")
+
+# Words a long form may contain without contributing a letter ("Department of Motor Vehicles (DMV)")
+MINOR_WORDS = frozenset("a an and for in of on the to &".split())
+
+WORD = re.compile(r"[A-Za-z0-9][A-Za-z0-9']*|&")
+
+# Acronym-looking tokens in a question ("What does ASDE stand for?")
+ACRONYM_TOKEN = re.compile(r"\b[A-Z][A-Za-z0-9&]*[A-Z0-9][A-Za-z0-9&]*\b")
+
+
+def _letters(abbreviation):
+    """The characters a long form's words must start with"""
+    letters = [c for c in abbreviation if c.isupper() or c.isdigit()]
+    return letters if len(letters) >= 2 else None
+
+
+def _long_form(words, letters):
+    """The shortest run of trailing words whose initials spell letters, or None"""
+    position = len(letters) - 1
+    start = None
+    for i in range(len(words) - 1, -1, -1):
+        word = words[i]
+        if position < 0:
+            break
+        if word[0].upper() == letters[position]:
+            position -= 1
+            start = i
+        elif word.lower() not in MINOR_WORDS:
+            return None
+    if position >= 0 or start is None:
+        return None
+    return " ".join(words[start:])
+
+
+def find_definitions(text):
+    """Yield (abbreviation, long form) for each "Long Form (ABBR)" definition in text"""
+    for match in PARENTHESISED_ABBREVIATION.finditer(text):
+        abbreviation = match.group(1)
+        letters = _letters(abbreviation)
+        if letters is None:
+            continue
+        # Look back at most a few words more than there are letters
+        window = text[max(0, match.start() - 20 * (len(letters) + 4)):match.start()]
+        words = WORD.findall(window)[-(len(letters) + 4):]
+        long_form = _long_form(words, letters)
+        if long_form:
+            yield abbreviation, long_form
+
+
+def acronym_candidates(query_text, max_length=10):
+    """Tokens of a question that could be a defined abbreviation, upper-cased for lookup"""
+    candidates = [token.upper() for token in ACRONYM_TOKEN.findall(query_text) if len(token) <= max_length]
+    stripped = query_text.strip(" ?!.\"'")
+    # Very short questions are often just the abbreviation, whatever its case
+    if 2 <= len(stripped) <= 5 and stripped.isalnum():
+        candidates.append(stripped.upper())
+    return list(dict.fromkeys(candidates))
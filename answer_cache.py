@@ -0,0 +1,151 @@
+from collections import OrderedDict
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+# Punctuation and whitespace differences don't make a question different
+QUESTION_NOISE = re.compile(r"[^\w]+")
+
+
+def normalize_question(question):
+    """Lowercase a question and reduce it to its words"""
+    return QUESTION_NOISE.sub(" ", question.lower()).strip()
+
+
+class AnswerCache:
+    """LRU + TTL cache of generated answers.
+
+    Keys combine the normalised question with a fingerprint of the chunk ids
+    that were retrieved for it, so an answer is only reused when the same
+    context would be sent to the LLM. Every entry also records the corpus
+    version it was generated under; DocumentProcessor bumps the version on
+    each ingest, which turns all older entries into misses.
+
+    With a path, entries and the corpus version are also kept in a local
+    SQLite file so the cache survives app restarts; the in-memory LRU sits
+    in front of it.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, path=None, max_disk_entries=100_000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._entries = OrderedDict()   # key -> (answer, version, created_at)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY, answer TEXT NOT NULL, version INTEGER NOT NULL,
+                created_at REAL NOT NULL, accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'corpus_version'").fetchone()
+        self.version = row[0] if row else 0
+        self._db.commit()
+
+    @staticmethod
+    def make_key(question, chunk_ids):
+        """Cache key for a question and the ids of the chunks retrieved for it"""
+        digest = hashlib.sha256(normalize_question(question).encode("utf-8"))
+        for chunk_id in chunk_ids:
+            digest.update(b"\0" + str(chunk_id).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Cached answer for key, or None if missing, expired or from an older corpus version"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT answer, version, created_at FROM answers WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = tuple(row)
+                    self._remember(key, entry)
+
+            if entry is None or entry[1] != self.version or now - entry[2] > self.ttl_seconds:
+                if entry is not None:
+                    self._forget(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, answer):
+        """Store an answer under the current corpus version"""
+        now = time.time()
+        with self._lock:
+            entry = (answer, self.version, now)
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                    (key, answer, self.version, now, now)
+                )
+                self._db.execute(
+                    """
+                    DELETE FROM answers WHERE key IN (
+                        SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def bump_version(self):
+        """Invalidate every cached answer; called whenever the corpus changes"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('corpus_version', ?)", (self.version,)
+                )
+                self._db.execute("DELETE FROM answers WHERE version < ?", (self.version,))
+                self._db.commit()
+            return self.version
+
+    def stats(self):
+        """Hit/miss counters and sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "corpus_version": self.version,
+            }
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self._db.commit()
@@ -1,7 +1,13 @@
 import streamlit as st
 from query_engine import Chatbot
 from document_processor import DocumentProcessor
+from answer_cache import AnswerCache
+from ingest_service import IngestService
+from llm_scheduler import RequestScheduler
+from scopes import DEFAULT_COLLECTION, Scope
+from tracing import tracer, set_verbosity, start_metrics_server
 import time
+import uuid
 
 # Set page configuration
 st.set_page_config(
@@ -13,23 +19,114 @@ st.set_page_config(
 # Initialize session state for chat history
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+# Gemini requests are scheduled fairly between sessions
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # ✅ Load secrets from Streamlit
 NEO4J_URI = st.secrets["neo4j"]["uri"]
 NEO4J_USER = st.secrets["neo4j"]["user"]
 NEO4J_PASSWORD = st.secrets["neo4j"]["password"]
+# Optional [neo4j_pool] section: max_connection_pool_size, connection_acquisition_timeout, max_connection_lifetime
+NEO4J_POOL_SETTINGS = dict(st.secrets.get("neo4j_pool", {}))
+
+# Optional [observability] section: verbosity ("quiet", "info", "debug"),
+# trace_path (JSON lines span log) and metrics_port (Prometheus /metrics endpoint)
+OBSERVABILITY = st.secrets.get("observability", {})
+set_verbosity(OBSERVABILITY.get("verbosity", "info"))
+tracer.export_path = OBSERVABILITY.get("trace_path")
+if OBSERVABILITY.get("metrics_port"):
+    start_metrics_server(int(OBSERVABILITY["metrics_port"]))
 
 # ✅ Initialize chatbot & document processor
 @st.cache_resource
 def get_chatbot():
-    return Chatbot(uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD)
+    # Optional [cache] path in secrets keeps answers in SQLite across restarts
+    cache_path = st.secrets.get("cache", {}).get("path")
+    gemini_settings = st.secrets.get("gemini", {})
+    chatbot = Chatbot(
+        uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD,
+        # Optional [retrieval] mode: "bm25" (default), "vector", "graph" or "hybrid"
+        retrieval_mode=st.secrets.get("retrieval", {}).get("mode", "bm25"),
+        answer_cache=AnswerCache(path=cache_path),
+        driver_settings=NEO4J_POOL_SETTINGS,
+        # Optional [gemini] hedge = true sends a backup request for unusually slow answers
+        hedge_requests=bool(gemini_settings.get("hedge", False)),
+        # Optional [gemini] rpm and tpm: requests and prompt tokens per minute shared by all sessions
+        scheduler=RequestScheduler(rpm=gemini_settings.get("rpm"), tpm=gemini_settings.get("tpm")),
+        # Optional [snapshot] path: a corpus_snapshot.py export to warm the local indexes from
+        snapshot_path=st.secrets.get("snapshot", {}).get("path")
+    )
+    # Check Gemini in the background instead of blocking the first render on it
+    chatbot.start_health_probe()
+    return chatbot
 
 @st.cache_resource
 def get_processor():
-    return DocumentProcessor(uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD)
+    # Keep the chatbot's local search indexes in step with newly stored chunks
+    processor = DocumentProcessor(
+        uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD,
+        indexes=get_chatbot().local_indexes,
+        answer_cache=get_chatbot().answer_cache,
+        corpus_stats=get_chatbot().corpus_stats,
+        driver_settings=NEO4J_POOL_SETTINGS
+    )
+    # Scope indexes exist, and older documents have collections, before the first scoped question
+    processor.ensure_indexes()
+    return processor
+
+@st.cache_resource
+def get_ingest_service():
+    # Optional [ingest] section: queue_path, spool_dir and workers
+    settings = st.secrets.get("ingest", {})
+    return IngestService(
+        get_processor(),
+        path=settings.get("queue_path", "ingest_jobs.db"),
+        spool_dir=settings.get("spool_dir", "ingest_spool"),
+        workers=int(settings.get("workers", 2))
+    )
 
 chatbot = get_chatbot()
 processor = get_processor()
+ingest_service = get_ingest_service()
+
+if "reported_jobs" not in st.session_state:
+    st.session_state.reported_jobs = set()
+
+JOB_ICONS = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}
+
+@st.cache_data(ttl=10, show_spinner=False)
+def get_documents(corpus_version):
+    # Keyed on the corpus version so a finished ingest shows up right away
+    return processor.list_documents()
+
+def describe_scope(scope, names):
+    if scope is None:
+        return "All documents"
+    if scope.kind == "collection":
+        return f"📁 {scope.value}"
+    return f"📄 {names.get(scope.value, scope.value[:12])}"
+
+@st.fragment(run_every=2)
+def show_ingest_jobs():
+    """Poll the ingest queue and show each job's state without blocking the rest of the page"""
+    jobs = ingest_service.jobs()
+    if not jobs:
+        return
+    st.markdown("**Ingest jobs**")
+    for job in jobs:
+        label = f"{JOB_ICONS.get(job['state'], '')} {job['name']} ({job['state']})"
+        if job["state"] == "running":
+            st.progress(min(job["progress"], 1.0), text=f"{label}: {job['message'] or ''}")
+        else:
+            st.caption(label)
+        if job["state"] == "failed" and job["message"]:
+            st.caption(job["message"])
+        if job["state"] == "done" and job["id"] not in st.session_state.reported_jobs:
+            st.session_state.reported_jobs.add(job["id"])
+            st.session_state.chat_history.append(
+                {"role": "system", "content": f"Document '{job['name']}' has been processed and added to the knowledge graph."}
+            )
 
 # App title and description
 st.title("🧠 Knowledge Graph Chatbot")
@@ -44,48 +141,91 @@ col1, col2 = st.columns([1, 2])
 # 📂 File Upload Section (left column)
 with col1:
     st.subheader("📂 Upload Documents")
-    uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
+    uploaded_files = st.file_uploader("Choose PDF files", type="pdf", accept_multiple_files=True)
+    collection = st.text_input("Collection", value=DEFAULT_COLLECTION).strip() or DEFAULT_COLLECTION
 
-    if uploaded_file:
-        if st.button("Process Document"):
+    if uploaded_files:
+        if st.button("Process Documents"):
+            # Ingest runs on background workers; the job list below follows it
             try:
-                with st.spinner("🔄 Processing document..."):
-                    success = processor.process_pdf(uploaded_file)
-                    
-                    if success:
-                        st.success("✅ Document processed successfully!")
-                        st.session_state.chat_history.append(
-                            {"role": "system", "content": f"Document '{uploaded_file.name}' has been processed and added to the knowledge graph."}
-                        )
-                    else:
-                        st.error("❌ Failed to process document. See messages above for details.")
+                for uploaded_file in uploaded_files:
+                    ingest_service.submit(uploaded_file.name, uploaded_file.getvalue(), collection)
+                st.success(f"✅ Queued {len(uploaded_files)} document(s) for processing")
             except Exception as e:
-                st.error(f"❌ Error processing document: {str(e)}")
+                st.error(f"❌ Error queueing documents: {str(e)}")
+
+    show_ingest_jobs()
 
     # Display system status
     st.subheader("System Status")
-    try:
-        with st.spinner("Checking connection..."):
-            with chatbot.driver.session() as session:
-                result = session.run("RETURN 1 as test").single()
-                if result and result["test"] == 1:
-                    st.success("✅ Connected to Neo4j")
-                    
-                    # Check if database has content
-                    count_result = session.run("MATCH (c:TextChunk) RETURN count(c) as count").single()
-                    count = count_result["count"] if count_result else 0
-                    if count > 0:
-                        st.success(f"✅ Database contains {count} text chunks")
-                    else:
-                        st.warning("⚠️ Database is empty. Please upload a document.")
-                else:
-                    st.error("❌ Neo4j connection issue")
-    except Exception as e:
-        st.error(f"❌ Neo4j connection error: {str(e)}")
+    # Corpus stats are cached and refreshed on a TTL, so reruns don't recount the graph
+    stats = chatbot.corpus_stats.snapshot()
+    if stats["error"]:
+        st.error(f"❌ Neo4j connection error: {stats['error']}")
+    else:
+        st.success("✅ Connected to Neo4j")
+        if stats["chunks"] > 0:
+            st.success(f"✅ Database contains {stats['chunks']} text chunks from {stats['documents']} documents")
+            if stats["last_ingest"]:
+                st.caption(f"Last ingest: {stats['last_ingest']}")
+        else:
+            st.warning("⚠️ Database is empty. Please upload a document.")
+
+    gemini_status = chatbot.gemini_status
+    if gemini_status["state"] == "ok":
+        st.success(f"✅ Gemini API reachable ({gemini_status['latency']:.2f}s)")
+    elif gemini_status["state"] == "error":
+        st.error(f"❌ Gemini API check failed: {gemini_status['detail']}")
+    else:
+        st.info("⏳ Checking Gemini API...")
+    if chatbot.circuit_breaker.state != "closed":
+        st.warning("⚠️ Gemini is failing; answers show the relevant document passages until it recovers")
+    queue_depth = chatbot.scheduler.depth
+    if queue_depth:
+        st.caption(f"Gemini queue: {queue_depth} request(s) waiting for the rate limit")
+
+    cache_stats = chatbot.answer_cache.stats()
+    st.caption(
+        f"Answer cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries"
+    )
+    llm_counters = tracer.counters()
+    prompts = llm_counters.get(("llm_prompts_total", ()), 0)
+    if prompts:
+        st.caption(f"Prompts: {prompts:.0f}, ~{llm_counters[('llm_prompt_tokens_total', ())] / prompts:.0f} tokens each")
+
+    # Per-stage latencies recorded by the tracer
+    with st.expander("⏱️ Stage latencies"):
+        stage_stats = tracer.summary()
+        if stage_stats:
+            st.table([
+                {
+                    "stage": name,
+                    "count": stage["count"],
+                    "p50 (ms)": round(stage["p50"] * 1000, 1),
+                    "p95 (ms)": round(stage["p95"] * 1000, 1),
+                }
+                for name, stage in stage_stats.items()
+            ])
+        else:
+            st.caption("No timings recorded yet.")
 
 # 💬 Chat Section (right column)
 with col2:
     st.subheader("💬 Ask Questions About Your Documents")
+
+    # Questions can be limited to one collection or one document
+    documents = get_documents(chatbot.answer_cache.version)
+    document_names = {document["hash"]: document["name"] for document in documents}
+    scope_options = (
+        [None]
+        + [Scope("collection", name)
+           for name in sorted({name for document in documents for name in document["collections"]})]
+        + [Scope("document", document["hash"]) for document in documents]
+    )
+    scope = st.selectbox(
+        "Search in", scope_options, format_func=lambda option: describe_scope(option, document_names)
+    )
     
     # Display chat history
     chat_container = st.container()
@@ -108,20 +248,28 @@ with col2:
         # Display user message
         st.chat_message("user").write(user_input)
         
-        # Get and display assistant response
+        # Get and display assistant response, rendering it as it streams in
         with st.chat_message("assistant"):
             try:
-                with st.spinner("Thinking..."):
-                    start_time = time.time()
-                    response_text = chatbot.chat(user_input)
-                    end_time = time.time()
-                    
-                    st.write(response_text)
-                    
-                    # Add debug info if response took too long
-                    response_time = end_time - start_time
-                    if response_time > 5:
-                        st.caption(f"Response time: {response_time:.2f} seconds")
+                start_time = time.time()
+                first_token = {}
+
+                def timed_stream(stream):
+                    for piece in stream:
+                        if "time" not in first_token:
+                            first_token["time"] = time.time() - start_time
+                        yield piece
+
+                response_text = st.write_stream(timed_stream(chatbot.chat_stream(user_input, session=st.session_state.session_id, scope=scope)))
+                end_time = time.time()
+                
+                # Add debug info if response took too long
+                response_time = end_time - start_time
+                if response_time > 5:
+                    st.caption(
+                        f"Response time: {response_time:.2f} seconds "
+                        f"(first token after {first_token.get('time', response_time):.2f} seconds)"
+                    )
             except Exception as e:
                 st.error(f"Error generating response: {str(e)}")
                 response_text = "I encountered a technical issue. Please try again later."
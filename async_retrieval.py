@@ -0,0 +1,377 @@
+import asyncio
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from neo4j import AsyncGraphDatabase
+from neo4j.exceptions import ClientError
+
+from acronyms import acronym_candidates
+from document_processor import FULLTEXT_INDEX_NAME
+from neo4j_connection import pool_settings
+from scopes import SCOPE_PROPERTIES, scope_condition
+from tracing import tracer
+
+# Characters with special meaning in Lucene query syntax
+LUCENE_SPECIAL_CHARS = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+# Neighbours pulled in around a hit score this fraction of the hit's score, divided by their distance
+NEIGHBOUR_SCORE_FACTOR = 0.5
+
+def escape_lucene(text):
+    """Escape text so the full-text index treats it literally"""
+    return LUCENE_SPECIAL_CHARS.sub(r'\\\1', text)
+
+
+def scoped_lucene(lucene_query, scope):
+    """A full-text query on the chunk text, restricted to scope inside the index"""
+    if scope is None:
+        return f"text:({lucene_query})"
+    return f'text:({lucene_query}) AND {SCOPE_PROPERTIES[scope.kind]}:"{escape_lucene(scope.value)}"'
+
+
+def extract_keywords(query_text):
+    """Words longer than 3 characters (or all words if there are none), without repeats"""
+    keywords = [word.strip().lower() for word in query_text.split() if len(word.strip()) > 3]
+    if not keywords:
+        keywords = [word.strip().lower() for word in query_text.split() if len(word.strip()) > 0]
+    return list(dict.fromkeys(keywords))
+
+
+def neighbour_query(hops):
+    """Cypher fetching ranked hits and, up to hops NEXT relationships either way, their neighbours
+
+    $hits holds {"list", "rank", "id", "fetch"} rows and only hits ranked
+    below $expand_top are expanded. Texts are returned for neighbours, and
+    for hits with fetch set; callers already holding a hit's text skip it.
+    """
+    # Variable-length bounds can't be parameters, so the (integer) hop count is inlined
+    hops = max(int(hops), 0)
+    if not hops:
+        return """
+            UNWIND $hits AS h
+            MATCH (c:TextChunk {id: h.id})
+            RETURN h.list AS list, h.rank AS rank, c.id AS id, CASE WHEN h.fetch THEN c.text END AS text,
+                   0 AS distance
+            """
+    return f"""
+        UNWIND $hits AS h
+        MATCH (hit:TextChunk {{id: h.id}})
+        CALL {{
+            WITH hit, h
+            MATCH path = (hit)-[:NEXT*0..{hops}]->(c:TextChunk)
+            WHERE h.rank < $expand_top OR length(path) = 0
+            RETURN c, length(path) AS distance
+            UNION
+            WITH hit, h
+            MATCH path = (c:TextChunk)-[:NEXT*1..{hops}]->(hit)
+            WHERE h.rank < $expand_top
+            RETURN c, length(path) AS distance
+        }}
+        RETURN h.list AS list, h.rank AS rank, c.id AS id,
+               CASE WHEN distance > 0 OR h.fetch THEN c.text END AS text, distance
+        """
+
+
+def rank_neighbours(hit_lists, records, texts=None):
+    """Turn neighbour_query() records into a chunk list per ranked (chunk_id, score) hit list
+
+    Hits come first in rank order, then their neighbours by score, scored
+    below the hit they were found from. texts supplies the text of hits
+    fetched without it; hits missing from the records are dropped.
+    """
+    texts = texts or {}
+    found = [{} for _ in hit_lists]
+    for record in records:
+        n, rank, distance = record["list"], record["rank"], record["distance"]
+        score = hit_lists[n][rank][1]
+        if distance:
+            score = score * NEIGHBOUR_SCORE_FACTOR / distance
+        # Hits sort by rank, neighbours after every hit by score
+        order = (0, rank) if distance == 0 else (1, -score)
+        existing = found[n].get(record["id"])
+        if existing is None or order < existing[0]:
+            text = record["text"] if record["text"] is not None else texts.get(record["id"])
+            found[n][record["id"]] = (order, {"id": record["id"], "text": text, "score": score})
+    return [[chunk for _, chunk in sorted(chunks.values(), key=lambda item: item[0])] for chunks in found]
+
+
+class StrategyResult(NamedTuple):
+    name: str
+    chunks: list                # chunk dicts: id, score, confident and (for Neo4j strategies) text
+    elapsed: float
+    error: Optional[str] = None
+
+
+class RetrievalResult(NamedTuple):
+    chunks: list                # fused chunk dicts: id, text, score
+    strategies: list            # StrategyResult of every strategy that finished
+    cancelled: list             # names of strategies cancelled early or at the deadline
+    elapsed: float
+
+
+class AsyncRetriever:
+    """Runs retrieval strategies concurrently on the async Neo4j driver.
+
+    Every strategy for a question starts at once under a per-query
+    deadline. Results are merged with reciprocal rank fusion, and strategies
+    still running are cancelled as soon as enough high-confidence chunks
+    (exact phrase hits, chunks matching every keyword, acronym definitions)
+    have arrived. The driver lives on a private event loop thread, so
+    synchronous callers just call retrieve(); nothing here touches Streamlit.
+
+    local_strategies maps a name to a search(query_text, k, documents)
+    callable returning (chunk_id, score) pairs, e.g. BM25Index.search; they
+    run in the loop's executor alongside the Neo4j strategies. The
+    expand_top best fused chunks are expanded with up to neighbour_hops
+    chunks on either side along NEXT relationships, in the same query that
+    fetches the texts the local strategies don't return.
+    """
+
+    def __init__(self, uri, user, password, local_strategies=None, deadline=3.0, k=5, rrf_k=60,
+                 driver_settings=None, neighbour_hops=0, expand_top=3):
+        self.local_strategies = dict(local_strategies or {})
+        self.deadline = deadline
+        self.k = k
+        self.rrf_k = rrf_k
+        self.neighbour_hops = neighbour_hops
+        self.expand_top = expand_top
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-retrieval", daemon=True)
+        self._thread.start()
+        self._driver = self._run(self._open_driver(uri, user, password, driver_settings))
+
+    async def _open_driver(self, uri, user, password, driver_settings):
+        return AsyncGraphDatabase.driver(uri, auth=(user, password), **pool_settings(driver_settings))
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def close(self):
+        """Close the async driver and stop the event loop thread"""
+        self._run(self._driver.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def retrieve(self, query_text, scope=None, documents=None):
+        """Run all strategies for a question and return the fused RetrievalResult
+
+        scope (a scopes.Scope) limits the Neo4j strategies, and documents
+        (the scope's document keys) the local ones; None searches everything.
+        """
+        return self._run(self.retrieve_async(query_text, scope, documents))
+
+    def retrieve_many(self, questions, concurrency=8, scope=None, documents=None):
+        """Retrieve for several questions, at most concurrency at a time; results keep their order"""
+        return self._run(self._retrieve_many(questions, concurrency, scope, documents))
+
+    async def _retrieve_many(self, questions, concurrency, scope, documents):
+        # Each question already runs several sessions at once; bound them so the pool isn't exhausted
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def retrieve(query_text):
+            async with semaphore:
+                return await self.retrieve_async(query_text, scope, documents)
+
+        return await asyncio.gather(*(retrieve(query_text) for query_text in questions))
+
+    async def retrieve_async(self, query_text, scope=None, documents=None):
+        start = time.perf_counter()
+        strategies = {
+            "exact": self._exact(query_text, scope),
+            "keywords": self._keywords(query_text, scope),
+        }
+        abbreviations = acronym_candidates(query_text)
+        if abbreviations:
+            strategies["acronym"] = self._acronym(abbreviations, scope)
+        for name, search in self.local_strategies.items():
+            strategies[name] = self._local(search, query_text, documents)
+
+        tasks = {asyncio.create_task(self._timed(name, coroutine)): name for name, coroutine in strategies.items()}
+        finished = []
+        confident = set()
+        pending = set(tasks)
+        deadline = start + self.deadline
+        while pending:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                finished.append(result)
+                confident.update(chunk["id"] for chunk in result.chunks if chunk.get("confident"))
+            if len(confident) >= self.k:
+                break
+
+        cancelled = [tasks[task] for task in pending]
+        for task in pending:
+            task.cancel()
+
+        chunks = self._fuse(finished)
+        if chunks and (self.neighbour_hops > 0 or any(chunk["text"] is None for chunk in chunks)):
+            fetch_start = time.perf_counter()
+            chunks = await self._fetch_chunks(chunks)
+            tracer.record("neo4j.fetch_chunks", time.perf_counter() - fetch_start)
+        return RetrievalResult(chunks, finished, cancelled, time.perf_counter() - start)
+
+    async def _timed(self, name, coroutine):
+        # Tasks interleave on the loop thread, so spans are recorded flat rather than nested
+        start = time.perf_counter()
+        try:
+            chunks = await coroutine
+            elapsed = time.perf_counter() - start
+            tracer.record(f"retrieval.{name}", elapsed)
+            return StrategyResult(name, chunks, elapsed)
+        except asyncio.CancelledError:
+            tracer.record(f"retrieval.{name}", time.perf_counter() - start, error="cancelled")
+            raise
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            tracer.record(f"retrieval.{name}", elapsed, error=type(e).__name__)
+            return StrategyResult(name, [], elapsed, str(e))
+
+    def _fuse(self, results):
+        """Reciprocal rank fusion of the strategies' ranked chunk lists"""
+        fused = {}
+        for result in results:
+            for rank, chunk in enumerate(result.chunks):
+                entry = fused.setdefault(chunk["id"], {"id": chunk["id"], "text": None, "score": 0.0})
+                entry["score"] += 1.0 / (self.rrf_k + rank + 1)
+                if entry["text"] is None and chunk.get("text") is not None:
+                    entry["text"] = chunk["text"]
+        return sorted(fused.values(), key=lambda chunk: chunk["score"], reverse=True)[:self.k]
+
+    async def _local(self, search, query_text, documents):
+        hits = await self._loop.run_in_executor(None, search, query_text, self.k, documents)
+        return [{"id": chunk_id, "score": score, "confident": False} for chunk_id, score in hits]
+
+    async def _exact(self, query_text, scope):
+        records = await self._search_chunks(f'"{escape_lucene(query_text)}"', query_text, self.k, scope)
+        return [dict(record, confident=True) for record in records]
+
+    async def _acronym(self, abbreviations, scope):
+        """Chunks defining the abbreviations, looked up through the Acronym nodes built at ingest"""
+        condition, parameters = scope_condition(scope, "c")
+        async with self._driver.session() as session:
+            result = await session.run(
+                f"""
+                UNWIND $abbreviations AS abbr
+                MATCH (:Acronym {{abbr: abbr}})-[r:DEFINED_IN]->(c:TextChunk)
+                WHERE {condition}
+                RETURN c.text AS text, c.id AS id, r.long_form AS long_form
+                LIMIT $limit
+                """,
+                abbreviations=abbreviations,
+                limit=self.k,
+                **parameters
+            )
+            records = [record async for record in result]
+        return [{"id": r["id"], "text": r["text"], "score": 1.0, "confident": True} for r in records]
+
+    async def _keywords(self, query_text, scope):
+        """Rank chunks by how many keywords they contain in a single round trip
+
+        Every full-text hit of every keyword is counted before the LIMIT, so
+        a chunk matching all keywords is never cut off by a common one.
+        """
+        keywords = extract_keywords(query_text)
+        if not keywords:
+            return []
+        node_condition, parameters = scope_condition(scope, "node")
+        chunk_condition, _ = scope_condition(scope, "c")
+        async with self._driver.session() as session:
+            try:
+                result = await session.run(
+                    f"""
+                    UNWIND $keywords AS keyword
+                    CALL db.index.fulltext.queryNodes($index_name, keyword.lucene)
+                    YIELD node, score
+                    WHERE {node_condition}
+                    WITH node, count(DISTINCT keyword.term) AS matches, sum(score) AS score
+                    RETURN node.text AS text, node.id AS id, matches, score
+                    ORDER BY matches DESC, score DESC
+                    LIMIT $limit
+                    """,
+                    keywords=[{"term": k, "lucene": scoped_lucene(escape_lucene(k), scope)} for k in keywords],
+                    index_name=FULLTEXT_INDEX_NAME,
+                    limit=self.k,
+                    **parameters
+                )
+                records = [record async for record in result]
+            except ClientError:
+                # Full-text index missing: scan chunks instead
+                result = await session.run(
+                    f"""
+                    MATCH (c:TextChunk)
+                    WHERE {chunk_condition}
+                    WITH c, toLower(c.text) AS text_lower
+                    UNWIND $keywords AS keyword
+                    WITH c, keyword
+                    WHERE text_lower CONTAINS keyword
+                    WITH c, count(DISTINCT keyword) AS matches
+                    RETURN c.text AS text, c.id AS id, matches, toFloat(matches) AS score
+                    ORDER BY matches DESC
+                    LIMIT $limit
+                    """,
+                    keywords=keywords,
+                    limit=self.k,
+                    **parameters
+                )
+                records = [record async for record in result]
+        return [
+            {"id": r["id"], "text": r["text"], "score": r["score"], "confident": r["matches"] == len(keywords)}
+            for r in records
+        ]
+
+    async def _search_chunks(self, lucene_query, term, limit, scope=None):
+        """Query the full-text index, falling back to a CONTAINS scan if it is missing"""
+        node_condition, parameters = scope_condition(scope, "node")
+        chunk_condition, _ = scope_condition(scope, "c")
+        async with self._driver.session() as session:
+            try:
+                # Lucene narrows to the scope's chunks; the property test makes it exact
+                result = await session.run(
+                    f"""
+                    CALL db.index.fulltext.queryNodes($index_name, $lucene_query)
+                    YIELD node, score
+                    WHERE {node_condition}
+                    RETURN node.text AS text, node.id AS id, score
+                    LIMIT $limit
+                    """,
+                    index_name=FULLTEXT_INDEX_NAME,
+                    lucene_query=scoped_lucene(lucene_query, scope),
+                    limit=limit,
+                    **parameters
+                )
+                return [dict(record) async for record in result]
+            except ClientError:
+                result = await session.run(
+                    f"""
+                    MATCH (c:TextChunk)
+                    WHERE {chunk_condition} AND toLower(c.text) CONTAINS toLower($term)
+                    RETURN c.text AS text, c.id AS id, 1.0 AS score
+                    LIMIT $limit
+                    """,
+                    term=term,
+                    limit=limit,
+                    **parameters
+                )
+                return [dict(record) async for record in result]
+
+    async def _fetch_chunks(self, chunks):
+        """Fetch the fused chunks' missing texts and their neighbours in one query"""
+        hits = [
+            {"list": 0, "rank": rank, "id": chunk["id"], "fetch": chunk["text"] is None}
+            for rank, chunk in enumerate(chunks)
+        ]
+        async with self._driver.session() as session:
+            result = await session.run(
+                neighbour_query(self.neighbour_hops), hits=hits, expand_top=self.expand_top
+            )
+            records = [record async for record in result]
+        texts = {chunk["id"]: chunk["text"] for chunk in chunks if chunk["text"] is not None}
+        [expanded] = rank_neighbours([[(chunk["id"], chunk["score"]) for chunk in chunks]], records, texts)
+        return [chunk for chunk in expanded if chunk["text"] is not None]
@@ -0,0 +1,186 @@
+"""Answer a file of questions without the Streamlit UI.
+
+Questions are read as JSON lines ({"id": ..., "question": ...}; the id
+defaults to the line number) and one JSON line per answer is appended to
+the output with the retrieved chunk ids, the prompt's estimated tokens and
+timings. Retrieval runs a batch of questions at a time over shared Neo4j
+queries, and answers are generated on a bounded worker pool under
+requests- and tokens-per-minute limits.
+
+The output file is the checkpoint: questions already answered there
+(status "generated" or "cached") are skipped, so an interrupted run picks
+up where it stopped and unanswered ones are tried again; the last line for
+an id wins. Connection settings come from the app's secrets file, and
+answers land in its [cache] path, so a nightly run pre-warms the app:
+
+    python batch_qa.py faq.jsonl answers.jsonl --workers 4 --rpm 60
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import logging
+import time
+
+from answer_cache import AnswerCache
+from feedback import LogFeedback
+from llm_scheduler import RequestScheduler
+from query_engine import Chatbot
+from scopes import Scope
+from settings import DEFAULT_SECRETS_PATH, headless_setup
+
+# Statuses that count as done when resuming
+ANSWERED = ("generated", "cached")
+
+logger = logging.getLogger("nbot.batch")
+
+
+def read_questions(path):
+    """(id, question) pairs from a JSON lines file, skipping blank and malformed lines"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                questions.append((str(item.get("id", number)), item["question"]))
+            except (ValueError, KeyError, AttributeError):
+                logger.warning("Skipping line %d of %s: not a JSON object with a question", number, path)
+    return questions
+
+
+def answered_ids(path):
+    """Ids already answered in an earlier run's output"""
+    done = set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut off by an interrupted run
+                    continue
+                if record.get("status") in ANSWERED:
+                    done.add(record["id"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def answer(chatbot, question_id, question, prepared, retrieval_seconds, submitted_at):
+    """Generate one answer on a worker thread and return its output record"""
+    reply, text_chunks, cache_key = prepared
+    start = time.perf_counter()
+    prompt_tokens = 0
+    if reply is not None:
+        text, status = reply, "cached" if cache_key is not None else "unanswered"
+    else:
+        text, generated, prompt_tokens = chatbot.generate_answer(question, text_chunks, cache_key)
+        status = "generated" if generated else "unanswered"
+    finished = time.perf_counter()
+    return {
+        "id": question_id,
+        "question": question,
+        "answer": text,
+        "status": status,
+        "chunk_ids": [chunk["id"] for chunk in text_chunks],
+        "prompt_tokens": prompt_tokens,
+        "timings": {
+            "retrieval": retrieval_seconds,
+            "queued": start - submitted_at,
+            "generation": finished - start,
+            "total": retrieval_seconds + finished - submitted_at,
+        },
+    }
+
+
+def run(chatbot, questions, output_path, workers=4, batch_size=32, scope=None):
+    """Answer (id, question) pairs within scope, appending records to output_path; returns a count per status"""
+    statuses = {}
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="batch-qa"
+    ) as pool:
+
+        def write(futures):
+            for future in futures:
+                record = future.result()
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+            # Every finished answer is on disk before more are started
+            output.flush()
+
+        pending = set()
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            retrieval_start = time.perf_counter()
+            prepared = chatbot.prepare_answers([question for _, question in batch], scope)
+            submitted_at = time.perf_counter()
+            # The batch shares its queries, so each question is charged an equal share
+            retrieval_seconds = (submitted_at - retrieval_start) / len(batch)
+            for (question_id, question), item in zip(batch, prepared):
+                pending.add(pool.submit(
+                    answer, chatbot, question_id, question, item, retrieval_seconds, submitted_at
+                ))
+            # Retrieve the next batch while this one is answered, without running further ahead
+            while len(pending) > batch_size:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+            logger.info("Retrieved %d of %d questions", min(start + batch_size, len(questions)), len(questions))
+        write(wait(pending).done)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="questions as JSON lines")
+    parser.add_argument("output", help="JSON lines answers, appended to and used to resume")
+    parser.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="the app's secrets.toml")
+    parser.add_argument("--mode", default="bm25", choices=("bm25", "vector", "graph", "hybrid"),
+                        help="retrieval mode; match the app's so the cached answers are found")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent Gemini requests")
+    parser.add_argument("--rpm", type=float, default=60.0, help="Gemini requests per minute")
+    parser.add_argument("--tpm", type=float, help="Gemini prompt tokens per minute (default: unlimited)")
+    parser.add_argument("--batch-size", type=int, default=32, help="questions retrieved together")
+    parser.add_argument("--collection", help="only search this collection")
+    parser.add_argument("--document", help="only search the document with this hash")
+    parser.add_argument("--cache-path", help="answer cache SQLite file (default: the secrets' [cache] path)")
+    args = parser.parse_args()
+    secrets, neo4j = headless_setup(args.secrets)
+
+    scope = None
+    if args.document:
+        scope = Scope("document", args.document)
+    elif args.collection:
+        scope = Scope("collection", args.collection)
+
+    done = answered_ids(args.output)
+    questions = [(question_id, question) for question_id, question in read_questions(args.input)
+                 if question_id not in done]
+    logger.info("%d questions to answer, %d already answered", len(questions), len(done))
+    if not questions:
+        return
+
+    chatbot = Chatbot(
+        **neo4j,
+        retrieval_mode=args.mode,
+        answer_cache=AnswerCache(path=args.cache_path or secrets.get("cache", {}).get("path")),
+        api_key=secrets["gemini"]["api_key"],
+        feedback=LogFeedback(logger),
+        scheduler=RequestScheduler(rpm=args.rpm, tpm=args.tpm)
+    )
+    start = time.perf_counter()
+    try:
+        statuses = run(
+            chatbot, questions, args.output, workers=args.workers, batch_size=args.batch_size, scope=scope
+        )
+    finally:
+        chatbot.close()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Answered %d questions in %.1fs (%.2f/s): %s", len(questions), elapsed, len(questions) / elapsed,
+        ", ".join(f"{count} {status}" for status, count in sorted(statuses.items()))
+    )
+
+
+if __name__ == "__main__":
+    main()
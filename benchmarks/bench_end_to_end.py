@@ -0,0 +1,238 @@
+"""End-to-end ingest and question benchmark against local stand-ins.
+
+Generates a synthetic PDF corpus, ingests it with DocumentProcessor and
+asks Chatbot questions in every retrieval mode. Neo4j is an in-memory fake
+unless --neo4j-uri points at a local instance; Gemini is always a fake with
+configurable latency and failure rate. Run from the repository root:
+
+    python -m benchmarks.bench_end_to_end --documents 4 --size-mb 1 --questions 50
+    python -m benchmarks.bench_end_to_end --output after.json --baseline before.json
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import subprocess
+import time
+from unittest import mock
+
+import async_retrieval
+import document_processor
+import query_engine
+from answer_cache import AnswerCache
+from benchmarks.fakes import FakeAsyncGraphDatabase, FakeDriver, FakeGenerativeModel, FakeNeo4jStore
+from benchmarks.synthetic_pdf import SentenceSource, make_corpus
+from document_processor import DocumentProcessor
+from neo4j_connection import CorpusStats
+from pdf_extraction import PdfTextExtractor
+from query_engine import Chatbot
+from tracing import percentile, set_verbosity, tracer
+
+RETRIEVAL_MODES = ("bm25", "vector", "graph", "hybrid")
+
+
+class UploadedPdf(io.BytesIO):
+    """The parts of Streamlit's UploadedFile that DocumentProcessor uses"""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def fake_services(store, model):
+    """Patch the app modules to use the fake Neo4j store (if given) and the fake Gemini model"""
+    stack = contextlib.ExitStack()
+    stack.enter_context(mock.patch.object(query_engine.genai, "GenerativeModel", lambda **kwargs: model))
+    if store is not None:
+        connect = lambda *args, **kwargs: FakeDriver(store)
+        stack.enter_context(mock.patch.object(document_processor, "get_driver", connect))
+        stack.enter_context(mock.patch.object(query_engine, "get_driver", connect))
+        stack.enter_context(mock.patch.object(async_retrieval, "AsyncGraphDatabase", FakeAsyncGraphDatabase(store)))
+    return stack
+
+
+def latency_summary(durations):
+    values = sorted(durations)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else 0.0,
+    }
+
+
+def run_ingest(processor, corpus_stats, corpus):
+    """Ingest every document once, returning throughput figures"""
+    before = corpus_stats.snapshot()["chunks"]
+    total_bytes = sum(len(data) for _, data in corpus)
+    failed = 0
+    start = time.perf_counter()
+    for name, data in corpus:
+        if not processor.process_pdf(UploadedPdf(name, data)):
+            failed += 1
+    elapsed = time.perf_counter() - start
+    chunks = corpus_stats.snapshot()["chunks"] - before
+    return {
+        "documents": len(corpus),
+        "failed": failed,
+        "megabytes": total_bytes / 1e6,
+        "chunks": chunks,
+        "seconds": elapsed,
+        "mb_per_second": total_bytes / 1e6 / elapsed,
+        "chunks_per_second": chunks / elapsed,
+    }
+
+
+def run_questions(chatbot, questions):
+    """Time retrieval alone and full answers for every question"""
+    retrieval = []
+    answers = []
+    for question in questions:
+        start = time.perf_counter()
+        chatbot._prepare_answer(question)
+        retrieval.append(time.perf_counter() - start)
+    before = tracer.counters()
+    for question in questions:
+        start = time.perf_counter()
+        chatbot.chat(question)
+        answers.append(time.perf_counter() - start)
+    after = tracer.counters()
+
+    def added(name):
+        key = (name, ())
+        return after.get(key, 0) - before.get(key, 0)
+
+    prompts = added("llm_prompts_total")
+    return {
+        "retrieval": latency_summary(retrieval),
+        "answer": latency_summary(answers),
+        "prompt_tokens": added("llm_prompt_tokens_total") / prompts if prompts else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    def change(value, path):
+        if baseline is None:
+            return ""
+        previous = baseline
+        for key in path:
+            previous = previous.get(key, {}) if isinstance(previous, dict) else {}
+        if not isinstance(previous, (int, float)) or not previous:
+            return ""
+        return f" ({(value - previous) / previous:+.0%})"
+
+    ingest = results["ingest"]
+    print(f"\nIngest: {ingest['documents']} documents, {ingest['megabytes']:.1f} MB, "
+          f"{ingest['chunks']} chunks in {ingest['seconds']:.2f}s")
+    print(f"  {ingest['mb_per_second']:.2f} MB/s{change(ingest['mb_per_second'], ('ingest', 'mb_per_second'))}, "
+          f"{ingest['chunks_per_second']:.0f} chunks/s{change(ingest['chunks_per_second'], ('ingest', 'chunks_per_second'))}")
+
+    print(f"\n{'mode':<8} {'retrieval p50':>16} {'retrieval p99':>16} {'answer p50':>16} {'answer p99':>16} "
+          f"{'prompt tokens':>16}")
+    for mode, stats in results["chat"].items():
+        cells = []
+        for stage in ("retrieval", "answer"):
+            for q in ("p50", "p99"):
+                value = stats[stage][q]
+                cells.append(f"{value * 1000:.1f}ms{change(value, ('chat', mode, stage, q))}".rjust(16))
+        tokens = stats["prompt_tokens"]
+        cells.append(f"{tokens:.0f}{change(tokens, ('chat', mode, 'prompt_tokens'))}".rjust(16))
+        print(f"{mode:<8} {' '.join(cells)}")
+    gemini = results["gemini"]
+    print(f"\nGemini calls: {gemini['calls']} ({gemini['failures']} simulated failures)")
+    if results.get("neo4j_statements") is not None:
+        print(f"Neo4j statements: {results['neo4j_statements']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=4, help="number of synthetic PDFs")
+    parser.add_argument("--size-mb", type=float, default=1.0, help="approximate size of each PDF")
+    parser.add_argument("--questions", type=int, default=50, help="questions asked per retrieval mode")
+    parser.add_argument("--modes", default=",".join(RETRIEVAL_MODES), help="comma-separated retrieval modes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--extract-workers", type=int, default=None, help="PDF extraction processes")
+    parser.add_argument("--neo4j-latency", type=float, default=0.0, help="simulated seconds per fake Neo4j statement")
+    parser.add_argument("--neo4j-uri", help="benchmark a local Neo4j instead of the in-memory fake")
+    parser.add_argument("--neo4j-user", default="neo4j")
+    parser.add_argument("--neo4j-password", default="neo4j")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="fake Gemini seconds before answering")
+    parser.add_argument("--gemini-jitter", type=float, default=0.1, help="extra random fake Gemini latency")
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="share of fake Gemini calls that fail")
+    parser.add_argument("--gemini-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    set_verbosity("quiet")
+    # Streamlit calls outside `streamlit run` only log warnings about the missing script context
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    store = None if args.neo4j_uri else FakeNeo4jStore(latency=args.neo4j_latency)
+    uri = args.neo4j_uri or "bolt://fake:7687"
+    model = FakeGenerativeModel(
+        latency=args.gemini_latency, jitter=args.gemini_jitter, failure_rate=args.gemini_failure_rate,
+        tokens_per_second=args.gemini_tokens_per_second, seed=args.seed
+    )
+
+    corpus = make_corpus(args.documents, int(args.size_mb * 1e6), seed=args.seed)
+    sentences = SentenceSource(args.seed + 1)
+    questions = [sentences.question() for _ in range(args.questions)]
+    print(f"Corpus: {len(corpus)} PDFs, {sum(len(data) for _, data in corpus) / 1e6:.1f} MB; "
+          f"Neo4j: {'fake' if store else uri}")
+
+    results = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "params": vars(args), "chat": {}}
+    with fake_services(store, model):
+        processor = DocumentProcessor(
+            uri, args.neo4j_user, args.neo4j_password,
+            extractor=PdfTextExtractor(max_workers=args.extract_workers)
+        )
+        processor.corpus_stats = CorpusStats(processor.driver)
+        results["ingest"] = run_ingest(processor, processor.corpus_stats, corpus)
+
+        for mode in args.modes.split(","):
+            # A cache that never keeps anything, so every question pays for retrieval and generation
+            chatbot = Chatbot(
+                uri, args.neo4j_user, args.neo4j_password,
+                retrieval_mode=mode, answer_cache=AnswerCache(max_entries=0)
+            )
+            try:
+                results["chat"][mode] = run_questions(chatbot, questions)
+            finally:
+                chatbot.close()
+
+        if store is None:
+            # Leave a real database as it was found
+            for _, data in corpus:
+                processor.delete_document(hashlib.sha256(data).hexdigest())
+
+    results["gemini"] = {"calls": model.calls, "failures": model.failures}
+    results["neo4j_statements"] = store.statements if store else None
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Baseline: commit {baseline.get('commit')} from {baseline.get('timestamp')}")
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Micro-benchmark for text normalisation and chunking.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_text_chunking --size-mb 8
+"""
+import argparse
+import random
+import re
+import time
+
+from text_chunking import chunk_spans, iter_chunks, normalize_text
+
+WORDS = (
+    "driver education vehicle safety license permit instructor lesson road signal "
+    "lane speed limit parking brake mirror intersection pedestrian highway exam"
+).split()
+
+
+def synthetic_text(size_bytes, seed=0):
+    """PDF-like text: short lines, sentences, stray double spaces and control characters"""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size_bytes:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize() + ". "
+        if rng.random() < 0.2:
+            sentence += "\n"
+        if rng.random() < 0.05:
+            sentence += "  \x0c\n\n"
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)
+
+
+def legacy_clean_text(text):
+    """The regex + per-character generator cleaner this engine replaced, for comparison"""
+    text = re.sub(r'\n+', '\n', text)
+    text = re.sub(r' +', ' ', text)
+    return ''.join(c for c in text if c.isprintable() or c == '\n')
+
+
+def measure(label, func, size_bytes, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {best * 1000:9.1f} ms  {size_bytes / best / 1e6:8.1f} MB/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=8.0, help="size of the synthetic text")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, best is reported")
+    parser.add_argument("--page-chars", type=int, default=3000, help="piece size for the streaming chunker")
+    args = parser.parse_args()
+
+    text = synthetic_text(int(args.size_mb * 1e6))
+    size = len(text.encode("utf-8"))
+    print(f"Synthetic text: {size / 1e6:.1f} MB")
+
+    measure("legacy clean", lambda: legacy_clean_text(text), size, args.repeat)
+    cleaned = measure("normalize_text", lambda: normalize_text(text), size, args.repeat)
+    spans = measure("chunk_spans", lambda: list(chunk_spans(cleaned)), size, args.repeat)
+
+    pages = [cleaned[i:i + args.page_chars] for i in range(0, len(cleaned), args.page_chars)]
+    measure("iter_chunks (streaming)", lambda: sum(1 for _ in iter_chunks(pages)), size, args.repeat)
+    print(f"{len(spans)} chunks")
+
+
+if __name__ == "__main__":
+    main()
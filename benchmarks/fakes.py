@@ -0,0 +1,599 @@
+"""In-process stand-ins for Neo4j and Gemini used by the benchmarks.
+
+FakeNeo4jStore implements exactly the Cypher statements the app sends, in
+memory: each statement is routed by a marker that identifies its shape, and
+an unknown statement raises, so the fake can't silently drift from the real
+queries. Full-text queries are served from a BM25Index, so the CONTAINS
+scans the app falls back to without a full-text index are never needed.
+Drivers, sessions
+and transactions only implement the parts of the neo4j driver API the app
+uses, in sync and async flavours over the same store.
+
+FakeGenerativeModel mimics google.generativeai.GenerativeModel with a
+configurable latency, streaming speed and failure rate.
+"""
+import asyncio
+import random
+import re
+import threading
+import time
+
+from search_index import BM25Index
+
+LUCENE_ESCAPE = re.compile(r"\\(.)")
+
+NEXT_HOPS = re.compile(r"NEXT\*0\.\.(\d+)")
+
+# Scoped statements inline the property they filter on (see scopes.scope_condition)
+SCOPE_FILTER = re.compile(r"\.(document) = \$scope_value|\$scope_value IN \w+\.(collections)")
+
+# Full-text queries target the text field, optionally narrowed to a scope (see async_retrieval.scoped_lucene)
+SCOPED_LUCENE = re.compile(r'^text:\((.*)\)(?: AND (?:document|collections):".*")?$', re.S)
+
+
+class FakeResult:
+    """A finished query result: iterable records with single()"""
+
+    def __init__(self, records):
+        self._records = list(records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        for record in self._records:
+            yield record
+
+    def single(self):
+        return self._records[0] if self._records else None
+
+
+class FakeNeo4jStore:
+    """Documents, chunks and a full-text index held in memory"""
+
+    def __init__(self, latency=0.0):
+        # Simulated round-trip time added to every statement
+        self.latency = latency
+        self.statements = 0
+        self._lock = threading.RLock()
+        self.documents = {}         # hash -> {"name", "size", "collections", "complete", "ingested_at"}
+        # id -> {"id", "text", "embedding", "offset", "content_hash", "document", "collections", "next",
+        # "previous"}, where next/previous are the neighbouring chunk dicts along NEXT relationships
+        self.chunks = {}
+        self.fulltext = BM25Index()
+        self.acronyms = {}          # abbr -> {chunk id: long form}
+        self._routes = [
+            # Snapshot export and restore; some of these contain shorter markers further down
+            ("toString(d.ingested_at) AS ingested_at", self._export_documents),
+            ("RETURN d.hash AS document, c.offset AS offset", self._export_chunks),
+            ("RETURN c.id AS chunk_id, a.abbr AS abbr, r.long_form AS long_form", self._export_definitions),
+            ("RETURN d.hash AS hash, coalesce(d.complete, false) AS complete", self._stored_documents),
+            ("UNWIND $documents AS document MERGE", self._restore_documents),
+            ("UNWIND $documents AS document MATCH", self._mark_restored),
+            ("MATCH (d:Document {hash: row.document})", self._restore_chunks),
+            ("UNWIND $links AS link", self._link_pairs),
+            ("RETURN d.hash AS hash, d.name AS name, d.collections AS collections", self._list_documents),
+            ("MATCH (d:Document) WHERE d.complete RETURN d.hash AS hash", self._complete_documents),
+            ("CREATE CONSTRAINT", self._schema),
+            ("CREATE INDEX", self._schema),
+            ("CREATE FULLTEXT INDEX", self._schema),
+            ("DROP INDEX", self._schema),
+            ("MATCH (d:Document) WHERE d.collections IS NULL", self._default_collections),
+            ("RETURN count(DISTINCT d) AS added", self._add_to_collection),
+            ("WHERE name <> $collection] AS remaining", self._remaining_collections),
+            ("SET d.collections = $collections", self._set_collections),
+            ("WHERE $collection IN d.collections RETURN d.hash AS hash", self._collection_documents),
+            ("WHERE NOT (:Document)-[:HAS_CHUNK]->(c) RETURN count(c) AS count", self._count_unowned_chunks),
+            ("OPTIONAL MATCH (existing:Document {hash: $hash})", self._create_legacy_document),
+            ("MERGE (d)-[:HAS_CHUNK]->(c)", self._adopt_unowned_chunks),
+            ("SET c.document = d.hash, c.collections = d.collections", self._schema),
+            ("LIMIT $batch_size DETACH DELETE c", self._delete_chunk_batch),
+            ("DETACH DELETE d RETURN complete", self._delete_document),
+            ("MATCH (d:Document {hash: $hash}) RETURN coalesce(d.complete, false)", self._document_status),
+            ("MERGE (d:Document {hash: $hash})", self._create_document),
+            ("SET d.complete = true", self._mark_complete),
+            ("MATCH (d:Document {name: $name})", self._previous_version),
+            ("RETURN c.id AS id, c.content_hash AS content_hash", self._document_chunks),
+            ("MATCH (:Document {hash: $previous_hash})-[:HAS_CHUNK]->(old:TextChunk", self._copy_chunks),
+            ("CREATE (d)-[:HAS_CHUNK]->(c:TextChunk", self._create_chunks),
+            ("WHERE d.complete RETURN c.id AS id, c.text AS text, c.embedding AS embedding", self._complete_chunks),
+            ("MERGE (a)-[:NEXT]->(b)", self._link_chunks),
+            ("UNWIND $hits AS h MATCH (hit:TextChunk {id: h.id})", self._chunks_for_hits),
+            ("UNWIND $hits AS h MATCH (c:TextChunk {id: h.id})", self._chunks_for_hits),
+            ("RETURN c.text AS text, c.id AS id LIMIT $limit", self._sample_chunks),
+            ("MATCH (d:Document) WHERE d.complete OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:TextChunk)",
+             self._count_documents),
+            ("MERGE (a:Acronym {abbr: definition.abbr})", self._define_acronyms),
+            ("MATCH (:Acronym {abbr: abbr})-[r:DEFINED_IN]->(c:TextChunk)", self._acronym_definitions),
+            ("MATCH (:Acronym {abbr: lookup.abbr})-[:DEFINED_IN]->(c:TextChunk)", self._acronym_lookups),
+            ("MATCH (a:Acronym) WHERE NOT (a)-[:DEFINED_IN]->() DELETE a", self._drop_unused_acronyms),
+            ("UNWIND $keywords AS keyword CALL db.index.fulltext.queryNodes", self._fulltext_keywords),
+            ("CALL db.index.fulltext.queryNodes($index_name, $lucene_query)", self._fulltext_query),
+        ]
+
+    def run(self, query, parameters):
+        """Execute one statement and return its records"""
+        shape = " ".join(query.split())
+        for marker, handler in self._routes:
+            if marker in shape:
+                if self.latency:
+                    time.sleep(self.latency)
+                hops = NEXT_HOPS.search(shape)
+                if handler == self._chunks_for_hits and hops:
+                    # The hop count is inlined in the query text
+                    parameters = dict(parameters, hops=int(hops.group(1)))
+                if "scope_value" in parameters:
+                    # So is the property a scoped statement filters on
+                    parameters = dict(parameters)
+                    match = SCOPE_FILTER.search(shape)
+                    parameters["scope"] = (match.group(1) or match.group(2), parameters.pop("scope_value"))
+                with self._lock:
+                    self.statements += 1
+                    return FakeResult(handler(**parameters))
+        raise NotImplementedError(f"Fake Neo4j has no handler for: {shape[:120]}")
+
+    # Schema and documents
+
+    def _schema(self):
+        return []
+
+    def _document_status(self, hash):
+        document = self.documents.get(hash)
+        return [] if document is None else [{"complete": document["complete"]}]
+
+    def _create_document(self, hash, name, size, collection):
+        document = self.documents.setdefault(hash, {"ingested_at": None})
+        document.update(name=name, size=size, collections=[collection], complete=False)
+        return []
+
+    def _default_collections(self, collection):
+        for document in self.documents.values():
+            document.setdefault("collections", [collection])
+        return []
+
+    def _add_to_collection(self, hash, collection):
+        document = self.documents.get(hash)
+        if document is None or collection in document["collections"]:
+            return [{"added": 0}]
+        self._set_collections(hash, document["collections"] + [collection])
+        return [{"added": 1}]
+
+    def _remaining_collections(self, hash, collection):
+        document = self.documents.get(hash)
+        if document is None:
+            return []
+        return [{"remaining": [name for name in document["collections"] if name != collection]}]
+
+    def _set_collections(self, hash, collections):
+        if hash in self.documents:
+            self.documents[hash]["collections"] = list(collections)
+            for chunk in self.chunks.values():
+                if chunk["document"] == hash:
+                    chunk["collections"] = list(collections)
+        return []
+
+    def _list_documents(self):
+        complete = [(doc_hash, document) for doc_hash, document in self.documents.items() if document["complete"]]
+        return [
+            {"hash": doc_hash, "name": document["name"], "collections": list(document["collections"])}
+            for doc_hash, document in sorted(complete, key=lambda item: item[1]["name"])
+        ]
+
+    def _collection_documents(self, collection):
+        return [{"hash": doc_hash} for doc_hash, document in self.documents.items()
+                if collection in document["collections"]]
+
+    def _in_scope(self, chunk_id, scope):
+        if scope is None:
+            return True
+        kind, value = scope
+        if kind == "collections":
+            return value in self.chunks[chunk_id]["collections"]
+        return self.chunks[chunk_id][kind] == value
+
+    def _mark_complete(self, hash):
+        if hash in self.documents:
+            self.documents[hash].update(complete=True, ingested_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        return []
+
+    def _previous_version(self, name, collection, hash):
+        return [
+            {"hash": doc_hash} for doc_hash, document in self.documents.items()
+            if document["name"] == name and document["complete"] and collection in document["collections"]
+            and doc_hash != hash
+        ][:1]
+
+    def _delete_document(self, hash):
+        document = self.documents.pop(hash, None)
+        for chunk in list(self.chunks.values()):
+            if chunk["document"] == hash:
+                chunk["document"] = None
+        return [] if document is None else [{"complete": document["complete"]}]
+
+    # Chunks
+
+    def _document_chunks(self, hash):
+        return [
+            {"id": chunk["id"], "content_hash": chunk["content_hash"]}
+            for chunk in self.chunks.values() if chunk["document"] == hash
+        ]
+
+    def _delete_chunk_batch(self, hash, batch_size):
+        ids = [chunk_id for chunk_id, chunk in self.chunks.items() if chunk["document"] == hash][:batch_size]
+        self._delete_chunks_by_id(ids)
+        return [{"ids": ids}]
+
+    def _count_unowned_chunks(self):
+        return [{"count": sum(1 for chunk in self.chunks.values() if chunk["document"] not in self.documents)}]
+
+    def _create_legacy_document(self, hash, name, collection):
+        created = hash not in self.documents
+        if created:
+            self.documents[hash] = {
+                "name": name, "size": 0, "collections": [collection], "complete": True,
+                "ingested_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+        return [{"created": created}]
+
+    def _adopt_unowned_chunks(self, hash):
+        for chunk in self.chunks.values():
+            if chunk["document"] not in self.documents:
+                chunk.update(document=hash, collections=list(self.documents[hash]["collections"]))
+                if chunk.get("offset") is None:
+                    chunk["offset"] = int(chunk["id"].rpartition("-")[2])
+        return []
+
+    def _delete_chunks_by_id(self, ids):
+        ids = [chunk_id for chunk_id in ids if chunk_id in self.chunks]
+        for chunk_id in ids:
+            for definitions in self.acronyms.values():
+                definitions.pop(chunk_id, None)
+            self._unlink(self.chunks.pop(chunk_id))
+        self.fulltext.remove_chunks(ids)
+        return []
+
+    def _copy_chunks(self, hash, previous_hash, rows):
+        copies = []
+        for row in rows:
+            old = self.chunks.get(row["old_id"])
+            if old is None or old["document"] != previous_hash:
+                continue
+            copies.append(dict(old, id=row["id"], offset=row["offset"]))
+        self._create_chunks(hash, copies)
+        for definitions in self.acronyms.values():
+            for row in rows:
+                if row["old_id"] in definitions and row["id"] in self.chunks:
+                    definitions[row["id"]] = definitions[row["old_id"]]
+        return []
+
+    def _create_chunks(self, hash, rows):
+        if hash not in self.documents:
+            return []
+        for row in rows:
+            if row["id"] in self.chunks:
+                raise ValueError(f"TextChunk {row['id']} already exists (textChunkId constraint)")
+        new_chunks = [
+            {
+                "id": row["id"], "text": row["text"], "embedding": row["embedding"],
+                "offset": row["offset"], "content_hash": row["content_hash"], "document": hash,
+                "collections": list(self.documents[hash]["collections"]),
+            }
+            for row in rows
+        ]
+        for chunk in new_chunks:
+            self.chunks[chunk["id"]] = chunk
+        self.fulltext.add_chunks(new_chunks)
+        return []
+
+    @staticmethod
+    def _unlink(chunk):
+        """Delete a chunk's NEXT relationships"""
+        for direction, opposite in (("next", "previous"), ("previous", "next")):
+            neighbour = chunk.get(direction)
+            if neighbour is not None and neighbour.get(opposite) is chunk:
+                neighbour[opposite] = None
+            chunk[direction] = None
+
+    def _link_chunks(self, ids):
+        for a, b in zip(ids, ids[1:]):
+            if a in self.chunks and b in self.chunks:
+                self.chunks[a]["next"] = self.chunks[b]
+                self.chunks[b]["previous"] = self.chunks[a]
+        return []
+
+    def _chunks_for_hits(self, hits, expand_top, hops=0):
+        records = []
+        for h in hits:
+            hit = self.chunks.get(h["id"])
+            if hit is None:
+                continue
+            n, rank = h["list"], h["rank"]
+            text = hit["text"] if h["fetch"] else None
+            records.append({"list": n, "rank": rank, "id": hit["id"], "text": text, "distance": 0})
+            if rank >= expand_top:
+                continue
+            for direction in ("next", "previous"):
+                neighbour = hit
+                for distance in range(1, hops + 1):
+                    neighbour = neighbour.get(direction)
+                    if neighbour is None:
+                        break
+                    records.append({
+                        "list": n, "rank": rank, "id": neighbour["id"], "text": neighbour["text"],
+                        "distance": distance
+                    })
+        return records
+
+    def _complete_chunks(self):
+        return [
+            {"id": chunk["id"], "text": chunk["text"], "embedding": chunk["embedding"]}
+            for chunk in self.chunks.values()
+            if chunk["document"] in self.documents and self.documents[chunk["document"]]["complete"]
+        ]
+
+    def _sample_chunks(self, limit, scope=None):
+        return [
+            {"text": chunk["text"], "id": chunk["id"]}
+            for chunk in self.chunks.values() if self._in_scope(chunk["id"], scope)
+        ][:limit]
+
+    def _define_acronyms(self, definitions):
+        for definition in definitions:
+            if definition["chunk_id"] in self.chunks:
+                self.acronyms.setdefault(definition["abbr"], {})[definition["chunk_id"]] = definition["long_form"]
+        return []
+
+    def _acronym_definitions(self, abbreviations, limit, scope=None):
+        return [
+            {"text": self.chunks[chunk_id]["text"], "id": chunk_id, "long_form": long_form}
+            for abbr in abbreviations
+            for chunk_id, long_form in self.acronyms.get(abbr, {}).items()
+            if self._in_scope(chunk_id, scope)
+        ][:limit]
+
+    def _acronym_lookups(self, lookups, scope=None):
+        return [
+            {"list": lookup["list"], "id": chunk_id}
+            for lookup in lookups
+            for chunk_id in self.acronyms.get(lookup["abbr"], {})
+            if self._in_scope(chunk_id, scope)
+        ]
+
+    def _drop_unused_acronyms(self):
+        for abbr in [abbr for abbr, definitions in self.acronyms.items() if not definitions]:
+            del self.acronyms[abbr]
+        return []
+
+    # Snapshots
+
+    def _export_documents(self):
+        return [
+            {"hash": doc_hash, "name": document["name"], "size": document["size"],
+             "collections": list(document["collections"]), "ingested_at": document["ingested_at"]}
+            for doc_hash, document in self.documents.items() if document["complete"]
+        ]
+
+    def _export_chunks(self):
+        chunks = [chunk for chunk in self.chunks.values()
+                  if chunk["document"] in self.documents and self.documents[chunk["document"]]["complete"]]
+        return [
+            {"document": chunk["document"], "offset": chunk["offset"], "text": chunk["text"],
+             "embedding": chunk["embedding"]}
+            for chunk in sorted(chunks, key=lambda chunk: (chunk["document"], chunk["offset"]))
+        ]
+
+    def _export_definitions(self):
+        return [
+            {"chunk_id": chunk_id, "abbr": abbr, "long_form": long_form}
+            for abbr, definitions in self.acronyms.items()
+            for chunk_id, long_form in definitions.items()
+            if self.documents.get(self.chunks[chunk_id]["document"], {}).get("complete")
+        ]
+
+    def _stored_documents(self, hashes):
+        return [{"hash": doc_hash, "complete": self.documents[doc_hash]["complete"]}
+                for doc_hash in hashes if doc_hash in self.documents]
+
+    def _restore_documents(self, documents):
+        for document in documents:
+            self._create_document(document["hash"], document["name"], document["size"], None)
+            self.documents[document["hash"]]["collections"] = list(document["collections"])
+        return []
+
+    def _restore_chunks(self, rows):
+        by_document = {}
+        for row in rows:
+            by_document.setdefault(row["document"], []).append(row)
+        for doc_hash, document_rows in by_document.items():
+            self._create_chunks(doc_hash, document_rows)
+        return []
+
+    def _link_pairs(self, links):
+        for link in links:
+            self._link_chunks([link["source"], link["target"]])
+        return []
+
+    def _mark_restored(self, documents):
+        for document in documents:
+            if document["hash"] in self.documents:
+                self.documents[document["hash"]].update(
+                    complete=True, ingested_at=document["ingested_at"] or time.strftime("%Y-%m-%dT%H:%M:%S")
+                )
+        return []
+
+    def _complete_documents(self):
+        return [{"hash": doc_hash} for doc_hash, document in self.documents.items() if document["complete"]]
+
+    def _count_documents(self):
+        complete = {doc_hash for doc_hash, document in self.documents.items() if document["complete"]}
+        chunks = sum(1 for chunk in self.chunks.values() if chunk["document"] in complete)
+        last = max((self.documents[doc_hash]["ingested_at"] for doc_hash in complete
+                    if self.documents[doc_hash]["ingested_at"]), default=None)
+        return [{"documents": len(complete), "chunks": chunks, "last_ingest": last}]
+
+    # Full-text index
+
+    def _search(self, lucene_query, limit, scope=None):
+        """Approximate Lucene: BM25 over the terms, phrase queries must also match verbatim"""
+        text = LUCENE_ESCAPE.sub(r"\1", SCOPED_LUCENE.match(lucene_query).group(1))
+        phrase = None
+        if len(text) > 1 and text.startswith('"') and text.endswith('"'):
+            phrase = text[1:-1].lower()
+        documents = None
+        if scope is not None:
+            documents = {chunk_id.rpartition("-")[0] for chunk_id in self.chunks if self._in_scope(chunk_id, scope)}
+        hits = self.fulltext.search(text, k=limit if phrase is None else max(limit * 20, 100), documents=documents)
+        if phrase is not None:
+            hits = [(chunk_id, score) for chunk_id, score in hits if phrase in self.chunks[chunk_id]["text"].lower()]
+        return hits[:limit]
+
+    def _fulltext_query(self, index_name, lucene_query, limit, scope=None):
+        return [
+            {"text": self.chunks[chunk_id]["text"], "id": chunk_id, "score": score}
+            for chunk_id, score in self._search(lucene_query, limit, scope)
+        ]
+
+    def _fulltext_keywords(self, keywords, index_name, limit, scope=None):
+        matches = {}
+        scores = {}
+        for keyword in keywords:
+            for chunk_id, score in self._search(keyword["lucene"], len(self.chunks), scope):
+                matches[chunk_id] = matches.get(chunk_id, 0) + 1
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+        ranked = sorted(matches, key=lambda chunk_id: (matches[chunk_id], scores[chunk_id]), reverse=True)
+        return [
+            {"text": self.chunks[chunk_id]["text"], "id": chunk_id,
+             "matches": matches[chunk_id], "score": scores[chunk_id]}
+            for chunk_id in ranked[:limit]
+        ]
+
+
+class FakeTransaction:
+    def __init__(self, store):
+        self._store = store
+
+    def run(self, query, parameters=None, **kwargs):
+        return self._store.run(query, dict(parameters or {}, **kwargs))
+
+
+class FakeSession(FakeTransaction):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(FakeTransaction(self._store), *args, **kwargs)
+
+    execute_read = execute_write
+
+    def close(self):
+        pass
+
+
+class FakeDriver:
+    """Stands in for neo4j.Driver"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def session(self, **kwargs):
+        return FakeSession(self.store)
+
+    def close(self):
+        pass
+
+
+class FakeAsyncSession:
+    def __init__(self, store):
+        self._store = store
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def run(self, query, parameters=None, **kwargs):
+        # Run off the event loop so simulated latency overlaps like real network waits
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._store.run, query, dict(parameters or {}, **kwargs)
+        )
+
+
+class FakeAsyncDriver:
+    """Stands in for neo4j.AsyncDriver"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def session(self, **kwargs):
+        return FakeAsyncSession(self.store)
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncGraphDatabase:
+    """Stands in for neo4j.AsyncGraphDatabase, handing out drivers over one store"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def driver(self, uri, auth=None, **settings):
+        return FakeAsyncDriver(self.store)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel
+
+    Each call waits latency seconds (plus up to jitter more), then fails
+    with probability failure_rate or answers with a canned reply streamed
+    at tokens_per_second.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.2, failure_rate=0.0, tokens_per_second=200.0,
+                 answer_tokens=80, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _start_call(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.random() * self.jitter
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("503 Service Unavailable (simulated)")
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        self._start_call()
+        words = ["answer"] * self.answer_tokens
+        if not stream:
+            time.sleep(len(words) / self.tokens_per_second)
+            return FakeResponse(" ".join(words))
+        return self._stream(words)
+
+    def _stream(self, words, words_per_piece=8):
+        for i in range(0, len(words), words_per_piece):
+            piece = words[i:i + words_per_piece]
+            time.sleep(len(piece) / self.tokens_per_second)
+            yield FakeResponse(" ".join(piece) + " ")
@@ -0,0 +1,121 @@
+"""Synthetic PDF corpora for the benchmarks.
+
+PDFs are written by hand (one Helvetica text stream per page), so no PDF
+library is needed to produce them and the same seed always gives the same
+bytes.
+"""
+import io
+import random
+
+from benchmarks.bench_text_chunking import WORDS
+
+# Extra vocabulary drawn with Zipf-like frequencies, so some terms are rare
+# enough for retrieval to tell chunks apart
+VOCABULARY_SIZE = 5000
+
+LINE_CHARS = 90
+LINES_PER_PAGE = 55
+
+
+def vocabulary(seed=0):
+    """Common words followed by pronounceable pseudo-words, most frequent first"""
+    rng = random.Random(seed)
+    consonants, vowels = "bcdfghklmnprstvz", "aeiou"
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < len(WORDS) + VOCABULARY_SIZE:
+        word = "".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class SentenceSource:
+    """Random sentences over the benchmark vocabulary"""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.words = vocabulary(seed)
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.words))]
+
+    def sentence(self):
+        words = self.rng.choices(self.words, self.weights, k=self.rng.randint(6, 18))
+        return " ".join(words).capitalize() + "."
+
+    def question(self):
+        """A question made of words that occur in the corpus, biased towards rarer ones"""
+        rare = self.rng.sample(self.words[len(WORDS):len(WORDS) + 500], self.rng.randint(1, 3))
+        common = self.rng.sample(WORDS, self.rng.randint(1, 2))
+        words = rare + common
+        self.rng.shuffle(words)
+        return "What does the document say about " + " ".join(words) + "?"
+
+
+def page_lines(source, lines=LINES_PER_PAGE, width=LINE_CHARS):
+    """Wrap sentences into lines of at most width characters"""
+    result = []
+    line = ""
+    while len(result) < lines:
+        for word in source.sentence().split():
+            if line and len(line) + 1 + len(word) > width:
+                result.append(line)
+                line = ""
+            line = f"{line} {word}" if line else word
+    return result[:lines]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _content_stream(lines):
+    body = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+    for line in lines:
+        body.append(f"({_escape(line)}) Tj T*")
+    body.append("ET")
+    return "\n".join(body).encode("latin-1")
+
+
+def make_pdf(pages, seed=0):
+    """PDF bytes with the given number of pages of synthetic text"""
+    source = SentenceSource(seed)
+    # Objects 1-3 are the catalog, the page tree and the font; each page adds a page and a content object
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {pages} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+    for page_id in page_ids:
+        stream = _content_stream(page_lines(source))
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode()
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = out.tell()
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, objects[number]))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for number in sorted(objects):
+        out.write(b"%010d 00000 n \n" % offsets[number])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def pages_for_size(size_bytes):
+    """Roughly how many pages make a PDF of size_bytes"""
+    page_bytes = LINES_PER_PAGE * (LINE_CHARS + 8) + 250
+    return max(1, round(size_bytes / page_bytes))
+
+
+def make_corpus(documents, size_bytes, seed=0):
+    """(file name, PDF bytes) pairs of about size_bytes each"""
+    pages = pages_for_size(size_bytes)
+    return [(f"synthetic-{seed}-{i:03d}.pdf", make_pdf(pages, seed=seed * 1000 + i)) for i in range(documents)]
@@ -0,0 +1,123 @@
+import math
+from typing import NamedTuple
+
+from scopes import parse_chunk_id
+
+# Rough characters per token for English prose; good enough to budget prompts without a tokenizer call
+CHARS_PER_TOKEN = 4
+
+# Context tokens per prompt (the old 8000-character limit)
+DEFAULT_TOKEN_BUDGET = 2000
+
+
+def estimate_tokens(text):
+    """Approximate number of LLM tokens in text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class PackedContext(NamedTuple):
+    text: str                   # context passages joined for the prompt
+    tokens: int                 # estimated tokens of text
+    chunk_ids: list             # ids of the chunks that made it in
+    dropped: int                # retrieved chunks left out for lack of budget
+
+
+class _Span(NamedTuple):
+    document: str
+    start: int
+    end: int
+    text: str
+
+
+def _span(chunk):
+    """Where a chunk sits in its document, from its "{document}-{offset}" id; None for other ids"""
+    parsed = parse_chunk_id(chunk["id"])
+    if parsed is None:
+        return None
+    document, start = parsed
+    return _Span(document, start, start + len(chunk["text"]), chunk["text"])
+
+
+def _merge(spans):
+    """Join spans of the same document, dropping the text they share; spans are sorted by start"""
+    merged = [spans[0]]
+    for span in spans[1:]:
+        last = merged[-1]
+        if span.document != last.document or span.start > last.end:
+            merged.append(span)
+        elif span.end > last.end:
+            merged[-1] = _Span(last.document, last.start, span.end, last.text + span.text[last.end - span.start:])
+    return merged
+
+
+def _knapsack(costs, values, budget):
+    """Indexes of the items with the highest total value whose costs fit in budget (0/1 knapsack)"""
+    best = [0.0] * (budget + 1)
+    taken = [[False] * (budget + 1) for _ in costs]
+    for i, (cost, value) in enumerate(zip(costs, values)):
+        for capacity in range(budget, cost - 1, -1):
+            if best[capacity - cost] + value > best[capacity]:
+                best[capacity] = best[capacity - cost] + value
+                taken[i][capacity] = True
+    chosen = []
+    capacity = budget
+    for i in range(len(costs) - 1, -1, -1):
+        if taken[i][capacity]:
+            chosen.append(i)
+            capacity -= costs[i]
+    return sorted(chosen)
+
+
+def pack_context(chunks, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Pick the context for a prompt from ranked chunk dicts ({"id", "text", "score"})
+
+    Chunks are chosen to maximise total relevance within the token budget
+    (a 0/1 knapsack, so a long chunk that doesn't fit doesn't shut out
+    shorter ones after it). Chunks that overlap in their document are then
+    merged so the shared text appears once, and the freed budget is offered
+    to the remaining chunks in rank order. Passages are ordered by their
+    best chunk's rank.
+    """
+    if not chunks:
+        return PackedContext("", 0, [], 0)
+
+    count = len(chunks)
+    # Rank breaks ties (and gives unscored sample chunks a value at all)
+    values = [max(chunk.get("score") or 0.0, 0.0) + (count - rank) * 1e-6 for rank, chunk in enumerate(chunks)]
+    costs = [estimate_tokens(chunk["text"]) for chunk in chunks]
+    chosen = set(_knapsack(costs, values, token_budget))
+
+    def passages(indexes):
+        """Merged passages for the chosen chunks, each with the best rank among its chunks"""
+        located = []
+        loose = []
+        for i in sorted(indexes):
+            span = _span(chunks[i])
+            if span is None:
+                loose.append((i, chunks[i]["text"]))
+            else:
+                located.append((span, i))
+        located.sort(key=lambda item: (item[0].document, item[0].start))
+        result = list(loose)
+        if located:
+            for merged in _merge([span for span, _ in located]):
+                best = min(i for span, i in located
+                           if span.document == merged.document and merged.start <= span.start < merged.end)
+                result.append((best, merged.text))
+        return sorted(result)
+
+    def tokens_of(indexes):
+        return sum(estimate_tokens(text) for _, text in passages(indexes))
+
+    # Overlap removal may have freed budget for chunks the knapsack had to leave out
+    for i in range(count):
+        if i not in chosen and tokens_of(chosen | {i}) <= token_budget:
+            chosen.add(i)
+
+    packed = passages(chosen)
+    return PackedContext(
+        text="\n\n".join(text for _, text in packed),
+        tokens=sum(estimate_tokens(text) for _, text in packed),
+        chunk_ids=[chunks[i]["id"] for i in sorted(chosen)],
+        dropped=count - len(chosen),
+    )
@@ -0,0 +1,295 @@
+"""Export the chunk corpus to a compact snapshot file and restore it.
+
+A snapshot holds every complete document with its chunks (offset, text and
+embedding) and acronym definitions. Chunk ids, content hashes and NEXT
+chains are not stored: they follow from each chunk's document and offset,
+and are rebuilt on restore. Chunks are kept in row groups of a few thousand;
+each group holds little-endian arrays aligned for np.frombuffer (document
+numbers, offsets, text lengths and a float32 embedding matrix) and its
+texts, zlib-compressed. The documents, definitions and group directory sit
+in a compressed footer at the end, so export streams straight to disk and
+readers memory-map the file and decode one group at a time.
+
+Restoring writes the corpus with a few large UNWIND transactions, and the
+chatbot can build its local indexes from a snapshot ([snapshot] path in the
+secrets) instead of reading every chunk back from Neo4j:
+
+    python corpus_snapshot.py export corpus.snap
+    python corpus_snapshot.py import corpus.snap
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import NamedTuple
+
+import numpy as np
+
+from document_processor import DocumentProcessor
+from feedback import LogFeedback
+from scopes import DEFAULT_COLLECTION
+from settings import DEFAULT_SECRETS_PATH, headless_setup
+from vector_index import HashingEmbedder
+
+MAGIC = b"NBOTSNAP"
+FORMAT_VERSION = 1
+
+# Chunks per row group; the unit of compression and of decoding
+GROUP_SIZE = 4096
+
+# Arrays start on this boundary so they can be viewed straight from the mapped file
+ALIGNMENT = 64
+
+COMPRESSION_LEVEL = 6
+
+# Footer length (little-endian u64) and the magic again close the file
+TRAILER = struct.Struct("<Q8s")
+
+logger = logging.getLogger("nbot.snapshot")
+
+
+class SnapshotGroup(NamedTuple):
+    documents: np.ndarray       # uint32 index into CorpusSnapshot.documents, per chunk
+    offsets: np.ndarray         # int64 character offset of each chunk in its document
+    texts: list                 # decoded chunk texts
+    embeddings: np.ndarray      # float32 (chunks, dimensions), read-only view of the file
+
+
+class SnapshotWriter:
+    """Streams documents, chunks and acronym definitions into a snapshot file.
+
+    Chunks must be added document by document, in offset order. The file is
+    written under a temporary name and moved into place by close(), so an
+    interrupted export never leaves a truncated snapshot behind.
+    """
+
+    def __init__(self, path, dimensions, group_size=GROUP_SIZE):
+        self.path = path
+        self.dimensions = dimensions
+        self.group_size = group_size
+        self.chunks = 0
+        self._partial_path = f"{path}.partial"
+        self._file = open(self._partial_path, "wb")
+        self._file.write(MAGIC)
+        self._documents = []
+        self._document_numbers = {}
+        self._definitions = []
+        self._groups = []
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._partial_path)
+
+    def add_document(self, doc_hash, name=None, size=None, collections=None, ingested_at=None):
+        self._document_numbers[doc_hash] = len(self._documents)
+        self._documents.append({
+            "hash": doc_hash, "name": name, "size": size, "collections": list(collections or [DEFAULT_COLLECTION]),
+            "ingested_at": ingested_at
+        })
+
+    def add_chunk(self, doc_hash, offset, text, embedding):
+        self._pending.append((self._document_numbers[doc_hash], offset, text, embedding))
+        if len(self._pending) >= self.group_size:
+            self._write_group()
+
+    def add_definition(self, chunk_id, abbr, long_form):
+        self._definitions.append([chunk_id, abbr, long_form])
+
+    def close(self):
+        if self._pending:
+            self._write_group()
+        footer = zlib.compress(json.dumps({
+            "version": FORMAT_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "chunks": self.chunks,
+            "dimensions": self.dimensions,
+            "documents": self._documents,
+            "definitions": self._definitions,
+            "groups": self._groups,
+        }).encode("utf-8"), COMPRESSION_LEVEL)
+        self._file.write(footer)
+        self._file.write(TRAILER.pack(len(footer), MAGIC))
+        self._file.close()
+        os.replace(self._partial_path, self.path)
+
+    def _write(self, data):
+        """Append data at the next aligned position and return its (position, length)"""
+        padding = -self._file.tell() % ALIGNMENT
+        self._file.write(b"\0" * padding)
+        position = self._file.tell()
+        self._file.write(data)
+        return [position, len(data)]
+
+    def _write_group(self):
+        numbers, offsets, texts, embeddings = zip(*self._pending)
+        encoded = [text.encode("utf-8") for text in texts]
+        self._groups.append({
+            "count": len(self._pending),
+            "documents": self._write(np.asarray(numbers, dtype="<u4").tobytes()),
+            "offsets": self._write(np.asarray(offsets, dtype="<i8").tobytes()),
+            "text_lengths": self._write(np.asarray([len(data) for data in encoded], dtype="<u4").tobytes()),
+            "embeddings": self._write(np.asarray(embeddings, dtype="<f4").reshape(-1, self.dimensions).tobytes()),
+            "texts": self._write(zlib.compress(b"".join(encoded), COMPRESSION_LEVEL)),
+        })
+        self.chunks += len(self._pending)
+        self._pending = []
+
+
+class CorpusSnapshot:
+    """A snapshot file opened for reading, memory-mapped.
+
+    Arrays handed out by groups() are views of the mapping, valid until
+    close(); copy what has to outlive it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            footer_length, magic = TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+            if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+                raise ValueError(f"{path} is not a corpus snapshot")
+            footer_end = len(self._map) - TRAILER.size
+            footer = json.loads(zlib.decompress(self._map[footer_end - footer_length:footer_end]))
+        except Exception:
+            self._file.close()
+            raise
+        if footer["version"] != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} has snapshot format {footer['version']}, expected {FORMAT_VERSION}")
+        self.created_at = footer["created_at"]
+        self.chunk_count = footer["chunks"]
+        self.dimensions = footer["dimensions"]
+        self.documents = footer["documents"]
+        for document in self.documents:
+            # Snapshots taken while a document had a single collection
+            if "collections" not in document:
+                document["collections"] = [document.pop("collection", None) or DEFAULT_COLLECTION]
+        self.definitions = footer["definitions"]
+        self._groups = footer["groups"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            # Views are still referenced; the mapping goes when they do
+            pass
+        self._file.close()
+
+    def document_hashes(self):
+        return {document["hash"] for document in self.documents}
+
+    def _array(self, section, dtype, shape):
+        position, length = section
+        return np.frombuffer(self._map, dtype=dtype, count=length // np.dtype(dtype).itemsize,
+                             offset=position).reshape(shape)
+
+    def groups(self):
+        """Yield the chunks a SnapshotGroup at a time, in document and offset order"""
+        for group in self._groups:
+            count = group["count"]
+            lengths = self._array(group["text_lengths"], "<u4", (count,))
+            position, length = group["texts"]
+            data = zlib.decompress(self._map[position:position + length])
+            ends = np.cumsum(lengths, dtype=np.int64).tolist()
+            starts = [0] + ends[:-1]
+            yield SnapshotGroup(
+                documents=self._array(group["documents"], "<u4", (count,)),
+                offsets=self._array(group["offsets"], "<i8", (count,)),
+                texts=[data[start:end].decode("utf-8") for start, end in zip(starts, ends)],
+                embeddings=self._array(group["embeddings"], "<f4", (count, self.dimensions)),
+            )
+
+    def iter_rows(self):
+        """Yield every chunk as a {"document", "offset", "text", "embedding"} dict"""
+        for group in self.groups():
+            offsets = group.offsets.tolist()
+            for number, offset, text, embedding in zip(
+                group.documents.tolist(), offsets, group.texts, group.embeddings
+            ):
+                yield {"document": self.documents[number]["hash"], "offset": offset, "text": text,
+                       "embedding": embedding}
+
+
+def export_snapshot(driver, path, embedder=None, group_size=GROUP_SIZE):
+    """Write every complete document in Neo4j to a snapshot at path; returns the number of chunks
+
+    Chunks stored without an embedding get one from embedder (default:
+    HashingEmbedder, as at ingest).
+    """
+    embedder = embedder or HashingEmbedder()
+    with driver.session() as session, SnapshotWriter(path, embedder.dimensions, group_size) as writer:
+        documents = session.run(
+            """
+            MATCH (d:Document) WHERE d.complete
+            RETURN d.hash AS hash, d.name AS name, d.size AS size, d.collections AS collections,
+                   toString(d.ingested_at) AS ingested_at
+            """
+        )
+        for record in list(documents):
+            writer.add_document(record["hash"], record["name"], record["size"], record["collections"],
+                                record["ingested_at"])
+
+        chunks = session.run(
+            """
+            MATCH (d:Document)-[:HAS_CHUNK]->(c:TextChunk) WHERE d.complete
+            RETURN d.hash AS document, c.offset AS offset, c.text AS text, c.embedding AS embedding
+            ORDER BY document, offset
+            """
+        )
+        for record in chunks:
+            embedding = record["embedding"]
+            if embedding is None:
+                embedding = embedder.embed(record["text"])
+            writer.add_chunk(record["document"], record["offset"], record["text"], embedding)
+
+        definitions = session.run(
+            """
+            MATCH (d:Document)-[:HAS_CHUNK]->(c:TextChunk)<-[r:DEFINED_IN]-(a:Acronym) WHERE d.complete
+            RETURN c.id AS chunk_id, a.abbr AS abbr, r.long_form AS long_form
+            """
+        )
+        for record in definitions:
+            writer.add_definition(record["chunk_id"], record["abbr"], record["long_form"])
+    return writer.chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help="snapshot file")
+    parser.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="the app's secrets.toml")
+    args = parser.parse_args()
+    _, neo4j = headless_setup(args.secrets)
+    processor = DocumentProcessor(**neo4j)
+    start = time.perf_counter()
+    if args.command == "export":
+        chunks = export_snapshot(processor.driver, args.path, processor.embedder)
+        logger.info("Exported %d chunks to %s in %.1fs (%d bytes)", chunks, args.path,
+                    time.perf_counter() - start, os.path.getsize(args.path))
+    else:
+        with CorpusSnapshot(args.path) as snapshot:
+            if not processor.restore_snapshot(snapshot, feedback=LogFeedback(logger)):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
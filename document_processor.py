@@ -1,219 +1,837 @@
-import PyPDF2
-from neo4j import GraphDatabase
-import io
-import streamlit as st
-import re
+import time
+import hashlib
+import threading
+from contextlib import contextmanager, nullcontext
+from vector_index import HashingEmbedder
+from pdf_extraction import PdfTextExtractor
+from text_chunking import normalize_text, iter_chunks
+from acronyms import find_definitions
+from neo4j_connection import get_driver
+from tracing import tracer, debug
+from feedback import StreamlitFeedback
+from scopes import DEFAULT_COLLECTION, DOCUMENT_ID_LENGTH
+
+# Name of the Neo4j full-text index used for retrieval. It covers TextChunk.text plus the
+# document and collections properties, so scoped searches are filtered inside Lucene
+FULLTEXT_INDEX_NAME = "textChunkScopes"
+
+# Earlier full-text indexes (text only, then with a single collection), dropped once the current one exists
+LEGACY_FULLTEXT_INDEX_NAMES = ("textChunkText", "textChunkScoped")
+
+# Indexes on the single collection property documents and chunks had before they could be in several
+LEGACY_INDEX_NAMES = ("documentCollection", "textChunkCollection")
+
+# Bulk writes send at most this many rows / approximate payload bytes per transaction
+BATCH_MAX_ROWS = 2000
+BATCH_MAX_BYTES = 8 * 1024 * 1024
+
+# Chunks written before documents were tracked have "chunk-N" ids; they are filed under a Document
+# with this hash, which is also their document key (see scopes.document_key)
+LEGACY_DOCUMENT_HASH = "chunk"
+LEGACY_DOCUMENT_NAME = "Uploads from before documents were tracked"
+
+# Scoped deletes remove at most this many chunks per transaction
+DELETE_BATCH_SIZE = 5000
+
+# Snapshot restores write bigger batches: no extraction or embedding runs between them
+RESTORE_BATCH_ROWS = 10000
+RESTORE_BATCH_BYTES = 64 * 1024 * 1024
+
+
+def chunk_id(doc_hash, offset):
+    """The id of the chunk at offset in a document"""
+    return f"{doc_hash[:DOCUMENT_ID_LENGTH]}-{offset}"
+
 
 class DocumentProcessor:
-    def __init__(self, uri, user, password):
-        """Initialize Neo4j connection"""
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri, user, password, indexes=None, embedder=None, extractor=None, answer_cache=None,
+                 corpus_stats=None, driver_settings=None):
+        """Initialize Neo4j connection
+
+        indexes are local search indexes (e.g. Chatbot.search_index) that
+        mirror the TextChunk store and are updated as chunks are written.
+        answer_cache (e.g. Chatbot.answer_cache) has its corpus version
+        bumped whenever the stored chunks change, and corpus_stats (e.g.
+        Chatbot.corpus_stats) is updated in place so nobody has to recount.
+        driver_settings override the shared driver's pool settings.
+        """
+        self.driver = get_driver(uri, user, password, driver_settings)
+        self.corpus_stats = corpus_stats
+        self.indexes = list(indexes or [])
+        # Chunk embeddings are computed locally at ingest and stored on each TextChunk; the
+        # embedder is sent to the extractor's worker processes, so it has to be picklable
+        self.embedder = embedder or HashingEmbedder()
+        # PDFs are extracted page-parallel, and chunks embedded, in the extractor's process pool
+        self.extractor = extractor or PdfTextExtractor()
+        self.answer_cache = answer_cache
+        # Indexes are checked (and old chunks migrated) once per process
+        self._schema_ready = False
+        # Documents (by hash, and by name within a collection) an ingest in this process is working on
+        self._claimed = set()
+        self._claims = threading.Condition()
+
+    def process_pdf(self, uploaded_file, feedback=None, collection=DEFAULT_COLLECTION):
+        """Stream an uploaded PDF through extract -> clean -> chunk -> Neo4j
 
-    def process_pdf(self, uploaded_file):
-        """Extract text from a Streamlit uploaded PDF, chunk it, and store in Neo4j"""
+        uploaded_file is a Streamlit UploadedFile or any seekable binary file
+        object with name and size attributes. Pages are cleaned and chunked
+        as they are extracted and chunks are written in batches as soon as a
+        batch fills up, so peak memory is bounded by the batch size rather
+        than the size of the document.
+
+        feedback receives progress(fraction, text), clear(), success(),
+        warning() and error() calls; it defaults to StreamlitFeedback, so
+        callers off the script thread (e.g. IngestService) pass their own.
+        The document is filed under collection; uploading a document that
+        is already stored files it there as well, keeping it in its other
+        collections. Either way an older version with the same name in the
+        collection is replaced.
+        """
+        feedback = feedback or StreamlitFeedback()
         try:
             # Verify the uploaded file
             if uploaded_file is None:
-                st.error("No file was uploaded")
+                feedback.error("No file was uploaded")
                 return False
                 
             # Debug information
-            st.info(f"Processing file: {uploaded_file.name}, Size: {uploaded_file.size} bytes")
-            
-            # Extract text from the PDF
-            text = self._extract_text_from_streamlit_file(uploaded_file)
-            
-            if not text or len(text.strip()) == 0:
-                st.warning("⚠️ No text could be extracted from the PDF!")
-                return False
+            debug(f"Processing file: {uploaded_file.name}, Size: {uploaded_file.size} bytes")
 
-            st.info(f"Extracted {len(text)} characters of text")
-            
-            # Clean the text
-            text = self._clean_text(text)
-            st.info(f"Text cleaned, now {len(text)} characters")
-                
-            # Chunk the text
-            chunks = self._chunk_text(text)
-            if not chunks or len(chunks) == 0:
-                st.warning("⚠️ No chunks created from the text!")
-                return False
-                
-            st.info(f"Created {len(chunks)} text chunks")
+            # Documents are keyed by a hash of their content, so identical re-uploads are free
+            doc_hash = self._hash_file(uploaded_file)
+        except Exception as e:
+            feedback.error(f"Error processing document: {str(e)}")
+            return False
+
+        # An ingest of the same bytes, or of another version of the file, finishes first
+        with self._claim(("document", doc_hash), ("name", collection, uploaded_file.name)), self._changing():
+            return self._ingest(uploaded_file, doc_hash, feedback, collection)
+
+    def _changing(self):
+        """Mark a change to the stored chunks in corpus_stats, if there are stats to keep"""
+        return self.corpus_stats.changing() if self.corpus_stats is not None else nullcontext()
+
+    @contextmanager
+    def _claim(self, *keys):
+        """Hold keys against other ingests in this process, waiting while any of them is held
+
+        All keys are taken at once, so two ingests never hold one key each
+        and wait for the other's.
+        """
+        with self._claims:
+            while any(key in self._claimed for key in keys):
+                self._claims.wait()
+            self._claimed.update(keys)
+        try:
+            yield
+        finally:
+            with self._claims:
+                self._claimed.difference_update(keys)
+                self._claims.notify_all()
 
-            # Clear existing chunks before adding new ones
-            self._clear_existing_chunks()
+    def _ingest(self, uploaded_file, doc_hash, feedback, collection):
+        """process_pdf() for a document this thread has claimed"""
+        try:
+            self.ensure_indexes(feedback)
+            status = self._document_status(doc_hash)
+            previous_hash = self._find_previous_version(uploaded_file.name, collection, doc_hash)
+            if status == "complete":
+                debug(f"'{uploaded_file.name}' is already in the knowledge graph, only filing it under '{collection}'")
+                self._add_to_collection(doc_hash, collection)
+                if previous_hash:
+                    self._remove_from_collection(previous_hash, collection, feedback)
+                return True
+            if status == "partial":
+                # Nobody in this process owns it, so an interrupted ingest left it behind; start over
+                self.delete_document(doc_hash, feedback=feedback)
 
-            # Store chunks in Neo4j
-            success = self._store_chunks_in_neo4j(chunks)
-            return success
-            
+            self._create_document(doc_hash, uploaded_file.name, uploaded_file.size, collection)
         except Exception as e:
-            st.error(f"Error processing document: {str(e)}")
+            feedback.error(f"Error processing document: {str(e)}")
             return False
 
-    def _extract_text_from_streamlit_file(self, uploaded_file):
-        """Extract text from a PDF file uploaded via Streamlit"""
-        text = ""
+        completed = False
         try:
-            # Read the file content
-            bytes_data = uploaded_file.getvalue()
-            
-            # Create a file-like object
-            file_stream = io.BytesIO(bytes_data)
-            
-            # Use PyPDF2 to extract text
-            try:
-                reader = PyPDF2.PdfReader(file_stream)
-                
-                # Debug info
-                st.info(f"PDF has {len(reader.pages)} pages")
-                
-                # Extract text from each page
-                for i, page in enumerate(reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                    except Exception as e:
-                        st.warning(f"Error extracting text from page {i+1}: {str(e)}")
-                
-            except Exception as e:
-                st.error(f"Error reading PDF: {str(e)}")
-                return ""
-                
+            feedback.progress(0.0, "Extracting text...")
+            with tracer.span("ingest.total", document=uploaded_file.name):
+                pages = self._iter_page_texts(uploaded_file, feedback)
+                chunks = tracer.timed_iter("ingest.chunk", iter_chunks(pages))
+                rows = self._iter_chunk_rows(doc_hash, chunks)
+                stored, reused = self._store_chunks_in_neo4j(doc_hash, rows, previous_hash, feedback)
+            feedback.clear()
+
+            if stored == 0:
+                feedback.warning("⚠️ No text could be extracted from the PDF!")
+                self.delete_document(doc_hash, feedback=feedback)
+                return False
+
+            self._mark_document_complete(doc_hash)
+            completed = True
+            if self.corpus_stats is not None:
+                # Deleting the previous version below uncounts its chunks, reused ones included
+                self.corpus_stats.record_change(chunks=stored, documents=1, ingested=True)
+            if previous_hash:
+                # Unchanged chunks were copied; the old version leaves the collection now that the new one
+                # is complete, and goes altogether unless another collection still holds it
+                self._remove_from_collection(previous_hash, collection, feedback)
+            self._bump_corpus_version()
+            return True
+
         except Exception as e:
-            st.error(f"Error processing uploaded file: {str(e)}")
-            return ""
-        
-        return text
-        
+            feedback.clear()
+            if completed:
+                # The document is stored and searchable, so it stays; the older version may linger beside it
+                feedback.warning(f"⚠️ Stored the document, but could not retire its older version: {str(e)}")
+                self._bump_corpus_version()
+                return True
+            feedback.error(f"Error processing document: {str(e)}")
+            self.delete_document(doc_hash, feedback=feedback)
+            return False
+
+    @staticmethod
+    def _hash_file(uploaded_file, block_size=1024 * 1024):
+        """SHA-256 of the uploaded file's bytes
+
+        In-memory uploads (Streamlit's UploadedFile, any BytesIO made from
+        bytes) hand back the bytes they wrap from getvalue() without a copy;
+        getbuffer() would unshare them, copying the whole file for the rest
+        of the ingest. Other files are read in blocks.
+        """
+        if hasattr(uploaded_file, "getvalue"):
+            return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        digest = hashlib.sha256()
+        uploaded_file.seek(0)
+        for block in iter(lambda: uploaded_file.read(block_size), b""):
+            digest.update(block)
+        uploaded_file.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _iter_chunk_rows(doc_hash, chunks):
+        """Turn (offset, text) chunks into rows with ids from the document hash and chunk offset"""
+        for offset, chunk in chunks:
+            yield {
+                "id": chunk_id(doc_hash, offset),
+                "text": chunk,
+                "offset": offset,
+                "content_hash": hashlib.sha256(chunk.encode("utf-8")).hexdigest(),
+            }
+
+    def _iter_page_texts(self, uploaded_file, feedback):
+        """Yield the cleaned text of each page of the uploaded PDF, in order"""
+        for page in tracer.timed_iter("ingest.extract", self.extractor.iter_pages(uploaded_file)):
+            if page.error:
+                feedback.warning(f"Error extracting text from page {page.page_number}: {page.error}")
+            feedback.progress(
+                page.page_number / page.page_count,
+                f"Processed page {page.page_number}/{page.page_count}"
+            )
+            with tracer.span("ingest.clean"):
+                text = self._clean_text(page.text).strip("\n")
+            if text:
+                yield text + "\n"
+
     def _clean_text(self, text):
         """Clean the extracted text"""
-        # Replace multiple newlines with a single newline
-        text = re.sub(r'\n+', '\n', text)
-        
-        # Replace multiple spaces with a single space
-        text = re.sub(r' +', ' ', text)
-        
-        # Remove any non-printable characters
-        text = ''.join(c for c in text if c.isprintable() or c == '\n')
-        
-        return text
-
-    def _chunk_text(self, text, chunk_size=800, overlap=200):
-        """Split text into overlapping chunks"""
-        chunks = []
-        if not text or len(text.strip()) == 0:
-            return chunks
-            
-        # Try to chunk at paragraph boundaries first
-        paragraphs = text.split('\n\n')
-        current_chunk = ""
-        
-        for para in paragraphs:
-            if len(current_chunk) + len(para) < chunk_size:
-                current_chunk += para + "\n\n"
-            else:
-                # If the current chunk has content, add it to chunks
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-                
-                # Start a new chunk with overlap
-                if len(current_chunk) > overlap:
-                    # Find the last period in the overlap region
-                    overlap_text = current_chunk[-overlap:]
-                    last_period = overlap_text.rfind('.')
-                    
-                    if last_period != -1:
-                        # Start new chunk from the last sentence in the overlap
-                        current_chunk = current_chunk[-(overlap-last_period):] + para + "\n\n"
-                    else:
-                        # No good break point, just use the overlap
-                        current_chunk = current_chunk[-overlap:] + para + "\n\n"
-                else:
-                    current_chunk = para + "\n\n"
-        
-        # Add the last chunk if it has content
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-            
-        # If no chunks were created (maybe no paragraph breaks), fall back to character-based chunking
-        if not chunks:
-            start = 0
-            while start < len(text):
-                end = min(start + chunk_size, len(text))
-                
-                # Try to end at a sentence or paragraph break
-                if end < len(text):
-                    # Look for paragraph break
-                    para_break = text.rfind('\n\n', start, end)
-                    if para_break != -1 and para_break > start + chunk_size // 2:
-                        end = para_break + 2
-                    else:
-                        # Look for sentence break
-                        sentence_break = text.rfind('. ', start, end)
-                        if sentence_break != -1 and sentence_break > start + chunk_size // 2:
-                            end = sentence_break + 2
-                
-                chunk = text[start:end]
-                if chunk.strip():  # Only add non-empty chunks
-                    chunks.append(chunk.strip())
-                
-                # Calculate next start position with overlap
-                if end == len(text):
-                    break
-                    
-                # Try to start at a sentence beginning
-                overlap_start = max(end - overlap, start)
-                sentence_start = text.find('. ', overlap_start, end)
-                if sentence_start != -1:
-                    start = sentence_start + 2
-                else:
-                    start = overlap_start
-        
-        return chunks
-        
-    def _clear_existing_chunks(self):
-        """Clear existing chunks from Neo4j"""
+        return normalize_text(text)
+
+    def ensure_indexes(self, feedback=None):
+        """Create the Document/TextChunk constraints and indexes if they don't exist yet
+
+        Failures are reported to feedback (default: StreamlitFeedback).
+        """
+        if self._schema_ready:
+            return True
         try:
             with self.driver.session() as session:
-                session.run("MATCH (c:TextChunk) DETACH DELETE c")
-                st.info("🧹 Cleared existing chunks from Neo4j")
+                session.run(
+                    """
+                    CREATE CONSTRAINT documentHash IF NOT EXISTS
+                    FOR (d:Document) REQUIRE d.hash IS UNIQUE
+                    """
+                )
+                session.run("CREATE INDEX documentName IF NOT EXISTS FOR (d:Document) ON (d.name)")
+                session.run(
+                    """
+                    CREATE CONSTRAINT textChunkId IF NOT EXISTS
+                    FOR (c:TextChunk) REQUIRE c.id IS UNIQUE
+                    """
+                )
+                session.run(
+                    """
+                    CREATE CONSTRAINT acronymAbbr IF NOT EXISTS
+                    FOR (a:Acronym) REQUIRE a.abbr IS UNIQUE
+                    """
+                )
+                # Document scopes narrow on this instead of scanning every chunk; collection scopes
+                # narrow in the full-text index, as range indexes can't look up list members
+                session.run("CREATE INDEX textChunkDocument IF NOT EXISTS FOR (c:TextChunk) ON (c.document)")
+                self._migrate_scopes(session)
+                self._adopt_unowned_chunks(session, feedback)
+                session.run(
+                    f"""
+                    CREATE FULLTEXT INDEX {FULLTEXT_INDEX_NAME} IF NOT EXISTS
+                    FOR (c:TextChunk) ON EACH [c.text, c.document, c.collections]
+                    """
+                )
+                for index_name in LEGACY_FULLTEXT_INDEX_NAMES + LEGACY_INDEX_NAMES:
+                    session.run(f"DROP INDEX {index_name} IF EXISTS")
+            self._schema_ready = True
+            return True
+        except Exception as e:
+            (feedback or StreamlitFeedback()).warning(f"Could not create TextChunk indexes: {str(e)}")
+            return False
+
+    @staticmethod
+    def _migrate_scopes(session):
+        """Give documents and chunks stored before scopes existed a collections list
+
+        Documents keep the single collection they had, or get the default
+        one if they predate collections altogether.
+        """
+        session.run(
+            """
+            MATCH (d:Document) WHERE d.collections IS NULL
+            SET d.collections = [coalesce(d.collection, $collection)]
+            REMOVE d.collection
+            """,
+            collection=DEFAULT_COLLECTION
+        )
+        # Batched, as this can touch every chunk once; later runs find nothing to do
+        session.run(
+            """
+            MATCH (d:Document)-[:HAS_CHUNK]->(c:TextChunk) WHERE c.collections IS NULL
+            CALL {
+                WITH d, c
+                SET c.document = d.hash, c.collections = d.collections
+                REMOVE c.collection
+            } IN TRANSACTIONS OF 10000 ROWS
+            """
+        )
+
+    def _adopt_unowned_chunks(self, session, feedback=None):
+        """File chunks that belong to no Document under a legacy Document
+
+        Chunks written before documents were tracked ("chunk-N" ids) keep
+        answering questions and can be deleted like any other document.
+        Later runs find nothing to do.
+        """
+        unowned = session.run(
+            "MATCH (c:TextChunk) WHERE NOT (:Document)-[:HAS_CHUNK]->(c) RETURN count(c) AS count"
+        ).single()["count"]
+        if not unowned:
+            return
+        with self._changing():
+            created = session.run(
+                """
+                OPTIONAL MATCH (existing:Document {hash: $hash})
+                MERGE (d:Document {hash: $hash})
+                ON CREATE SET d.name = $name, d.size = 0, d.collections = [$collection],
+                              d.complete = true, d.ingested_at = datetime()
+                RETURN existing IS NULL AS created
+                """,
+                hash=LEGACY_DOCUMENT_HASH,
+                name=LEGACY_DOCUMENT_NAME,
+                collection=DEFAULT_COLLECTION
+            ).single()["created"]
+            # Batched, like the scope migration; the offset is the N of a "chunk-N" id
+            session.run(
+                """
+                MATCH (c:TextChunk) WHERE NOT (:Document)-[:HAS_CHUNK]->(c)
+                CALL {
+                    WITH c
+                    MATCH (d:Document {hash: $hash})
+                    MERGE (d)-[:HAS_CHUNK]->(c)
+                    SET c.document = d.hash, c.collections = d.collections,
+                        c.offset = coalesce(c.offset, toInteger(split(c.id, "-")[-1]))
+                    REMOVE c.collection
+                } IN TRANSACTIONS OF 10000 ROWS
+                """,
+                hash=LEGACY_DOCUMENT_HASH
+            )
+            if self.corpus_stats is not None:
+                self.corpus_stats.record_change(chunks=unowned, documents=int(created))
+        self._bump_corpus_version()
+        (feedback or StreamlitFeedback()).warning(
+            f"⚠️ {unowned} chunks stored before documents were tracked are now listed as "
+            f"'{LEGACY_DOCUMENT_NAME}'; delete that document to drop them."
+        )
+
+    def _document_status(self, doc_hash):
+        """"complete" or "partial" if a document with this content hash exists, else None"""
+        with self.driver.session() as session:
+            record = session.run(
+                "MATCH (d:Document {hash: $hash}) RETURN coalesce(d.complete, false) AS complete",
+                hash=doc_hash
+            ).single()
+            if record is None:
+                return None
+            return "complete" if record["complete"] else "partial"
+
+    def _create_document(self, doc_hash, name, size, collection):
+        """Create the Document node chunks are attached to; it stays partial until ingest finishes"""
+        with self.driver.session() as session:
+            session.run(
+                """
+                MERGE (d:Document {hash: $hash})
+                SET d.name = $name, d.size = $size, d.collections = [$collection], d.complete = false
+                """,
+                hash=doc_hash, name=name, size=size, collection=collection
+            )
+
+    def _add_to_collection(self, doc_hash, collection):
+        """File a stored document and its chunks under one more collection"""
+        with self.driver.session() as session:
+            record = session.run(
+                """
+                MATCH (d:Document {hash: $hash}) WHERE NOT $collection IN d.collections
+                SET d.collections = d.collections + $collection
+                WITH d
+                OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:TextChunk)
+                SET c.collections = d.collections
+                RETURN count(DISTINCT d) AS added
+                """,
+                hash=doc_hash, collection=collection
+            ).single()
+        if record and record["added"]:
+            # Scoped questions now retrieve differently
+            self._bump_corpus_version()
+
+    def _remove_from_collection(self, doc_hash, collection, feedback=None):
+        """Take a document out of a collection, deleting it if no other collection holds it"""
+        with self.driver.session() as session:
+            record = session.run(
+                """
+                MATCH (d:Document {hash: $hash})
+                RETURN [name IN d.collections WHERE name <> $collection] AS remaining
+                """,
+                hash=doc_hash, collection=collection
+            ).single()
+            if record is None:
                 return True
+            if not record["remaining"]:
+                return self.delete_document(doc_hash, feedback=feedback)
+            session.run(
+                """
+                MATCH (d:Document {hash: $hash})
+                SET d.collections = $collections
+                WITH d
+                OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:TextChunk)
+                SET c.collections = $collections
+                """,
+                hash=doc_hash, collections=record["remaining"]
+            )
+        self._bump_corpus_version()
+        return True
+
+    def list_documents(self, feedback=None):
+        """Complete documents as {"hash", "name", "collections"} dicts, by name"""
+        try:
+            with self.driver.session() as session:
+                results = session.run(
+                    """
+                    MATCH (d:Document) WHERE d.complete
+                    RETURN d.hash AS hash, d.name AS name, d.collections AS collections
+                    ORDER BY name
+                    """
+                )
+                return [dict(record) for record in results]
+        except Exception as e:
+            (feedback or StreamlitFeedback()).error(f"Error listing documents: {str(e)}")
+            return []
+
+    def _mark_document_complete(self, doc_hash):
+        """Flag a document as fully ingested"""
+        with self.driver.session() as session:
+            session.run(
+                "MATCH (d:Document {hash: $hash}) SET d.complete = true, d.ingested_at = datetime()",
+                hash=doc_hash
+            )
+
+    def _find_previous_version(self, name, collection, doc_hash):
+        """Hash of another ingested document with the same file name in the collection, if any"""
+        with self.driver.session() as session:
+            record = session.run(
+                """
+                MATCH (d:Document {name: $name})
+                WHERE d.complete AND $collection IN d.collections AND d.hash <> $hash
+                RETURN d.hash AS hash
+                LIMIT 1
+                """,
+                name=name, collection=collection, hash=doc_hash
+            ).single()
+            return record["hash"] if record else None
+
+    def delete_document(self, doc_hash, batch_size=DELETE_BATCH_SIZE, feedback=None):
+        """Delete one document and its chunks, a batch per transaction; failures go to feedback"""
+        try:
+            deleted = 0
+            with self._changing(), self.driver.session() as session:
+                while True:
+                    record = session.execute_write(self._delete_chunks_tx, doc_hash, batch_size)
+                    chunk_ids = record["ids"] if record else []
+                    for index in self.indexes:
+                        index.remove_chunks(chunk_ids)
+                    deleted += len(chunk_ids)
+                    if len(chunk_ids) < batch_size:
+                        break
+                record = session.run(
+                    """
+                    MATCH (d:Document {hash: $hash})
+                    WITH d, coalesce(d.complete, false) AS complete
+                    DETACH DELETE d
+                    RETURN complete
+                    """,
+                    hash=doc_hash
+                ).single()
+                if deleted:
+                    # Acronyms whose every defining chunk is gone
+                    session.run("MATCH (a:Acronym) WHERE NOT (a)-[:DEFINED_IN]->() DELETE a")
+                if self.corpus_stats is not None:
+                    was_counted = bool(record and record["complete"])
+                    self.corpus_stats.record_change(
+                        chunks=-deleted if was_counted else 0, documents=-int(was_counted)
+                    )
+            if deleted:
+                self._bump_corpus_version()
+            debug(f"🧹 Removed {deleted} chunks of document {doc_hash[:DOCUMENT_ID_LENGTH]}")
+            return True
         except Exception as e:
-            st.error(f"Error clearing existing chunks: {str(e)}")
+            (feedback or StreamlitFeedback()).error(f"Error deleting document: {str(e)}")
             return False
-    
-    def _store_chunks_in_neo4j(self, chunks):
-        """Store text chunks in Neo4j"""
-        success = False
+
+    def restore_snapshot(self, snapshot, feedback=None, max_rows=RESTORE_BATCH_ROWS, max_bytes=RESTORE_BATCH_BYTES):
+        """Write the documents of a corpus_snapshot.CorpusSnapshot to Neo4j
+
+        Chunks keep the snapshot's embeddings and acronym definitions and
+        are written with one large UNWIND transaction per batch, chained
+        with NEXT relationships as they go; local indexes are fed the same
+        batches. Documents already stored are skipped and partial ones
+        (e.g. from an interrupted restore) are replaced, so a restore can
+        simply be run again. Returns True on success.
+        """
+        feedback = feedback or StreamlitFeedback()
+        # Partial documents may be uploads still being ingested here; wait for those to finish
+        with self._claim(*(("document", doc_hash) for doc_hash in snapshot.document_hashes())), self._changing():
+            return self._restore(snapshot, feedback, max_rows, max_bytes)
+
+    def _restore(self, snapshot, feedback, max_rows, max_bytes):
+        """restore_snapshot() once the snapshot's documents are claimed"""
+        start_time = time.perf_counter()
         try:
+            if not self.ensure_indexes(feedback):
+                raise RuntimeError("the TextChunk indexes are missing")
             with self.driver.session() as session:
-                # Create a transaction function to batch the inserts
-                def create_chunks_tx(tx, chunk_batch, start_idx):
-                    for i, chunk in enumerate(chunk_batch):
-                        chunk_id = f"chunk-{start_idx + i}"
-                        tx.run(
-                            """
-                            CREATE (c:TextChunk {id: $id, text: $text})
-                            """,
-                            id=chunk_id,
-                            text=chunk
-                        )
-                
-                # Process in smaller batches to avoid transaction timeouts
-                batch_size = 10
-                for i in range(0, len(chunks), batch_size):
-                    batch = chunks[i:i+batch_size]
-                    session.execute_write(create_chunks_tx, batch, i)
-                    st.info(f"Stored batch {i//batch_size + 1}/{(len(chunks)-1)//batch_size + 1}")
-                
-                st.success(f"✅ Successfully stored {len(chunks)} in Neo4j")
-                success = True
+                stored = {
+                    record["hash"]: record["complete"]
+                    for record in session.run(
+                        """
+                        UNWIND $hashes AS hash
+                        MATCH (d:Document {hash: hash})
+                        RETURN d.hash AS hash, coalesce(d.complete, false) AS complete
+                        """,
+                        hashes=sorted(snapshot.document_hashes())
+                    )
+                }
+            for doc_hash, complete in stored.items():
+                if not complete:
+                    self.delete_document(doc_hash, feedback=feedback)
+            documents = [document for document in snapshot.documents if not stored.get(document["hash"])]
+            if not documents:
+                feedback.success("✅ Every document in the snapshot is already stored")
+                return True
+
+            wanted = {document["hash"] for document in documents}
+            definitions = {}
+            for definition_chunk_id, abbr, long_form in snapshot.definitions:
+                definitions.setdefault(definition_chunk_id, []).append(
+                    {"chunk_id": definition_chunk_id, "abbr": abbr, "long_form": long_form}
+                )
+            rows = (
+                {
+                    "id": chunk_id(row["document"], row["offset"]),
+                    "document": row["document"],
+                    "text": row["text"],
+                    "offset": row["offset"],
+                    "content_hash": hashlib.sha256(row["text"].encode("utf-8")).hexdigest(),
+                    "embedding": row["embedding"].tolist(),
+                }
+                for row in snapshot.iter_rows() if row["document"] in wanted
+            )
+
+            stored_chunks = 0
+            last = None
+            with self.driver.session() as session:
+                session.run(
+                    """
+                    UNWIND $documents AS document
+                    MERGE (d:Document {hash: document.hash})
+                    SET d.name = document.name, d.size = document.size, d.collections = document.collections,
+                        d.complete = false
+                    """,
+                    documents=documents
+                )
+                embedding_bytes = 8 * snapshot.dimensions
+                for batch in self._batch_rows(rows, max_rows, max_bytes, extra_bytes_per_row=embedding_bytes):
+                    # Snapshot rows are in document and offset order, so each chunk follows the one before
+                    links = []
+                    for row in batch:
+                        if last is not None and last["document"] == row["document"]:
+                            links.append({"source": last["id"], "target": row["id"]})
+                        last = row
+                    batch_definitions = [
+                        definition for row in batch for definition in definitions.get(row["id"], ())
+                    ]
+                    with tracer.span("restore.write", rows=len(batch)):
+                        session.execute_write(self._restore_batch_tx, batch, batch_definitions, links)
+                    for index in self.indexes:
+                        index.add_chunks(batch)
+                    stored_chunks += len(batch)
+                    feedback.progress(
+                        min(stored_chunks / max(snapshot.chunk_count, 1), 1.0),
+                        f"Restored {stored_chunks} chunks"
+                    )
+                session.run(
+                    """
+                    UNWIND $documents AS document
+                    MATCH (d:Document {hash: document.hash})
+                    SET d.complete = true, d.ingested_at = coalesce(datetime(document.ingested_at), datetime())
+                    """,
+                    documents=[{"hash": d["hash"], "ingested_at": d["ingested_at"]} for d in documents]
+                )
+            feedback.clear()
         except Exception as e:
-            st.error(f"Error storing chunks in Neo4j: {str(e)}")
-            success = False
-        
-        return success
+            feedback.clear()
+            feedback.error(f"Error restoring snapshot: {str(e)}")
+            return False
+
+        if self.corpus_stats is not None:
+            self.corpus_stats.record_change(chunks=stored_chunks, documents=len(documents), ingested=True)
+        self._bump_corpus_version()
+        elapsed = time.perf_counter() - start_time
+        feedback.success(
+            f"✅ Restored {len(documents)} documents and {stored_chunks} chunks in {elapsed:.2f}s "
+            f"({stored_chunks / max(elapsed, 1e-9):.0f} chunks/s)"
+        )
+        return True
+
+    @staticmethod
+    def _restore_batch_tx(tx, rows, definitions, links):
+        """Create a batch of restored chunks across documents, with their acronyms and NEXT links"""
+        tx.run(
+            """
+            UNWIND $rows AS row
+            MATCH (d:Document {hash: row.document})
+            CREATE (d)-[:HAS_CHUNK]->(c:TextChunk {
+                id: row.id, text: row.text, embedding: row.embedding,
+                offset: row.offset, content_hash: row.content_hash,
+                document: d.hash, collections: d.collections
+            })
+            """,
+            rows=rows
+        )
+        if definitions:
+            DocumentProcessor._define_acronyms_tx(tx, definitions)
+        if links:
+            tx.run(
+                """
+                UNWIND $links AS link
+                MATCH (a:TextChunk {id: link.source}), (b:TextChunk {id: link.target})
+                CREATE (a)-[:NEXT]->(b)
+                """,
+                links=links
+            )
+
+    def _bump_corpus_version(self):
+        """Invalidate cached answers after the corpus changed"""
+        if self.answer_cache is not None:
+            self.answer_cache.bump_version()
+
+    @staticmethod
+    def _delete_chunks_tx(tx, doc_hash, batch_size):
+        """Delete up to batch_size chunks still attached to a document"""
+        return tx.run(
+            """
+            MATCH (:Document {hash: $hash})-[:HAS_CHUNK]->(c:TextChunk)
+            WITH c, c.id AS id
+            LIMIT $batch_size
+            DETACH DELETE c
+            RETURN collect(id) AS ids
+            """,
+            hash=doc_hash,
+            batch_size=batch_size
+        ).single()
+
+    def _load_previous_chunks(self, session, previous_hash):
+        """Map content hash -> chunk ids for the chunks of an earlier document version"""
+        previous = {}
+        for record in session.run(
+            """
+            MATCH (:Document {hash: $hash})-[:HAS_CHUNK]->(c:TextChunk)
+            RETURN c.id AS id, c.content_hash AS content_hash
+            """,
+            hash=previous_hash
+        ):
+            previous.setdefault(record["content_hash"], []).append(record["id"])
+        return previous
+
+    @staticmethod
+    def _copy_chunks_tx(tx, doc_hash, previous_hash, rows):
+        """Copy a batch of unchanged chunks, with their acronym definitions, onto the new document version
+
+        The previous version keeps its chunks until the new one is complete,
+        so a failed ingest can be thrown away without touching it.
+        """
+        tx.run(
+            """
+            MATCH (d:Document {hash: $hash})
+            UNWIND $rows AS row
+            MATCH (:Document {hash: $previous_hash})-[:HAS_CHUNK]->(old:TextChunk {id: row.old_id})
+            CREATE (d)-[:HAS_CHUNK]->(c:TextChunk {
+                id: row.id, text: old.text, embedding: old.embedding,
+                offset: row.offset, content_hash: old.content_hash,
+                document: d.hash, collections: d.collections
+            })
+            WITH old, c
+            MATCH (a:Acronym)-[r:DEFINED_IN]->(old)
+            CREATE (a)-[:DEFINED_IN {long_form: r.long_form}]->(c)
+            """,
+            hash=doc_hash,
+            previous_hash=previous_hash,
+            rows=rows
+        )
+
+    @staticmethod
+    def _link_chunks_tx(tx, chunk_ids):
+        """Chain chunks (given in document order) with NEXT relationships"""
+        tx.run(
+            """
+            UNWIND range(0, size($ids) - 2) AS i
+            MATCH (a:TextChunk {id: $ids[i]}), (b:TextChunk {id: $ids[i + 1]})
+            MERGE (a)-[:NEXT]->(b)
+            """,
+            ids=chunk_ids
+        )
+
+    def _write_batch_tx(self, tx, doc_hash, previous_hash, copies, new_rows, definitions, chain):
+        """Copy reused chunks, create new ones and chain the batch, all in one transaction"""
+        if copies:
+            self._copy_chunks_tx(tx, doc_hash, previous_hash, copies)
+        if new_rows:
+            self._create_chunks_tx(tx, doc_hash, new_rows, definitions)
+        if len(chain) > 1:
+            self._link_chunks_tx(tx, chain)
+
+    def _store_chunks_in_neo4j(self, doc_hash, rows, previous_hash=None, feedback=None):
+        """Write a stream of chunk rows to Neo4j with one write transaction per batch
+
+        Chunks whose content is unchanged since previous_hash are copied
+        inside Neo4j, keeping their embedding, instead of being sent again. Consecutive chunks
+        are chained with NEXT relationships, including across batches.
+        Returns the number of chunks stored and how many of those were reused.
+        """
+        start_time = time.perf_counter()
+        first_write = None
+        stored = 0
+        reused = 0
+        last_id = None
+        with self.driver.session() as session:
+            previous = self._load_previous_chunks(session, previous_hash) if previous_hash else {}
+            embedding_bytes = 8 * self.embedder.dimensions
+            for batch in self._batch_rows(rows, extra_bytes_per_row=embedding_bytes):
+                copies = []
+                copied_rows = []
+                new_rows = []
+                for row in batch:
+                    old_ids = previous.get(row["content_hash"])
+                    if old_ids:
+                        copies.append({"old_id": old_ids.pop(), "id": row["id"], "offset": row["offset"]})
+                        copied_rows.append(row)
+                    else:
+                        new_rows.append(row)
+
+                if new_rows:
+                    with tracer.span("ingest.embed", rows=len(new_rows)):
+                        # Pure-Python CPU work: it runs in the extraction pool, off the GIL ingest workers share
+                        embeddings = self.extractor.run(self.embedder.embed_batch, [row["text"] for row in new_rows])
+                        for row, embedding in zip(new_rows, embeddings):
+                            row["embedding"] = embedding.tolist()
+                # Acronym definitions are found once, here, in the text of each new chunk
+                definitions = [
+                    {"chunk_id": row["id"], "abbr": abbreviation.upper(), "long_form": long_form}
+                    for row in new_rows
+                    for abbreviation, long_form in find_definitions(row["text"])
+                ]
+                # The chain starts at the previous batch's last chunk so batches join up
+                chain = ([last_id] if last_id else []) + [row["id"] for row in batch]
+                with tracer.span("ingest.write", rows=len(batch)):
+                    session.execute_write(
+                        self._write_batch_tx, doc_hash, previous_hash, copies, new_rows, definitions, chain
+                    )
+                last_id = batch[-1]["id"]
+
+                # The previous version's ids leave the local indexes when it is deleted
+                for index in self.indexes:
+                    index.add_chunks(copied_rows + new_rows)
+
+                if first_write is None:
+                    first_write = time.perf_counter() - start_time
+                stored += len(batch)
+                reused += len(copies)
+
+        elapsed = time.perf_counter() - start_time
+        if stored:
+            (feedback or StreamlitFeedback()).success(
+                f"✅ Stored {stored} chunks in Neo4j ({reused} unchanged) in {elapsed:.2f}s "
+                f"({stored / max(elapsed, 1e-9):.0f} chunks/s, first chunk written after {first_write:.2f}s)"
+            )
+        return stored, reused
+
+    @staticmethod
+    def _batch_rows(rows, max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES, extra_bytes_per_row=0):
+        """Group rows into batches capped by row count and approximate payload size"""
+        batch = []
+        batch_bytes = 0
+        for row in rows:
+            row_bytes = len(row.get("text", "")) + extra_bytes_per_row
+            if batch and (len(batch) >= max_rows or batch_bytes + row_bytes > max_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(row)
+            batch_bytes += row_bytes
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _create_chunks_tx(tx, doc_hash, rows, definitions=()):
+        """Create a batch of TextChunk nodes linked to their document, and link their acronym definitions"""
+        tx.run(
+            """
+            MATCH (d:Document {hash: $hash})
+            UNWIND $rows AS row
+            CREATE (d)-[:HAS_CHUNK]->(c:TextChunk {
+                id: row.id, text: row.text, embedding: row.embedding,
+                offset: row.offset, content_hash: row.content_hash,
+                document: d.hash, collections: d.collections
+            })
+            """,
+            hash=doc_hash,
+            rows=rows
+        )
+        if definitions:
+            DocumentProcessor._define_acronyms_tx(tx, definitions)
 
+    @staticmethod
+    def _define_acronyms_tx(tx, definitions):
+        """Link chunks to the Acronym nodes they define ({"chunk_id", "abbr", "long_form"} rows)"""
+        tx.run(
+            """
+            UNWIND $definitions AS definition
+            MATCH (c:TextChunk {id: definition.chunk_id})
+            MERGE (a:Acronym {abbr: definition.abbr})
+            MERGE (a)-[r:DEFINED_IN]->(c)
+            SET r.long_form = definition.long_form
+            """,
+            definitions=list(definitions)
+        )
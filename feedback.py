@@ -0,0 +1,51 @@
+import logging
+import streamlit as st
+
+
+class StreamlitFeedback:
+    """Shows progress and messages in the running Streamlit script"""
+
+    def __init__(self):
+        self._bar = None
+
+    def progress(self, fraction, text):
+        if self._bar is None:
+            self._bar = st.progress(fraction, text=text)
+        else:
+            self._bar.progress(fraction, text=text)
+
+    def clear(self):
+        if self._bar is not None:
+            self._bar.empty()
+            self._bar = None
+
+    def success(self, message):
+        st.success(message)
+
+    def warning(self, message):
+        st.warning(message)
+
+    def error(self, message):
+        st.error(message)
+
+
+class LogFeedback:
+    """Sends messages to a logger instead of the UI, for headless runs"""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger("nbot")
+
+    def progress(self, fraction, text):
+        self.logger.debug("%3.0f%% %s", fraction * 100, text)
+
+    def clear(self):
+        pass
+
+    def success(self, message):
+        self.logger.info(message)
+
+    def warning(self, message):
+        self.logger.warning(message)
+
+    def error(self, message):
+        self.logger.error(message)
@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from scopes import DEFAULT_COLLECTION
+
+# Job states; queued and running jobs are picked up again after a restart
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Progress is written to SQLite at most this often per job
+PROGRESS_INTERVAL = 0.5
+
+
+class StoredUpload:
+    """A spooled upload read from disk, with the name and size attributes DocumentProcessor expects
+
+    path is the spool file itself, so the extractor's worker processes read
+    it in place instead of the job's bytes being loaded into memory.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JobFeedback:
+    """DocumentProcessor feedback that lands in the job's row instead of the UI"""
+
+    def __init__(self, service, job_id):
+        self.service = service
+        self.job_id = job_id
+        self.messages = []
+        self._last_write = 0.0
+
+    def progress(self, fraction, text):
+        now = time.monotonic()
+        if now - self._last_write >= PROGRESS_INTERVAL or fraction >= 1.0:
+            self._last_write = now
+            self.service._update(self.job_id, progress=fraction, message=text)
+
+    def clear(self):
+        pass
+
+    def success(self, message):
+        self.messages.append(message)
+
+    def warning(self, message):
+        self.messages.append(message)
+
+    def error(self, message):
+        self.messages.append(message)
+
+
+class IngestService:
+    """Background PDF ingestion fed from a persistent SQLite job queue.
+
+    submit() spools the file to disk and queues a job; worker threads claim
+    queued jobs one at a time and run DocumentProcessor.process_pdf on them,
+    recording state, progress and messages in the job's row, so the UI only
+    polls jobs(). Jobs left queued or running when the process stopped are
+    run again on the next start. The CPU-bound work of a job (PDF extraction
+    and embedding) runs in the processor's shared process pool, and worker
+    threads otherwise wait on Neo4j, so throughput grows with the worker
+    count until the pool's processes are busy.
+    """
+
+    def __init__(self, processor, path="ingest_jobs.db", spool_dir="ingest_spool", workers=2):
+        self.processor = processor
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, size INTEGER NOT NULL,
+                path TEXT NOT NULL, state TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0,
+                message TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+        try:
+            # Queues created before documents had collections
+            self._db.execute("ALTER TABLE jobs ADD COLUMN collection TEXT")
+        except sqlite3.OperationalError:
+            pass
+        # Whatever was running when the process stopped starts over
+        self._db.execute("UPDATE jobs SET state = ?, progress = 0 WHERE state = ?", (QUEUED, RUNNING))
+        self._db.commit()
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name, data, collection=DEFAULT_COLLECTION):
+        """Queue a PDF (bytes) for ingestion into a collection and return its job id"""
+        path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            job_id = self._db.execute(
+                "INSERT INTO jobs (name, size, path, collection, state, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, len(data), path, collection, QUEUED, time.time())
+            ).lastrowid
+            self._db.commit()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def jobs(self, limit=20):
+        """The most recent jobs, newest first, as dicts"""
+        with self._lock:
+            cursor = self._db.execute(
+                """
+                SELECT id, name, size, collection, state, progress, message, created_at, started_at, finished_at
+                FROM jobs ORDER BY id DESC LIMIT ?
+                """,
+                (limit,)
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def active(self):
+        """Number of queued or running jobs"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT count(*) FROM jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+
+    def stop(self):
+        """Let the workers finish their current job and exit"""
+        self._stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _claim(self):
+        """Mark the oldest queued job as running and return (id, name, path, collection), or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, name, path, collection FROM jobs WHERE state = ? ORDER BY id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET state = ?, started_at = ?, message = ? WHERE id = ?",
+                (RUNNING, time.time(), "Starting...", row[0])
+            )
+            self._db.commit()
+            return row
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def _work(self):
+        while not self._stopping:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._run(*job)
+
+    def _run(self, job_id, name, path, collection):
+        feedback = JobFeedback(self, job_id)
+        try:
+            with StoredUpload(name, path) as upload:
+                succeeded = self.processor.process_pdf(
+                    upload, feedback=feedback, collection=collection or DEFAULT_COLLECTION
+                )
+        except Exception as e:
+            feedback.error(f"Error processing document: {str(e)}")
+            succeeded = False
+        self._update(
+            job_id, state=DONE if succeeded else FAILED, progress=1.0 if succeeded else 0.0,
+            message="\n".join(feedback.messages), finished_at=time.time()
+        )
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,236 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import random
+import re
+import threading
+import time
+
+from tracing import tracer, percentile
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side failures
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Errors that will fail the same way on every attempt (blocked prompts, bad requests)
+FATAL_ERROR_NAMES = frozenset({"BlockedPromptException", "StopCandidateException", "ValueError", "TypeError"})
+
+STATUS_IN_MESSAGE = re.compile(r"\b([45]\d\d)\b")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is known to be down"""
+
+
+class EmptyResponseError(Exception):
+    """The upstream answered without any text"""
+
+
+class QueueTimeoutError(TimeoutError):
+    """The deadline passed while a request waited to be sent; the upstream was never called"""
+
+
+def is_retryable(error):
+    """Whether a failed call might succeed if simply tried again"""
+    if isinstance(error, (ConnectionError, TimeoutError, EmptyResponseError)):
+        return True
+    if type(error).__name__ in FATAL_ERROR_NAMES:
+        return False
+    # google.api_core errors carry the HTTP status as .code; others may only mention it
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        match = STATUS_IN_MESSAGE.search(str(error))
+        code = int(match.group(1)) if match else None
+    if code is None:
+        # Unknown failures are assumed to be transient; the deadline bounds what that costs
+        return True
+    return code in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after consecutive failures.
+
+    After failure_threshold retryable failures in a row the breaker opens
+    and allow() refuses calls for reset_timeout seconds. Then a single
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it for another reset_timeout.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, name="gemini"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._publish(self.CLOSED)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Whether a call may go ahead now"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self._publish(state)
+                return True
+        tracer.count("llm_breaker_rejections_total", upstream=self.name)
+        return False
+
+    def release(self):
+        """Give back a call allow()ed that never reached the upstream, so another may probe it"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self._publish(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    tracer.count("llm_breaker_trips_total", upstream=self.name)
+                self._opened_at = time.monotonic()
+                self._probing = False
+            self._publish(self._state())
+
+    def _publish(self, state):
+        tracer.set_gauge("llm_breaker_state", (self.CLOSED, self.HALF_OPEN, self.OPEN).index(state),
+                         upstream=self.name)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter under a total deadline.
+
+    Each attempt is given the time left until the deadline as its timeout,
+    a retry only happens if its backoff still ends before the deadline, and
+    fatal errors are raised immediately. Outcomes are reported to the
+    circuit breaker, if one is given; only retryable failures count against
+    the upstream.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=4.0, deadline=15.0, name="gemini", seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.name = name
+        self._rng = random.Random(seed)
+
+    def backoff(self, retry):
+        """Seconds to wait before retry number retry (0-based)"""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def call(self, attempt, breaker=None):
+        """Return attempt(timeout) from the first successful try
+
+        Raises CircuitOpenError if the breaker refuses a try, otherwise the
+        last error once retries, attempts or time run out.
+        """
+        deadline = time.monotonic() + self.deadline
+        for number in range(1, self.max_attempts + 1):
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(f"{self.name} is unavailable, not calling it for now")
+            try:
+                result = attempt(max(deadline - time.monotonic(), 0.001))
+            except QueueTimeoutError:
+                # Never sent, so it says nothing about the upstream; the deadline is spent anyway
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                tracer.count("llm_errors_total", upstream=self.name, kind="retryable" if retryable else "fatal")
+                if breaker is not None and retryable:
+                    breaker.record_failure()
+                elif breaker is not None:
+                    # A fatal error still means the upstream answered
+                    breaker.record_success()
+                delay = self.backoff(number - 1)
+                if not retryable or number == self.max_attempts or time.monotonic() + delay >= deadline:
+                    raise
+                if breaker is not None and breaker.state == breaker.OPEN:
+                    # This failure tripped the breaker; waiting to retry would be pointless
+                    raise CircuitOpenError(f"{self.name} is unavailable, not calling it for now") from e
+                tracer.count("llm_retries_total", upstream=self.name)
+                with tracer.span(f"{self.name}.retry_sleep"):
+                    time.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+class Hedger:
+    """Sends a backup request when the first one is slower than usual.
+
+    Once min_samples latencies have been seen, a call still running after
+    their latency_percentile gets a second, identical request, and whichever
+    succeeds first wins. The slower request is left to finish in the
+    background; its result is discarded.
+    """
+
+    def __init__(self, latency_percentile=95, min_samples=20, window=200, max_workers=8, name="gemini"):
+        self.latency_percentile = latency_percentile
+        self.min_samples = min_samples
+        self.name = name
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-hedge")
+
+    def hedge_delay(self):
+        """Seconds after which a backup request is sent, or None while there is too little history"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return percentile(sorted(self._latencies), self.latency_percentile)
+
+    def call(self, request, timeout):
+        """Return request(timeout) from the first request to succeed within timeout"""
+        start = time.monotonic()
+        end = start + timeout
+        futures = [self._executor.submit(request, timeout)]
+        delay = self.hedge_delay()
+        if delay is not None and delay < timeout:
+            done, _ = wait(futures, timeout=delay)
+            if not done:
+                tracer.count("llm_hedges_total", upstream=self.name)
+                futures.append(self._executor.submit(request, end - time.monotonic()))
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(end - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    with self._lock:
+                        self._latencies.append(time.monotonic() - start)
+                    if future is not futures[0]:
+                        tracer.count("llm_hedge_wins_total", upstream=self.name)
+                    return future.result()
+                error = future.exception()
+        if pending or error is None:
+            raise TimeoutError(f"{self.name} did not answer within {timeout:.1f}s")
+        raise error
+
@@ -0,0 +1,243 @@
+from collections import deque
+import threading
+import time
+
+from llm_retry import QueueTimeoutError
+from tracing import tracer
+
+
+class AbandonedError(Exception):
+    """The call being waited on stopped before it finished"""
+
+
+class Flight:
+    """One in-flight call that others can wait on.
+
+    The leader publish()es pieces of its result as they become available
+    (a streamed answer) and finish()es with the complete result or an
+    error; followers either replay the pieces with follow() or block for
+    the result with wait().
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pieces = []
+        self._finished = False
+        self._result = None
+        self._error = None
+
+    def publish(self, piece):
+        with self._condition:
+            self._pieces.append(piece)
+            self._condition.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._condition:
+            self._finished = True
+            self._result = result
+            self._error = error
+            self._condition.notify_all()
+
+    def follow(self):
+        """Yield the published pieces as they arrive, raising the leader's error at the end"""
+        position = 0
+        while True:
+            with self._condition:
+                while position == len(self._pieces) and not self._finished:
+                    self._condition.wait()
+                pieces = self._pieces[position:]
+                finished, error = self._finished, self._error
+            position += len(pieces)
+            yield from pieces
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+    def wait(self):
+        """The leader's result, once it has finished"""
+        with self._condition:
+            while not self._finished:
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+            return self._result
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one.
+
+    The first caller for a key leads the call; anyone asking for the same
+    key while it runs joins it and gets the leader's result instead of
+    repeating the work. Nothing is kept once the call has finished; that is
+    what the answer cache is for.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join(self, key):
+        """Return (flight, leader): a new flight for the caller to lead, or the one running for key"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                tracer.count("llm_coalesced_requests_total", stage=self.name)
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        """End a flight started by join(); later callers start a new one"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def do(self, key, call, piece=None):
+        """Return call(), or the result of the identical call already running
+
+        piece(result), if given, is published for followers replaying the
+        flight as a stream.
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait()
+        result = None
+        error = AbandonedError(f"{self.name} call was interrupted")
+        try:
+            result = call()
+            if piece is not None:
+                flight.publish(piece(result))
+            error = None
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.finish(key, flight, result, error)
+
+
+class TokenBucket:
+    """Up to capacity tokens, refilled continuously at rate_per_minute (a full minute's worth by default)
+
+    Not locked; RequestScheduler guards it.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    def delay(self, amount):
+        """Seconds until amount tokens are available; 0 if they are now"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # A request bigger than the bucket would never fit; it waits for a full bucket instead
+        return max(min(amount, self.capacity) - self.tokens, 0.0) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RequestScheduler:
+    """Admits LLM requests under requests- and tokens-per-minute limits, fairly across sessions.
+
+    acquire() queues the caller behind the requests already waiting. Each
+    session has its own queue and sessions take turns, so one session's
+    burst can't starve the others; the request at the head is sent once
+    both token buckets have room for it. Without limits requests go
+    straight through, but are still counted. Queue depth and wait times are
+    published as metrics.
+    """
+
+    def __init__(self, rpm=None, tpm=None, name="gemini"):
+        self.name = name
+        self._buckets = [TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None]
+        self._condition = threading.Condition()
+        self._queues = {}       # session -> waiting tickets, oldest first
+        self._turns = deque()   # sessions with waiting requests, next turn first
+        self._waiting = 0
+        self._publish_depth()
+
+    @property
+    def depth(self):
+        """Requests waiting to be sent"""
+        with self._condition:
+            return self._waiting
+
+    def acquire(self, tokens=0, session=None, timeout=None):
+        """Block until a request of about tokens tokens may be sent; returns the seconds waited
+
+        Raises QueueTimeoutError, leaving the queue, if that would take
+        longer than timeout seconds.
+        """
+        ticket = object()
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._condition:
+            if session not in self._queues:
+                self._queues[session] = deque()
+                self._turns.append(session)
+            self._queues[session].append(ticket)
+            self._waiting += 1
+            self._publish_depth()
+            try:
+                while True:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._time_out(timeout)
+                    if self._queues[self._turns[0]][0] is not ticket:
+                        self._condition.wait(remaining)
+                        continue
+                    delay = self._delay(tokens)
+                    if delay <= 0:
+                        break
+                    if remaining is not None and delay > remaining:
+                        # The buckets won't have room in time; no point holding up the queue
+                        self._time_out(timeout)
+                    self._condition.wait(delay)
+                for bucket, amount in zip(self._buckets, (1, tokens)):
+                    if bucket is not None:
+                        bucket.take(amount)
+            finally:
+                self._leave(ticket, session)
+                self._condition.notify_all()
+
+        waited = time.monotonic() - start
+        tracer.record(f"{self.name}.queue_wait", waited)
+        tracer.count("llm_scheduled_requests_total", upstream=self.name)
+        tracer.count("llm_queue_wait_seconds_total", waited, upstream=self.name)
+        return waited
+
+    def _time_out(self, timeout):
+        tracer.count("llm_queue_timeouts_total", upstream=self.name)
+        raise QueueTimeoutError(f"{self.name} request could not be sent within {timeout:.1f}s under the rate limits")
+
+    def _delay(self, tokens):
+        return max(
+            bucket.delay(amount) if bucket is not None else 0.0
+            for bucket, amount in zip(self._buckets, (1, tokens))
+        )
+
+    def _leave(self, ticket, session):
+        """Take a ticket out of its queue; a session that got its turn goes to the back"""
+        queue = self._queues[session]
+        had_turn = self._turns[0] == session and queue[0] is ticket
+        queue.remove(ticket)
+        if had_turn:
+            self._turns.popleft()
+            if queue:
+                self._turns.append(session)
+        elif not queue:
+            self._turns.remove(session)
+        if not queue:
+            del self._queues[session]
+        self._waiting -= 1
+        self._publish_depth()
+
+    def _publish_depth(self):
+        tracer.set_gauge("llm_queue_depth", self._waiting, upstream=self.name)
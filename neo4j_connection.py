@@ -0,0 +1,134 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+from neo4j import GraphDatabase
+
+from tracing import tracer
+
+# Connection pool settings used unless overridden (e.g. from a [neo4j_pool] secrets section)
+DEFAULT_POOL_SETTINGS = {
+    "max_connection_pool_size": 50,
+    "connection_acquisition_timeout": 30.0,   # seconds to wait for a free connection
+    "max_connection_lifetime": 3600,          # seconds before a pooled connection is recycled
+}
+
+_drivers = {}
+_drivers_lock = threading.Lock()
+
+
+def pool_settings(overrides=None):
+    """Default pool settings updated with any overrides"""
+    settings = dict(DEFAULT_POOL_SETTINGS)
+    settings.update(overrides or {})
+    return settings
+
+
+def get_driver(uri, user, password, settings=None):
+    """Process-wide shared Neo4j driver for these credentials and pool settings"""
+    settings = pool_settings(settings)
+    key = (uri, user, password, tuple(sorted(settings.items())))
+    with _drivers_lock:
+        driver = _drivers.get(key)
+        if driver is None:
+            driver = _drivers[key] = GraphDatabase.driver(uri, auth=(user, password), **settings)
+        return driver
+
+
+@atexit.register
+def close_all_drivers():
+    """Close every shared driver"""
+    with _drivers_lock:
+        for driver in _drivers.values():
+            driver.close()
+        _drivers.clear()
+
+
+class CorpusStats:
+    """Chunk count, document count and last ingest time of the complete documents.
+
+    Ingest updates the numbers directly through record_change(); otherwise
+    they are re-read from Neo4j at most once per ttl_seconds, which keeps
+    full counts off the per-rerun and per-question paths.
+
+    Changes this process makes to the stored chunks run inside changing():
+    local indexes follow them batch by batch but the numbers only move at
+    the end, so the two are only comparable while none is in progress.
+    """
+
+    def __init__(self, driver, ttl_seconds=60):
+        self.driver = driver
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._stats = {"chunks": 0, "documents": 0, "last_ingest": None, "error": None}
+        self._refreshed_at = None
+        self._changes_in_progress = 0
+        self._changes_started = 0
+
+    def snapshot(self):
+        """Current stats, refreshed from Neo4j if they are older than the TTL"""
+        with self._lock:
+            stale = self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.ttl_seconds
+        if stale:
+            self.refresh()
+        with self._lock:
+            return dict(self._stats)
+
+    def refresh(self):
+        """Re-read the stats from Neo4j"""
+        try:
+            with tracer.span("neo4j.corpus_stats"), self.driver.session() as session:
+                # Chunks of documents still being ingested are not in the corpus yet
+                record = session.run(
+                    """
+                    MATCH (d:Document)
+                    WHERE d.complete
+                    OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:TextChunk)
+                    WITH d, count(c) AS chunks
+                    RETURN count(d) AS documents, sum(chunks) AS chunks, max(d.ingested_at) AS last_ingest
+                    """
+                ).single()
+            stats = {
+                "chunks": record["chunks"],
+                "documents": record["documents"],
+                "last_ingest": str(record["last_ingest"])[:19] if record["last_ingest"] else None,
+                "error": None,
+            }
+        except Exception as e:
+            with self._lock:
+                stats = dict(self._stats, error=str(e))
+        with self._lock:
+            self._stats = stats
+            self._refreshed_at = time.monotonic()
+
+    @contextmanager
+    def changing(self):
+        """Mark a change to the stored chunks (ingest, restore, delete) as in progress"""
+        with self._lock:
+            self._changes_in_progress += 1
+            self._changes_started += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._changes_in_progress -= 1
+
+    def change_state(self):
+        """(changes in progress, changes started so far)"""
+        with self._lock:
+            return self._changes_in_progress, self._changes_started
+
+    @contextmanager
+    def unchanged_since(self, started):
+        """Hold off new changes and yield whether none ran since change_state() returned started"""
+        with self._lock:
+            yield self._changes_in_progress == 0 and self._changes_started == started
+
+    def record_change(self, chunks=0, documents=0, ingested=False):
+        """Apply a change made by ingest without a round trip to Neo4j"""
+        with self._lock:
+            self._stats["chunks"] = max(self._stats["chunks"] + chunks, 0)
+            self._stats["documents"] = max(self._stats["documents"] + documents, 0)
+            if ingested:
+                self._stats["last_ingest"] = time.strftime("%Y-%m-%dT%H:%M:%S")
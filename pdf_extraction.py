@@ -0,0 +1,161 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import PyPDF2
+
+# Shorter documents are extracted in the calling thread; the pool is started once and
+# shared, so only the temporary file is paid per document
+PARALLEL_MIN_PAGES = 2
+
+# Pages handed to a worker per task, so each task amortises its scheduling cost
+PAGES_PER_TASK = 8
+
+
+class PageResult(NamedTuple):
+    page_number: int            # 1-based
+    page_count: int
+    text: str
+    error: Optional[str] = None
+
+
+def _extract_page(reader, index, page_count):
+    try:
+        return PageResult(index + 1, page_count, reader.pages[index].extract_text() or "")
+    except Exception as e:
+        return PageResult(index + 1, page_count, "", str(e))
+
+
+# Per-worker state: tasks name the spooled PDF by path, and each worker
+# parses it once and keeps the reader for the rest of that document's tasks.
+_worker_readers = {}
+
+
+def _extract_page_range(page_range):
+    path, start, end, page_count = page_range
+    reader = _worker_readers.get(path)
+    if reader is None:
+        _worker_readers.clear()
+        reader = _worker_readers[path] = PyPDF2.PdfReader(path)
+    return [_extract_page(reader, i, page_count) for i in range(start, end)]
+
+
+def _process_context():
+    """Start workers from a clean server process; forking the threaded app could copy a held lock"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class PdfTextExtractor:
+    """Page-level PDF text extraction, spread over a process pool for large files.
+
+    PyPDF2 extraction is CPU-bound, so big documents are split into page
+    ranges that run in separate processes; small ones are extracted
+    serially in the calling thread. Pages always come back in order, and a
+    page that fails is reported in its PageResult instead of aborting the
+    whole document. One pool is started on first use and shared by every
+    document, including documents extracted at the same time; run() hands
+    it other CPU-bound work of the ingest, such as embedding.
+    """
+
+    def __init__(self, max_workers=None, pages_per_task=PAGES_PER_TASK,
+                 parallel_min_pages=PARALLEL_MIN_PAGES):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.parallel_min_pages = parallel_min_pages
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_process_context())
+            return self._executor
+
+    def run(self, function, *args):
+        """Return function(*args), computed in the worker pool (in this thread with one worker)
+
+        function and its arguments are pickled, so it must be a module-level
+        function or a method of a picklable object.
+        """
+        if self.max_workers <= 1:
+            return function(*args)
+        return self._pool().submit(function, *args).result()
+
+    def close(self):
+        """Shut the worker processes down; a later document starts a new pool"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def iter_pages(self, source):
+        """Yield a PageResult per page, in page order
+
+        source is PDF bytes or a seekable binary file object. The serial
+        path reads the file object in place; the parallel path hands the
+        workers the file's path if it has one (a path attribute, as on
+        ingest_service.StoredUpload) and otherwise spools the bytes to a
+        temporary file once for them to read. At most two tasks per worker
+        are in flight, so extracted text never piles up faster than the
+        caller consumes it.
+        """
+        stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        stream.seek(0)
+        reader = PyPDF2.PdfReader(stream)
+        page_count = len(reader.pages)
+
+        if self.max_workers <= 1 or page_count < self.parallel_min_pages:
+            for i in range(page_count):
+                yield _extract_page(reader, i, page_count)
+            return
+
+        path = getattr(source, "path", None)
+        spooled = path is None
+        if spooled:
+            path = self._spool(source)
+        try:
+            ranges = [
+                (path, start, min(start + self.pages_per_task, page_count), page_count)
+                for start in range(0, page_count, self.pages_per_task)
+            ]
+            in_flight = 2 * min(self.max_workers, len(ranges))
+            executor = self._pool()
+            pending = deque()
+            try:
+                for page_range in ranges:
+                    pending.append(executor.submit(_extract_page_range, page_range))
+                    if len(pending) >= in_flight:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                # A caller that stops early leaves no work behind in the shared pool
+                for future in pending:
+                    future.cancel()
+        finally:
+            if spooled:
+                os.remove(path)
+
+    @staticmethod
+    def _spool(source):
+        """Write PDF bytes or an in-memory file to a temporary file and return its path"""
+        if isinstance(source, (bytes, bytearray)):
+            pdf_bytes = source
+        elif hasattr(source, "getvalue"):
+            pdf_bytes = source.getvalue()
+        else:
+            source.seek(0)
+            pdf_bytes = source.read()
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+            spool.write(pdf_bytes)
+        return spool.name
+
+    def extract(self, source):
+        """Extract every page, returning a list of PageResult in page order"""
+        return list(self.iter_pages(source))
@@ -1,241 +1,660 @@
 import streamlit as st
-from neo4j import GraphDatabase
 import json
 import google.generativeai as genai
 import time
-import re
+import threading
+from search_index import BM25Index
+from vector_index import VectorIndex
+from answer_cache import AnswerCache, normalize_question
+from async_retrieval import AsyncRetriever, neighbour_query, rank_neighbours
+from neo4j_connection import get_driver, CorpusStats
+from tracing import tracer, debug
+from feedback import StreamlitFeedback
+from document_processor import DOCUMENT_ID_LENGTH, chunk_id
+from corpus_snapshot import CorpusSnapshot
+from scopes import scope_condition
+from acronyms import acronym_candidates
+from context_packing import pack_context, estimate_tokens, DEFAULT_TOKEN_BUDGET
+from llm_retry import (
+    RetryPolicy, CircuitBreaker, Hedger, CircuitOpenError, EmptyResponseError, QueueTimeoutError, is_retryable
+)
+from llm_scheduler import AbandonedError, RequestScheduler, SingleFlight
+
+GEMINI_MODEL_NAME = "gemini-1.0-pro"
+
+GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+SAFETY_SETTINGS = [
+    {"category": category, "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
+    for category in (
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+    )
+]
+
+# Retrieval modes that rank chunks with the local BM25 and vector indexes
+LOCAL_INDEX_MODES = ("bm25", "vector", "hybrid")
+
+# Canned replies; these are never cached
+NO_CONTEXT_ANSWER = "I don't have enough information to answer that question. Please upload relevant documents."
+TECHNICAL_ISSUE_ANSWER = "I encountered a technical issue. Please check your API configuration and try again."
+CONTEXT_ONLY_ANSWER = "⚠️ I can't reach the answer service right now. These are the most relevant passages from your documents:"
 
 class Chatbot:
-    def __init__(self, uri, user, password, database="neo4j"):
-        """Initialize Neo4j connection"""
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri, user, password, database="neo4j", retrieval_mode="bm25", answer_cache=None,
+                 driver_settings=None, retry_policy=None, circuit_breaker=None, hedge_requests=False,
+                 context_token_budget=DEFAULT_TOKEN_BUDGET, neighbour_hops=1, expand_top=3, api_key=None,
+                 feedback=None, scheduler=None, snapshot_path=None):
+        """Initialize Neo4j connection
+
+        retrieval_mode is "bm25" (local keyword ranking), "vector" (local
+        hashed-embedding similarity), "graph" (Neo4j strategies run
+        concurrently and rank-fused) or "hybrid" (graph plus the local
+        BM25 and vector rankings in the same fusion).
+        answer_cache defaults to an in-memory AnswerCache.
+        driver_settings override the shared driver's pool settings.
+        retry_policy and circuit_breaker govern Gemini calls (defaults:
+        RetryPolicy() and CircuitBreaker()); hedge_requests sends a backup
+        request when a non-streamed answer is slower than usual.
+        context_token_budget caps the estimated tokens of context per prompt.
+        The expand_top best hits are expanded with up to neighbour_hops
+        chunks on either side along NEXT relationships (0 disables this).
+        api_key defaults to the [gemini] api_key secret. feedback receives
+        warnings and errors (default: StreamlitFeedback; LogFeedback for
+        headless use). scheduler (a RequestScheduler, unlimited by default)
+        admits every Gemini request, retries and hedges included.
+        snapshot_path names a corpus snapshot to build the local indexes
+        from, as long as it holds exactly the documents stored in Neo4j.
+        """
+        self.driver = get_driver(uri, user, password, driver_settings)
+        self.corpus_stats = CorpusStats(self.driver)
         self.database = database
+        self.retrieval_mode = retrieval_mode
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache()
+
+        # Local indexes mirroring the TextChunk store; DocumentProcessor keeps them up to date
+        self.search_index = BM25Index()
+        self.vector_index = VectorIndex()
+        # Stored chunk count the local indexes were last rebuilt for, and the rebuild in progress
+        self._synced_chunks = None
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        if retrieval_mode in LOCAL_INDEX_MODES:
+            if not (snapshot_path and self._load_snapshot_index(snapshot_path)):
+                self._load_search_index()
+
+        # Concurrent Neo4j retrieval for graph and hybrid modes
+        self.retriever = None
+        if retrieval_mode in ("graph", "hybrid"):
+            local_strategies = {}
+            if retrieval_mode == "hybrid":
+                local_strategies = {"bm25": self.search_index.search, "vector": self.vector_index.search}
+            self.retriever = AsyncRetriever(
+                uri, user, password, local_strategies=local_strategies, driver_settings=driver_settings,
+                neighbour_hops=neighbour_hops, expand_top=expand_top
+            )
         
-        # Configure Gemini API
+        # The Gemini client is created on first use; start_health_probe() checks it in the background
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.gemini_status = {"state": "unchecked", "detail": None, "latency": None}
+
+        # Gemini calls retry with backoff under a deadline and fail fast while the breaker is open
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.hedger = Hedger() if hedge_requests else None
+        self.context_token_budget = context_token_budget
+        self.neighbour_hops = neighbour_hops
+        self.expand_top = expand_top
+        self.feedback = feedback or StreamlitFeedback()
+        self.scheduler = scheduler or RequestScheduler()
+
+        # Identical questions in flight at the same time share one retrieval and one Gemini call
+        self._retrieval_flights = SingleFlight("retrieval")
+        self._answer_flights = SingleFlight("answer")
+
+        # Document keys per collection, valid until the corpus version changes
+        self._collection_documents = {}
+        self._collections_version = None
+
+        # Configure Gemini API (no network call)
         try:
-            GEMINI_API_KEY = st.secrets["gemini"]["api_key"]
+            GEMINI_API_KEY = api_key or st.secrets["gemini"]["api_key"]
             genai.configure(api_key=GEMINI_API_KEY)
-            
-            # Verify API key by making a simple test call
-            try:
-                model = genai.GenerativeModel("gemini-1.0-pro")
-                _ = model.generate_content("Test")
-                print("✅ Gemini API configured and tested successfully")
-            except Exception as e:
-                print(f"⚠️ Gemini API test failed: {str(e)}")
         except Exception as e:
             print(f"❌ Error configuring Gemini API: {str(e)}")
+            self.gemini_status = {"state": "error", "detail": str(e), "latency": None}
 
     def close(self):
-        """Close Neo4j connection"""
-        self.driver.close()
+        """Close the async retrieval connection; the shared driver is closed at exit"""
+        if self.retriever is not None:
+            self.retriever.close()
 
-    def chat(self, user_input):
-        """Process user query, retrieve knowledge from Neo4j, and generate chatbot response"""
-        if not user_input or user_input.strip() == "":
-            return "Please ask a question."
-        
-        # Debug info
-        st.info(f"Searching for information about: '{user_input}'")
-        
-        # Check if database has any content
-        db_has_content = self._check_database_has_content()
-        if not db_has_content:
-            return "The knowledge base appears to be empty. Please upload a document first."
-            
-        # First try exact keyword search
-        text_chunks = self._find_relevant_text_exact(user_input)
-        if text_chunks:
-            st.info(f"Found {len(text_chunks)} chunks with exact match")
-        
-        # If no results, try fuzzy search with individual keywords
-        if not text_chunks:
-            st.info("No exact matches found, trying keyword search...")
-            text_chunks = self._find_relevant_text_keywords(user_input)
-            if text_chunks:
-                st.info(f"Found {len(text_chunks)} chunks with keyword search")
-            
-        # If still no results, try searching for acronyms or abbreviations
-        if not text_chunks and len(user_input) <= 5:
-            st.info("Trying acronym/abbreviation search...")
-            text_chunks = self._find_text_with_acronym(user_input)
-            if text_chunks:
-                st.info(f"Found {len(text_chunks)} chunks with acronym search")
-            
-        # If still no results, get some random chunks as context
-        if not text_chunks:
-            st.info("No specific matches found, retrieving sample chunks...")
-            text_chunks = self._get_sample_chunks()
-            if text_chunks:
-                st.info(f"Retrieved {len(text_chunks)} sample chunks")
-        
-        # Generate response using Gemini
+    def _get_model(self):
+        """The shared Gemini model client, created once on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = genai.GenerativeModel(
+                        model_name=GEMINI_MODEL_NAME,
+                        generation_config=GENERATION_CONFIG,
+                        safety_settings=SAFETY_SETTINGS
+                    )
+        return self._model
+
+    def start_health_probe(self):
+        """Check the Gemini API in a background thread; the result lands in gemini_status"""
+        if self.gemini_status["state"] in ("checking", "error"):
+            return
+
+        def probe():
+            start = time.perf_counter()
+            try:
+                self._get_model().generate_content("ping", generation_config={"max_output_tokens": 1})
+                self.gemini_status = {
+                    "state": "ok", "detail": None, "latency": time.perf_counter() - start
+                }
+            except Exception as e:
+                self.gemini_status = {
+                    "state": "error", "detail": str(e), "latency": time.perf_counter() - start
+                }
+
+        self.gemini_status = {"state": "checking", "detail": None, "latency": None}
+        threading.Thread(target=probe, name="gemini-health-probe", daemon=True).start()
+
+    @property
+    def local_indexes(self):
+        """Local indexes that DocumentProcessor should keep in step with Neo4j"""
+        return [self.search_index, self.vector_index]
+
+    def _load_search_index(self, indexes=None, batch_size=1000):
+        """Build local BM25 and vector indexes from the chunks of the documents stored in Neo4j
+
+        indexes default to the live ones. Only complete documents are
+        loaded, as corpus_stats counts them; returns True on success.
+        """
+        indexes = self.local_indexes if indexes is None else indexes
         try:
-            response = self._generate_gemini_response(user_input, text_chunks)
-            return response
+            with tracer.span("neo4j.load_index"), self.driver.session() as session:
+                results = session.run(
+                    """
+                    MATCH (d:Document)-[:HAS_CHUNK]->(c:TextChunk)
+                    WHERE d.complete
+                    RETURN c.id AS id, c.text AS text, c.embedding AS embedding
+                    """
+                )
+                batch = []
+                for record in results:
+                    batch.append(dict(record))
+                    if len(batch) >= batch_size:
+                        for index in indexes:
+                            index.add_chunks(batch)
+                        batch = []
+                for index in indexes:
+                    index.add_chunks(batch)
+            print(f"✅ Loaded {len(indexes[0])} chunks into the local search indexes")
+            return True
         except Exception as e:
-            st.error(f"Error generating response: {str(e)}")
-            return f"⚠️ Error generating response: {str(e)}"
+            print(f"⚠️ Could not build local search index: {str(e)}")
+            return False
 
-    def _check_database_has_content(self):
-        """Check if the database has any content"""
+    def _load_snapshot_index(self, path):
+        """Build the local indexes from a corpus snapshot; False if it is missing or out of date"""
         try:
-            with self.driver.session() as session:
-                result = session.run("MATCH (c:TextChunk) RETURN count(c) as count").single()
-                count = result["count"] if result else 0
-                st.info(f"Found {count} chunks in the database")
-                return count > 0
+            with tracer.span("snapshot.load_index"), CorpusSnapshot(path) as snapshot:
+                with self.driver.session() as session:
+                    stored = {
+                        record["hash"]
+                        for record in session.run("MATCH (d:Document) WHERE d.complete RETURN d.hash AS hash")
+                    }
+                if stored != snapshot.document_hashes():
+                    print(f"⚠️ Corpus snapshot {path} is out of date, loading the local indexes from Neo4j")
+                    return False
+                # Embeddings from another embedder are recomputed rather than mixed in
+                keep_embeddings = snapshot.dimensions == self.vector_index.embedder.dimensions
+                for group in snapshot.groups():
+                    rows = [
+                        {
+                            "id": chunk_id(snapshot.documents[number]["hash"], offset),
+                            "text": text,
+                            "embedding": embedding if keep_embeddings else None,
+                        }
+                        for number, offset, text, embedding in zip(
+                            group.documents.tolist(), group.offsets.tolist(), group.texts, group.embeddings
+                        )
+                    ]
+                    for index in self.local_indexes:
+                        index.add_chunks(rows)
+            print(f"✅ Loaded {len(self.search_index)} chunks into the local search indexes from {path}")
+            return True
+        except FileNotFoundError:
+            print(f"⚠️ Corpus snapshot {path} not found, loading the local indexes from Neo4j")
+            return False
         except Exception as e:
-            st.error(f"Error checking database content: {str(e)}")
+            print(f"⚠️ Could not load corpus snapshot {path}: {str(e)}")
             return False
 
-    def _find_relevant_text_exact(self, query_text):
-        """Retrieve relevant text chunks from Neo4j using exact match"""
+    def chat(self, user_input, session=None, scope=None):
+        """Process user query, retrieve knowledge from Neo4j, and generate chatbot response
+
+        session identifies the asking user for fair scheduling of Gemini
+        requests; scope (a scopes.Scope: one document or one collection)
+        limits retrieval to part of the corpus, None searches all of it.
+        """
+        reply, text_chunks, cache_key = self._prepare_answer(user_input, scope)
+        if reply is not None:
+            return reply
+        return self.generate_answer(user_input, text_chunks, cache_key, session)[0]
+
+    def generate_answer(self, user_input, text_chunks, cache_key, session=None):
+        """Answer a question from context returned by prepare_answers()
+
+        Returns (answer, generated, prompt_tokens); only generated answers
+        are cached, and prompt_tokens is the estimated size of the prompt
+        the answer came from (0 when no prompt was sent). A caller asking
+        while the same answer is being generated shares it.
+        """
         try:
-            with self.driver.session() as session:
-                results = session.run(
-                    """
-                    MATCH (c:TextChunk)
-                    WHERE toLower(c.text) CONTAINS toLower($query_text)
-                    RETURN c.text AS text, c.id AS id
-                    LIMIT 5
-                    """,
-                    query_text=query_text
-                )
-                chunks = []
-                for record in results:
-                    chunks.append(record["text"])
-                    st.info(f"Found match in chunk {record['id']}")
-                return chunks
+            return self._answer_flights.do(
+                cache_key, lambda: self._generate_answer(user_input, text_chunks, cache_key, session),
+                piece=lambda result: result[0]
+            )
         except Exception as e:
-            st.error(f"Error querying Neo4j: {str(e)}")
-            return []
+            self.feedback.error(f"Error generating response: {str(e)}")
+            return f"⚠️ Error generating response: {str(e)}", False, 0
 
-    def _find_relevant_text_keywords(self, query_text):
-        """Retrieve relevant text chunks from Neo4j using keywords"""
-        # Extract meaningful keywords (words longer than 3 characters)
-        keywords = [word.strip().lower() for word in query_text.split() if len(word.strip()) > 3]
-        
-        # If no meaningful keywords, use all words
-        if not keywords:
-            keywords = [word.strip().lower() for word in query_text.split() if len(word.strip()) > 0]
-            
-        st.info(f"Searching with keywords: {keywords}")
-        
-        results = []
-        
+    def _generate_answer(self, user_input, text_chunks, cache_key, session):
+        # Generate response using Gemini
+        response, generated, prompt_tokens = self._generate_gemini_response(user_input, text_chunks, session)
+        if generated:
+            self.answer_cache.put(cache_key, response)
+        return response, generated, prompt_tokens
+
+    def chat_stream(self, user_input, session=None, scope=None):
+        """Like chat(), but yield the answer piece by piece as Gemini generates it
+
+        Failures before the first piece are retried like in chat(); once text
+        has been yielded the answer can't be restarted, so a later failure
+        ends the stream with a note instead. Streams are never hedged. A
+        caller asking while the same answer is being generated replays that
+        stream instead of starting another.
+        """
+        reply, text_chunks, cache_key = self._prepare_answer(user_input, scope)
+        if reply is not None:
+            yield reply
+            return
+
+        flight, leader = self._answer_flights.join(cache_key)
+        if not leader:
+            try:
+                yield from flight.follow()
+            except Exception as e:
+                yield f"\n\n⚠️ The answer was cut off: {str(e)}"
+            return
+
+        parts = []
+        usage = {"prompt_tokens": 0}
+        error = AbandonedError("the answer stream was abandoned")
         try:
-            with self.driver.session() as session:
-                for keyword in keywords:
-                    query_results = session.run(
-                        """
-                        MATCH (c:TextChunk)
-                        WHERE toLower(c.text) CONTAINS toLower($keyword)
-                        RETURN c.text AS text, c.id AS id
-                        LIMIT 3
-                        """,
-                        keyword=keyword
-                    )
-                    for record in query_results:
-                        if record["text"] not in results:
-                            st.info(f"Found keyword '{keyword}' in chunk {record['id']}")
-                            results.append(record["text"])
-                            if len(results) >= 5:  # Limit to 5 chunks
-                                return results
-                return results
+            for piece in self._stream_answer(user_input, text_chunks, cache_key, session, usage):
+                flight.publish(piece)
+                parts.append(piece)
+                yield piece
+            error = None
+        finally:
+            # Followers blocked in chat() get the text, but not as a cacheable answer
+            self._answer_flights.finish(cache_key, flight, ("".join(parts), False, usage["prompt_tokens"]), error)
+
+    def _stream_answer(self, user_input, text_chunks, cache_key, session, usage):
+        """Gemini's answer as it streams in, or a fallback reply; never raises
+
+        The estimated prompt tokens are stored in usage["prompt_tokens"].
+        """
+        if not text_chunks:
+            yield NO_CONTEXT_ANSWER
+            return
+
+        try:
+            prompt, prompt_tokens = self._build_prompt(user_input, text_chunks)
         except Exception as e:
-            st.error(f"Error querying Neo4j with keywords: {str(e)}")
-            return []
+            self.feedback.error(f"Error generating response: {str(e)}")
+            yield f"⚠️ Error generating response: {str(e)}"
+            return
+        usage["prompt_tokens"] = prompt_tokens
+
+        def start_stream(timeout):
+            timeout = self._throttle(prompt_tokens, session, timeout)
+            # Not a span: the consumer renders between pieces, so time it by hand
+            attempt_start = time.perf_counter()
+            stream = iter(self._get_model().generate_content(
+                prompt, stream=True, request_options={"timeout": timeout}
+            ))
+            for piece in stream:
+                if piece.text:
+                    tracer.record("gemini.first_token", time.perf_counter() - attempt_start)
+                    return piece.text, stream
+            raise EmptyResponseError("Empty response from Gemini")
 
-    def _find_text_with_acronym(self, acronym):
-        """Search for text chunks that might contain the expanded form of an acronym"""
         try:
-            with self.driver.session() as session:
-                # First try to find exact acronym
+            first_piece, stream = self.retry_policy.call(start_stream, self.circuit_breaker)
+        except Exception as e:
+            yield self._fallback_answer(e, text_chunks)
+            return
+
+        parts = [first_piece]
+        yield first_piece
+        try:
+            for piece in stream:
+                if piece.text:
+                    parts.append(piece.text)
+                    yield piece.text
+        except Exception as e:
+            yield f"\n\n⚠️ The answer was cut off: {str(e)}"
+            return
+        self.answer_cache.put(cache_key, "".join(parts))
+
+    def _prepare_answer(self, user_input, scope=None):
+        """Retrieve context for a question; see prepare_answers()
+
+        Identical questions asked at the same time share one retrieval.
+        """
+        return self._retrieval_flights.do(
+            (scope, normalize_question(user_input or "")), lambda: self.prepare_answers([user_input], scope)[0]
+        )
+
+    def prepare_answers(self, questions, scope=None):
+        """Retrieve context for several questions, sharing the Neo4j round trips
+
+        Returns a (reply, text_chunks, cache_key) triple per question; reply
+        is set when the answer is known without calling Gemini (empty
+        question, empty knowledge base or a cache hit). Local hits of all
+        questions are fetched, and expanded to their neighbours, in one
+        query; graph and hybrid retrieval do both in each question's single
+        text fetch. Every retrieval query is limited to scope, if given.
+        """
+        prepared = [None] * len(questions)
+        pending = []
+        for i, user_input in enumerate(questions):
+            if not user_input or user_input.strip() == "":
+                prepared[i] = ("Please ask a question.", [], None)
+            else:
+                # Debug info
+                debug(f"Searching for information about: '{user_input}'")
+                pending.append(i)
+        if not pending:
+            return prepared
+
+        documents = self._scope_documents(scope)
+        if self.retrieval_mode in LOCAL_INDEX_MODES:
+            self._sync_local_indexes()
+        # Rank chunks in-process when the local indexes are populated; only the winners are fetched
+        if self.retrieval_mode in ("bm25", "vector") and len(self.search_index) > 0:
+            found = []
+            hit_lists = [self._local_hits(questions[i], documents) for i in pending]
+            hit_lists = self._add_acronym_hits([questions[i] for i in pending], hit_lists, scope)
+            for text_chunks in self._fetch_chunks_for_hits(hit_lists):
+                if not text_chunks:
+                    debug("No local matches found, retrieving sample chunks...")
+                    text_chunks = self._get_sample_chunks(scope)
+                found.append(text_chunks)
+        else:
+            found = self._find_relevant_text_graph([questions[i] for i in pending], scope, documents)
+
+        for i, text_chunks in zip(pending, found):
+            if text_chunks is None:
+                prepared[i] = ("The knowledge base appears to be empty. Please upload a document first.", [], None)
+                continue
+            # Reuse the answer if the same question already got this exact context
+            cache_key = self.answer_cache.make_key(questions[i], [chunk["id"] for chunk in text_chunks])
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                debug("Answer served from cache")
+                prepared[i] = (cached, text_chunks, cache_key)
+                continue
+            prepared[i] = (None, text_chunks, cache_key)
+        return prepared
+
+    def _sync_local_indexes(self):
+        """Rebuild the local indexes in the background when they miss chunks stored in Neo4j
+
+        That happens when the startup load failed or another process (a
+        second app instance, corpus_snapshot.py import) wrote or deleted
+        chunks. The corpus stats are cached, so the check is free per
+        question; it is skipped while this process is changing the chunks,
+        as the indexes run ahead of the stats until the change ends. A
+        rebuild starts at most once per stored chunk count.
+        """
+        in_progress, _ = self.corpus_stats.change_state()
+        if in_progress:
+            return
+        stored = self.corpus_stats.snapshot()["chunks"]
+        if stored == len(self.search_index) or stored == self._synced_chunks:
+            return
+        with self._sync_lock:
+            if stored == self._synced_chunks or self._sync_thread is not None:
+                return
+            self._synced_chunks = stored
+            debug(f"Neo4j holds {stored} chunks, the local indexes {len(self.search_index)}; rebuilding them")
+            self._sync_thread = threading.Thread(
+                target=self._rebuild_local_indexes, name="local-index-rebuild", daemon=True
+            )
+            self._sync_thread.start()
+
+    def _rebuild_local_indexes(self):
+        """Load fresh local indexes from Neo4j and swap them in, unless a local change ran meanwhile"""
+        try:
+            _, started = self.corpus_stats.change_state()
+            fresh = [BM25Index(), VectorIndex(self.vector_index.embedder)]
+            if not self._load_search_index(fresh):
+                return
+            with self.corpus_stats.unchanged_since(started) as unchanged:
+                if unchanged:
+                    for index, rebuilt in zip(self.local_indexes, fresh):
+                        index.replace_with(rebuilt)
+            if not unchanged:
+                # The change kept the live indexes up to date; check again once it is counted
+                debug("Chunks changed during the local index rebuild; discarding it")
+                self._synced_chunks = None
+        finally:
+            with self._sync_lock:
+                self._sync_thread = None
+
+    def _find_relevant_text_graph(self, questions, scope=None, documents=None):
+        """Run the retrieval strategies concurrently for each question
+
+        Returns a chunk list per question; the lists are None when the
+        database is empty.
+        """
+        found = [[] for _ in questions]
+        if self.retriever is not None:
+            with tracer.span("retrieval.graph"):
+                results = self.retriever.retrieve_many(questions, scope=scope, documents=documents)
+            for i, result in enumerate(results):
+                for strategy in result.strategies:
+                    if strategy.error:
+                        self.feedback.warning(f"{strategy.name} search failed: {strategy.error}")
+                    else:
+                        debug(f"{strategy.name} search: {len(strategy.chunks)} chunks in {strategy.elapsed:.2f}s")
+                if result.cancelled:
+                    debug(f"Cancelled {', '.join(result.cancelled)} search after enough results or the deadline")
+                if result.chunks:
+                    debug(f"Found {len(result.chunks)} chunks in {result.elapsed:.2f}s")
+                found[i] = result.chunks
+
+        if all(found):
+            return found
+        # Only a miss pays for the content check
+        if not self._check_database_has_content():
+            return [text_chunks or None for text_chunks in found]
+
+        # If still no results, get some random chunks as context
+        for i, text_chunks in enumerate(found):
+            if not text_chunks:
+                debug("No specific matches found, retrieving sample chunks...")
+                found[i] = self._get_sample_chunks(scope)
+                debug(f"Retrieved {len(found[i])} sample chunks")
+        return found
+
+    def _scope_documents(self, scope):
+        """Document keys of the chunks in scope, for filtering the local indexes; None for everything"""
+        if scope is None:
+            return None
+        if scope.kind == "document":
+            return frozenset([scope.value[:DOCUMENT_ID_LENGTH]])
+
+        version = self.answer_cache.version
+        if version != self._collections_version:
+            self._collection_documents = {}
+            self._collections_version = version
+        documents = self._collection_documents.get(scope.value)
+        if documents is None:
+            try:
+                with tracer.span("neo4j.scope_documents"), self.driver.session() as session:
+                    results = session.run(
+                        "MATCH (d:Document) WHERE $collection IN d.collections RETURN d.hash AS hash",
+                        collection=scope.value
+                    )
+                    documents = frozenset(record["hash"][:DOCUMENT_ID_LENGTH] for record in results)
+            except Exception as e:
+                self.feedback.error(f"Error looking up collection '{scope.value}': {str(e)}")
+                return frozenset()
+            self._collection_documents[scope.value] = documents
+        return documents
+
+    def _local_hits(self, query_text, documents=None, k=5):
+        """Rank chunks with the local indexes, returning (chunk_id, score) hits from documents (None: all)"""
+        hits = []
+        if self.retrieval_mode == "bm25":
+            with tracer.span("retrieval.bm25"):
+                hits = self.search_index.search(query_text, k=k, documents=documents)
+            for hit_id, score in hits:
+                debug(f"BM25 match in chunk {hit_id} (score {score:.2f})")
+
+        # Vector similarity also catches paraphrases that share no exact keyword
+        if not hits:
+            with tracer.span("retrieval.vector"):
+                hits = self.vector_index.search(query_text, k=k, documents=documents)
+            for hit_id, score in hits:
+                debug(f"Vector match in chunk {hit_id} (similarity {score:.2f})")
+        return hits
+
+    def _add_acronym_hits(self, questions, hit_lists, scope=None, k=5):
+        """Put chunks defining the questions' acronyms ahead of their local hits
+
+        The Acronym nodes built at ingest are looked up for every question
+        in one query; a definition is scored like the question's best hit.
+        """
+        lookups = [
+            {"list": n, "abbr": abbr}
+            for n, question in enumerate(questions) for abbr in acronym_candidates(question)
+        ]
+        if not lookups:
+            return hit_lists
+        condition, parameters = scope_condition(scope, "c")
+        definitions = [[] for _ in questions]
+        try:
+            with tracer.span("retrieval.acronym"), self.driver.session() as session:
                 results = session.run(
-                    """
-                    MATCH (c:TextChunk)
-                    WHERE toLower(c.text) CONTAINS toLower($acronym)
-                    RETURN c.text AS text, c.id AS id
-                    LIMIT 5
+                    f"""
+                    UNWIND $lookups AS lookup
+                    MATCH (:Acronym {{abbr: lookup.abbr}})-[:DEFINED_IN]->(c:TextChunk)
+                    WHERE {condition}
+                    RETURN lookup.list AS list, c.id AS id
                     """,
-                    acronym=acronym
+                    lookups=lookups,
+                    **parameters
                 )
-                
-                chunks = []
                 for record in results:
-                    st.info(f"Found acronym '{acronym}' in chunk {record['id']}")
-                    chunks.append(record["text"])
-                
-                # If found, return these chunks
-                if chunks:
-                    return chunks
-                    
-                # If not found, get all chunks to search for potential matches
-                # (This is inefficient but works for small datasets)
-                all_results = session.run(
-                    """
-                    MATCH (c:TextChunk)
-                    RETURN c.text AS text, c.id AS id
-                    LIMIT 20
-                    """
-                )
-                
-                # Look for patterns where the acronym might be defined
-                # e.g., "All Star Driver Education (ASDE)"
-                chunks = []
-                pattern1 = re.compile(r'([A-Za-z\s]+)\s*$$' + re.escape(acronym) + r'$$', re.IGNORECASE)
-                pattern2 = re.compile(r'([A-Za-z\s]+)\s*$$' + ''.join([f'{c}[A-Za-z]*' for c in acronym]) + r'$$', re.IGNORECASE)
-                
-                for record in all_results:
-                    text = record["text"]
-                    if pattern1.search(text) or pattern2.search(text) or acronym.lower() in text.lower():
-                        st.info(f"Found potential acronym match in chunk {record['id']}")
-                        chunks.append(text)
-                        if len(chunks) >= 5:
-                            break
-                
-                return chunks
-                
+                    if record["id"] not in definitions[record["list"]]:
+                        definitions[record["list"]].append(record["id"])
         except Exception as e:
-            st.error(f"Error searching for acronym: {str(e)}")
-            return []
+            self.feedback.warning(f"acronym search failed: {str(e)}")
+            return hit_lists
 
-    def _get_sample_chunks(self, limit=5):
-        """Get sample chunks from Neo4j when no relevant chunks are found"""
+        merged = []
+        for chunk_ids, hits in zip(definitions, hit_lists):
+            if chunk_ids:
+                debug(f"Acronym definitions in chunks {', '.join(chunk_ids[:k])}")
+            score = max((hit_score for _, hit_score in hits), default=1.0)
+            defined = [(hit_id, score) for hit_id in chunk_ids[:k]]
+            merged.append((defined + [hit for hit in hits if hit[0] not in chunk_ids[:k]])[:k])
+        return merged
+
+    def _fetch_chunks_for_hits(self, hit_lists):
+        """Fetch the chunks for several ranked (chunk_id, score) hit lists in one query
+
+        Returns a chunk list per hit list, in rank order. With neighbour_hops
+        set, the same query also follows NEXT relationships around each
+        list's expand_top best hits; neighbours come after the hits, scored
+        below the hit they were found from.
+        """
+        hits = [
+            {"list": n, "rank": rank, "id": hit_id, "fetch": True}
+            for n, hit_list in enumerate(hit_lists) for rank, (hit_id, _) in enumerate(hit_list)
+        ]
+        if not hits:
+            return [[] for _ in hit_lists]
+
+        hops = max(int(self.neighbour_hops), 0)
         try:
-            with self.driver.session() as session:
+            with tracer.span("neo4j.fetch_chunks", hops=hops), self.driver.session() as session:
+                records = list(session.run(neighbour_query(hops), hits=hits, expand_top=self.expand_top))
+            fetched = rank_neighbours(hit_lists, records)
+            if hops:
+                debug(f"Expanded {len(hits)} hits to {sum(map(len, fetched))} chunks with their neighbours")
+            return fetched
+        except Exception as e:
+            self.feedback.error(f"Error fetching chunks from Neo4j: {str(e)}")
+            return [[] for _ in hit_lists]
+
+    def _check_database_has_content(self):
+        """Check if the database has any content, using the cached corpus stats"""
+        stats = self.corpus_stats.snapshot()
+        if stats["error"]:
+            self.feedback.error(f"Error checking database content: {stats['error']}")
+        debug(f"Found {stats['chunks']} chunks in the database")
+        return stats["chunks"] > 0
+
+    def _get_sample_chunks(self, scope=None, limit=5):
+        """Get sample chunks (from scope, if given) from Neo4j when no relevant chunks are found"""
+        condition, parameters = scope_condition(scope, "c")
+        try:
+            with tracer.span("neo4j.sample_chunks"), self.driver.session() as session:
                 results = session.run(
-                    """
+                    f"""
                     MATCH (c:TextChunk)
+                    WHERE {condition}
                     RETURN c.text AS text, c.id AS id
                     LIMIT $limit
                     """,
-                    limit=limit
+                    limit=limit,
+                    **parameters
                 )
                 chunks = []
                 for record in results:
-                    st.info(f"Retrieved sample chunk {record['id']}")
-                    chunks.append(record["text"])
+                    debug(f"Retrieved sample chunk {record['id']}")
+                    chunks.append({"id": record["id"], "text": record["text"], "score": 0.0})
                 return chunks
         except Exception as e:
-            st.error(f"Error getting sample chunks: {str(e)}")
+            self.feedback.error(f"Error getting sample chunks: {str(e)}")
             return []
 
-    def _generate_gemini_response(self, user_input, text_chunks):
-        """Generate chatbot response using Gemini AI"""
-        if not text_chunks:
-            return "I don't have enough information to answer that question. Please upload relevant documents."
-            
-        # Prepare context from chunks (limit total size)
-        max_context_length = 8000  # Reduced to avoid token limits
-        context = ""
-        for chunk in text_chunks:
-            if len(context) + len(chunk) < max_context_length:
-                context += chunk + "\n\n"
-            else:
-                break
-                
+    def _build_prompt(self, user_input, text_chunks):
+        """Assemble the Gemini prompt from the question and the ranked context chunks
+
+        Returns the prompt and its estimated token count.
+        """
+        # Best chunks that fit the token budget, with overlapping text between neighbours sent once
+        packed = pack_context(text_chunks, self.context_token_budget)
+        context = packed.text
+
         prompt = f"""
         You are a helpful assistant answering questions based on the provided document context.
         
@@ -248,59 +667,72 @@ class Chatbot:
         If the answer cannot be found in the context, say "I don't have enough information to answer that question."
         Be concise and accurate.
         """
+        prompt_tokens = estimate_tokens(prompt)
+        tracer.count("llm_prompts_total")
+        tracer.count("llm_prompt_tokens_total", prompt_tokens)
+        tracer.count("llm_context_chunks_dropped_total", packed.dropped)
+        tracer.set_gauge("llm_last_prompt_tokens", prompt_tokens)
+        debug(f"Prompt: ~{prompt_tokens} tokens, {len(packed.chunk_ids)} chunks ({packed.dropped} left out)")
+        return prompt, prompt_tokens
+
+    def _generate_gemini_response(self, user_input, text_chunks, session=None):
+        """Generate chatbot response using Gemini AI
+
+        Returns (answer, generated, prompt_tokens); generated is False for
+        canned and fallback replies, which must not be cached.
+        """
+        if not text_chunks:
+            return NO_CONTEXT_ANSWER, False, 0
+            
+        prompt, prompt_tokens = self._build_prompt(user_input, text_chunks)
+
+        def request(timeout):
+            timeout = self._throttle(prompt_tokens, session, timeout)
+            with tracer.span("gemini.attempt", prompt_tokens=prompt_tokens):
+                response = self._get_model().generate_content(prompt, request_options={"timeout": timeout})
+            if not response or not response.text:
+                raise EmptyResponseError("Empty response from Gemini")
+            return response.text
+
+        def attempt(timeout):
+            if self.hedger is not None:
+                return self.hedger.call(request, timeout)
+            return request(timeout)
 
         try:
-            # Add retry logic with better error handling
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    # Use a more reliable model configuration
-                    generation_config = {
-                        "temperature": 0.2,
-                        "top_p": 0.8,
-                        "top_k": 40,
-                        "max_output_tokens": 1024,
-                    }
-                    
-                    safety_settings = [
-                        {
-                            "category": "HARM_CATEGORY_HARASSMENT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_HATE_SPEECH",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        }
-                    ]
-                    
-                    model = genai.GenerativeModel(
-                        model_name="gemini-1.0-pro",  # Use the full model name
-                        generation_config=generation_config,
-                        safety_settings=safety_settings
-                    )
-                    
-                    response = model.generate_content(prompt)
-                    
-                    if response and hasattr(response, "text"):
-                        return response.text
-                    else:
-                        st.warning(f"Empty response from Gemini (attempt {attempt+1})")
-                        time.sleep(1)  # Wait before retry
-                except Exception as e:
-                    st.warning(f"Gemini API error (attempt {attempt+1}): {str(e)}")
-                    time.sleep(2)  # Wait before retry
-                    
-            # Fallback response if all retries fail
-            return "I'm having trouble connecting to my knowledge base. Please try a different question or try again later."
+            return self.retry_policy.call(attempt, self.circuit_breaker), True, prompt_tokens
         except Exception as e:
-            st.error(f"Error with Gemini API: {str(e)}")
-            return "I encountered a technical issue. Please check your API configuration and try again."
+            return self._fallback_answer(e, text_chunks), False, prompt_tokens
+
+    def _throttle(self, prompt_tokens, session, timeout):
+        """Wait, at most timeout seconds, for the scheduler to admit a Gemini request
+
+        Returns the part of timeout left for the request itself, so queueing
+        counts against the retry policy's deadline.
+        """
+        waited = self.scheduler.acquire(prompt_tokens, session, timeout=timeout)
+        return max(timeout - waited, 0.001)
+
+    def _fallback_answer(self, error, text_chunks):
+        """Reply for a Gemini call that failed for good: the retrieved passages, unless it was our fault"""
+        if isinstance(error, CircuitOpenError):
+            debug("Gemini is unavailable, answering with the retrieved passages")
+        elif isinstance(error, QueueTimeoutError):
+            self.feedback.warning("Too many questions are waiting for Gemini, answering with the retrieved passages")
+        elif is_retryable(error):
+            self.feedback.warning(f"Gemini API error, giving up after retries: {str(error)}")
+        else:
+            self.feedback.error(f"Error with Gemini API: {str(error)}")
+            return TECHNICAL_ISSUE_ANSWER
+        return self._context_only_answer(text_chunks)
 
+    @staticmethod
+    def _context_only_answer(text_chunks, max_passages=3, max_chars=400):
+        """Quote the best retrieved passages when no answer can be generated"""
+        passages = []
+        for chunk in text_chunks[:max_passages]:
+            snippet = " ".join(chunk["text"].split())
+            if len(snippet) > max_chars:
+                snippet = snippet[:max_chars].rsplit(" ", 1)[0] + " …"
+            passages.append(f"> {snippet}")
+        return CONTEXT_ONLY_ANSWER + "\n\n" + "\n\n".join(passages)
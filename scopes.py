@@ -0,0 +1,46 @@
+import re
+from typing import NamedTuple
+
+# Collection of documents uploaded without one
+DEFAULT_COLLECTION = "default"
+
+# Chunk ids are the document hash prefix plus the chunk's character offset
+DOCUMENT_ID_LENGTH = 16
+CHUNK_ID = re.compile(rf"([0-9a-f]{{{DOCUMENT_ID_LENGTH}}})-(\d+)")
+
+# TextChunk (and Document) property holding each kind of scope. A document can be
+# filed under several collections, so "collections" is a list of their names
+SCOPE_PROPERTIES = {"document": "document", "collection": "collections"}
+
+
+class Scope(NamedTuple):
+    """The part of the corpus a question is asked against; None stands for all of it"""
+    kind: str       # "document" (value: the document hash) or "collection" (value: its name)
+    value: str
+
+
+def document_key(chunk_id):
+    """The document part of a "{document}-{offset}" chunk id"""
+    return str(chunk_id).rpartition("-")[0]
+
+
+def parse_chunk_id(chunk_id):
+    """(document key, offset) of a "{document}-{offset}" chunk id, or None for ids of another form"""
+    match = CHUNK_ID.fullmatch(str(chunk_id))
+    return (match.group(1), int(match.group(2))) if match else None
+
+
+def scope_condition(scope, variable="c"):
+    """A Cypher condition limiting TextChunk variable to scope, and its parameters
+
+    The property is inlined (from a fixed set) rather than tested with
+    "$value IS NULL OR ...", so the planner can use the property index and
+    the query only touches the chunks in scope. Collection scopes test
+    membership of the collections list; the full-text index covers that
+    list, so full-text queries are narrowed to the collection in Lucene.
+    """
+    if scope is None:
+        return "true", {}
+    if scope.kind == "collection":
+        return f"$scope_value IN {variable}.{SCOPE_PROPERTIES[scope.kind]}", {"scope_value": scope.value}
+    return f"{variable}.{SCOPE_PROPERTIES[scope.kind]} = $scope_value", {"scope_value": scope.value}
@@ -0,0 +1,245 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+import math
+import re
+import threading
+
+from scopes import document_key
+
+# Lowercased alphanumeric runs are the index terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its of on or
+so that the their then there these they this to was were what when where which who
+why will with you your
+""".split())
+
+
+def tokenize(text):
+    """Split text into lowercase index terms, dropping stop words"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOP_WORDS]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index mirroring the TextChunk store.
+
+    Postings are kept per term as two parallel compact arrays (document
+    numbers and term frequencies) instead of Python lists of tuples.
+    Removed chunks are tombstoned and the postings are compacted once
+    enough of them pile up; document frequencies are kept per term for the
+    live chunks only, so tombstones never skew scores. Doc numbers only grow, so postings stay sorted
+    and a document's chunks sit inside the span of doc numbers it was
+    given; scoped searches only scan the postings inside their documents'
+    spans.
+    """
+
+    # Attributes holding the indexed chunks, as set by clear()
+    _STATE = ("_postings", "_live_df", "_doc_terms", "_chunk_ids", "_documents", "_doc_numbers",
+              "_document_spans", "_document_chunks", "_doc_lengths", "_total_length", "_removed")
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Drop every indexed chunk"""
+        with self._lock:
+            self._postings = {}          # term -> (array of doc numbers, array of term freqs)
+            self._live_df = {}           # term -> number of live chunks containing it
+            self._doc_terms = []         # doc number -> distinct terms of the chunk, None once removed
+            self._chunk_ids = []         # doc number -> chunk id, None once removed
+            self._documents = []         # doc number -> document key of the chunk id
+            self._doc_numbers = {}       # chunk id -> doc number
+            self._document_spans = {}    # document key -> [first, last] doc number of its chunks
+            self._document_chunks = {}   # document key -> number of its live chunks
+            self._doc_lengths = array("I")
+            self._total_length = 0
+            self._removed = 0
+
+    def replace_with(self, other):
+        """Take over the chunks indexed by other, e.g. a freshly built index
+
+        The index is updated in place, so bound methods handed out
+        earlier (search, add_chunks) keep working on the new chunks.
+        """
+        with self._lock, other._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(other, name))
+
+    def __len__(self):
+        return len(self._doc_numbers)
+
+    def chunk_ids(self):
+        """Ids of the indexed chunks"""
+        with self._lock:
+            return list(self._doc_numbers)
+
+    def add_chunks(self, rows):
+        """Index chunk rows ({"id", "text", ...}), replacing chunks that are already indexed"""
+        with self._lock:
+            for row in rows:
+                chunk_id, text = row["id"], row["text"]
+                if chunk_id in self._doc_numbers:
+                    self._remove(chunk_id)
+
+                terms = tokenize(text)
+                doc_number = len(self._chunk_ids)
+                document = document_key(chunk_id)
+                self._chunk_ids.append(chunk_id)
+                self._documents.append(document)
+                self._add_to_span(document, doc_number)
+                self._doc_numbers[chunk_id] = doc_number
+                self._doc_lengths.append(len(terms))
+                self._total_length += len(terms)
+
+                frequencies = {}
+                for term in terms:
+                    frequencies[term] = frequencies.get(term, 0) + 1
+                for term, frequency in frequencies.items():
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        posting = self._postings[term] = (array("I"), array("I"))
+                    posting[0].append(doc_number)
+                    posting[1].append(frequency)
+                    self._live_df[term] = self._live_df.get(term, 0) + 1
+                self._doc_terms.append(tuple(frequencies))
+            # Re-indexing a chunk tombstones its old copy, so replacements pile up too
+            self._compact_if_needed()
+
+    def _add_to_span(self, document, doc_number):
+        span = self._document_spans.get(document)
+        if span is None:
+            self._document_spans[document] = [doc_number, doc_number]
+        else:
+            span[1] = doc_number
+        self._document_chunks[document] = self._document_chunks.get(document, 0) + 1
+
+    def remove_chunks(self, chunk_ids):
+        """Remove chunks from the index"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove(chunk_id)
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if self._removed > max(len(self._doc_numbers), 1000) // 4:
+            self._compact()
+
+    def _remove(self, chunk_id):
+        doc_number = self._doc_numbers.pop(chunk_id, None)
+        if doc_number is None:
+            return
+        self._chunk_ids[doc_number] = None
+        self._total_length -= self._doc_lengths[doc_number]
+        self._removed += 1
+        for term in self._doc_terms[doc_number]:
+            remaining = self._live_df[term] - 1
+            if remaining:
+                self._live_df[term] = remaining
+            else:
+                del self._live_df[term]
+        self._doc_terms[doc_number] = None
+        # A document whose chunks are all gone starts a fresh span if it is indexed again
+        document = self._documents[doc_number]
+        remaining = self._document_chunks[document] - 1
+        if remaining:
+            self._document_chunks[document] = remaining
+        else:
+            del self._document_chunks[document]
+            del self._document_spans[document]
+
+    def _compact(self):
+        """Rewrite postings without tombstoned documents, renumbering the survivors"""
+        renumber = {}
+        chunk_ids = []
+        documents = []
+        doc_terms = []
+        doc_lengths = array("I")
+        for old_number, chunk_id in enumerate(self._chunk_ids):
+            if chunk_id is not None:
+                renumber[old_number] = len(chunk_ids)
+                chunk_ids.append(chunk_id)
+                documents.append(self._documents[old_number])
+                doc_terms.append(self._doc_terms[old_number])
+                doc_lengths.append(self._doc_lengths[old_number])
+
+        postings = {}
+        for term, (doc_numbers, frequencies) in self._postings.items():
+            new_numbers = array("I")
+            new_frequencies = array("I")
+            for doc_number, frequency in zip(doc_numbers, frequencies):
+                new_number = renumber.get(doc_number)
+                if new_number is not None:
+                    new_numbers.append(new_number)
+                    new_frequencies.append(frequency)
+            if new_numbers:
+                postings[term] = (new_numbers, new_frequencies)
+
+        self._postings = postings
+        self._chunk_ids = chunk_ids
+        self._documents = documents
+        self._doc_terms = doc_terms
+        self._doc_numbers = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+        self._document_spans = {}
+        self._document_chunks = {}
+        for doc_number, document in enumerate(documents):
+            self._add_to_span(document, doc_number)
+        self._doc_lengths = doc_lengths
+        self._removed = 0
+
+    def search(self, query_text, k=5, documents=None):
+        """Return up to k (chunk_id, score) pairs ranked by BM25 score
+
+        documents, a set of document keys (see scopes.document_key), limits
+        the search to those documents' chunks; statistics stay corpus-wide.
+        Only the postings inside those documents' spans are scanned, so a
+        scoped search costs about as much as the scope is big.
+        """
+        with self._lock:
+            live = len(self._doc_numbers)
+            if live == 0:
+                return []
+            average_length = self._total_length / live or 1.0
+            k1, b = self.k1, self.b
+            chunk_ids = self._chunk_ids
+            chunk_documents = self._documents
+            doc_lengths = self._doc_lengths
+            if documents is not None:
+                spans = [(document, self._document_spans[document])
+                         for document in documents if document in self._document_spans]
+
+            scores = {}
+            for term in set(tokenize(query_text)):
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                df = self._live_df.get(term, 0)
+                if df == 0:
+                    continue
+                doc_numbers, frequencies = posting
+                idf = max(0.0, math.log(1 + (live - df + 0.5) / (df + 0.5)))
+                if documents is None:
+                    ranges = [(None, 0, len(doc_numbers))]
+                else:
+                    ranges = [
+                        (document, bisect_left(doc_numbers, first), bisect_right(doc_numbers, last))
+                        for document, (first, last) in spans
+                    ]
+                for document, start, stop in ranges:
+                    for i in range(start, stop):
+                        doc_number = doc_numbers[i]
+                        if chunk_ids[doc_number] is None:
+                            continue
+                        # Spans of documents ingested side by side can interleave
+                        if document is not None and chunk_documents[doc_number] != document:
+                            continue
+                        frequency = frequencies[i]
+                        norm = k1 * (1 - b + b * doc_lengths[doc_number] / average_length)
+                        scores[doc_number] = scores.get(doc_number, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(chunk_ids[doc_number], score) for doc_number, score in best]
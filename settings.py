@@ -0,0 +1,37 @@
+import logging
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11; streamlit depends on toml
+    import toml as tomllib
+
+from tracing import set_verbosity
+
+# Where Streamlit reads the app's secrets; headless tools read the same file
+DEFAULT_SECRETS_PATH = ".streamlit/secrets.toml"
+
+
+def load_secrets(path=DEFAULT_SECRETS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return tomllib.loads(f.read())
+
+
+def headless_setup(path=DEFAULT_SECRETS_PATH):
+    """Set up logging for a command-line tool and load the app's secrets
+
+    Returns the secrets and the Neo4j connection arguments (uri, user,
+    password and driver_settings) that Chatbot and DocumentProcessor take.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # Streamlit outside `streamlit run` only logs warnings about the missing script context
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    set_verbosity("quiet")
+
+    secrets = load_secrets(path)
+    neo4j = {
+        "uri": secrets["neo4j"]["uri"],
+        "user": secrets["neo4j"]["user"],
+        "password": secrets["neo4j"]["password"],
+        "driver_settings": dict(secrets.get("neo4j_pool", {})),
+    }
+    return secrets, neo4j
@@ -0,0 +1,39 @@
+from search_index import BM25Index
+
+
+def rows(document, texts):
+    return [{"id": f"{document}-{offset}", "text": text} for offset, text in enumerate(texts)]
+
+
+def test_replacing_chunks_keeps_scores_positive():
+    index = BM25Index()
+    texts = ["neo4j stores the graph", "streamlit renders the page", "pdf pages become chunks"]
+    for _ in range(50):
+        index.add_chunks(rows("doc", texts))
+
+    hits = index.search("neo4j graph")
+    assert len(index) == 3
+    assert hits[0][0] == "doc-0"
+    assert all(score > 0 for _, score in hits)
+
+
+def test_re_adding_removed_chunks_ranks_like_a_fresh_index():
+    texts = ["alpha beta", "beta gamma", "gamma delta", "delta alpha"]
+    index = BM25Index()
+    index.add_chunks(rows("doc", texts))
+    index.remove_chunks([f"doc-{offset}" for offset in range(len(texts))])
+    index.add_chunks(rows("doc", texts))
+
+    fresh = BM25Index()
+    fresh.add_chunks(rows("doc", texts))
+    assert index.search("alpha gamma", k=4) == fresh.search("alpha gamma", k=4)
+    assert index.search("beta", k=4, documents={"doc"}) == fresh.search("beta", k=4, documents={"doc"})
+
+
+def test_replacements_are_compacted():
+    index = BM25Index()
+    for _ in range(10):
+        index.add_chunks(rows("doc", [f"chunk {n}" for n in range(500)]))
+
+    assert len(index) == 500
+    assert index._removed <= max(len(index), 1000) // 4
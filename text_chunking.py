@@ -0,0 +1,109 @@
+import re
+
+# Runs of spaces or newlines collapse to their first character. Each branch
+# starts with a literal, which keeps the regex scan fast.
+WHITESPACE_RUNS = re.compile(r"  +|\n\n+")
+
+DEFAULT_CHUNK_SIZE = 800
+DEFAULT_OVERLAP = 200
+
+
+class _PrintableTable(dict):
+    """str.translate table deleting non-printable characters (except newline).
+
+    Characters are classified once, on first sight, and cached, so the
+    translate pass stays in C for every character seen before.
+    """
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        value = codepoint if char == "\n" or char.isprintable() else None
+        self[codepoint] = value
+        return value
+
+
+_PRINTABLE = _PrintableTable()
+
+
+def normalize_text(text):
+    """Drop non-printable characters and collapse newline and space runs, in linear time"""
+    return WHITESPACE_RUNS.sub(_first_char, text.translate(_PRINTABLE))
+
+
+def _first_char(match):
+    return match.group()[0]
+
+
+def chunk_spans(text, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP, final=True):
+    """Yield (start, end) offsets of overlapping chunks of text
+
+    A chunk ends at a sentence or line break in its second half when there
+    is one, otherwise after chunk_size characters; the next chunk starts at
+    a sentence beginning inside the last overlap characters. Spans are
+    trimmed of surrounding whitespace and empty ones are skipped. Every
+    search is bounded by the current window, so the whole pass is linear
+    in len(text).
+
+    With final=False the text is treated as the head of a longer stream:
+    only chunks known to be complete are produced, and the generator
+    returns the offset where chunking should resume once more text arrives.
+    """
+    length = len(text)
+    start = 0
+    while start < length:
+        end = start + chunk_size
+        if end >= length:
+            if not final:
+                return start
+            end = length
+        else:
+            # Try to end at a sentence or line break
+            for marker in (". ", "\n"):
+                brk = text.rfind(marker, start, end)
+                if brk != -1 and brk > start + chunk_size // 2:
+                    end = brk + len(marker)
+                    break
+
+        span_start, span_end = start, end
+        while span_start < span_end and text[span_start].isspace():
+            span_start += 1
+        while span_end > span_start and text[span_end - 1].isspace():
+            span_end -= 1
+        if span_start < span_end:
+            yield span_start, span_end
+
+        if end == length:
+            break
+
+        # Try to start the next chunk at a sentence beginning
+        overlap_start = max(end - overlap, start)
+        sentence_start = text.find(". ", overlap_start, end)
+        start = sentence_start + 2 if sentence_start != -1 else overlap_start
+    return start
+
+
+def iter_chunks(pieces, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP):
+    """Chunk a stream of text pieces, yielding (document_offset, chunk_text)
+
+    Produces the same chunks as chunk_spans over the concatenated pieces
+    while buffering only the not yet chunked tail of the stream.
+    """
+    buffer = ""
+    base = 0        # document offset of buffer[0]
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) <= chunk_size:
+            continue
+        spans = chunk_spans(buffer, chunk_size, overlap, final=False)
+        while True:
+            try:
+                start, end = next(spans)
+            except StopIteration as done:
+                resume = done.value
+                break
+            yield base + start, buffer[start:end]
+        buffer = buffer[resume:]
+        base += resume
+
+    for start, end in chunk_spans(buffer, chunk_size, overlap):
+        yield base + start, buffer[start:end]
@@ -0,0 +1,185 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import threading
+import time
+
+import streamlit as st
+
+VERBOSITY_LEVELS = {"quiet": 0, "info": 1, "debug": 2}
+
+_verbosity = VERBOSITY_LEVELS["info"]
+
+
+def set_verbosity(level):
+    """Set how chatty the UI is: "quiet", "info" or "debug" (shows per-step debug messages)"""
+    global _verbosity
+    _verbosity = VERBOSITY_LEVELS[level]
+
+
+def debug(message):
+    """Show a debug message in the UI only when verbosity is "debug" """
+    if _verbosity >= VERBOSITY_LEVELS["debug"]:
+        st.info(message)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+class Tracer:
+    """Lightweight timed spans with per-stage latency percentiles.
+
+    Each span records its wall time and its self time (wall time minus the
+    spans nested inside it on the same thread), so stages of a generator
+    pipeline that pull from each other are not double counted; percentiles
+    are computed on self time. The last window spans per stage are kept in
+    memory; spans can also be appended to a JSON lines file and scraped in
+    Prometheus text format, together with any counters and gauges.
+    """
+
+    def __init__(self, window=1000, export_path=None):
+        self.window = window
+        self.export_path = export_path
+        self._durations = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._counters = defaultdict(float)     # (name, labels) -> running total
+        self._gauges = {}                       # (name, labels) -> current value
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as one span of stage name"""
+        stack = self._local.__dict__.setdefault("stack", [])
+        frame = {"children": 0.0}
+        stack.append(frame)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1]["children"] += duration
+            self.record(name, duration, duration - frame["children"], error=error, **attributes)
+
+    def timed_iter(self, name, iterable, **attributes):
+        """Yield from iterable, timing each next() call as a span"""
+        iterator = iter(iterable)
+        while True:
+            with self.span(name, **attributes):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, name, duration, self_duration=None, **attributes):
+        """Record a finished span"""
+        self_duration = duration if self_duration is None else self_duration
+        with self._lock:
+            self._durations[name].append(self_duration)
+            self._counts[name] += 1
+            self._sums[name] += self_duration
+            if self.export_path:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({
+                        "name": name, "ts": time.time(), "duration": duration,
+                        "self_duration": self_duration, **attributes
+                    }, default=str) + "\n")
+
+    def count(self, name, amount=1, **labels):
+        """Add to a counter metric"""
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge metric"""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def counters(self):
+        """Current counter totals keyed by (name, labels)"""
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        """Per-stage count, p50 and p95 self time in seconds"""
+        with self._lock:
+            windows = {name: sorted(values) for name, values in self._durations.items()}
+            counts = dict(self._counts)
+        return {
+            name: {"count": counts[name], "p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for name, values in sorted(windows.items())
+        }
+
+    def prometheus_text(self):
+        """Stage latencies in Prometheus text exposition format"""
+        lines = [
+            "# HELP nbot_stage_seconds Self time spent per pipeline stage.",
+            "# TYPE nbot_stage_seconds summary",
+        ]
+        with self._lock:
+            stages = {name: sorted(values) for name, values in self._durations.items()}
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+            metrics = [("counter", self._counters), ("gauge", self._gauges)]
+            metrics = [(kind, dict(values)) for kind, values in metrics]
+        for name, values in sorted(stages.items()):
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'nbot_stage_seconds{{stage="{name}",quantile="{q}"}} {percentile(values, q * 100):.6f}')
+            lines.append(f'nbot_stage_seconds_sum{{stage="{name}"}} {sums[name]:.6f}')
+            lines.append(f'nbot_stage_seconds_count{{stage="{name}"}} {counts[name]}')
+        for kind, values in metrics:
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE nbot_{name} {kind}")
+                    typed.add(name)
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"nbot_{name}{{{label_text}}} {value:g}" if label_text else f"nbot_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide tracer used by the retrieval, LLM and ingest code
+tracer = Tracer()
+
+_metrics_server = None
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve tracer.prometheus_text() at /metrics from a background thread (once per process)"""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = tracer.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _metrics_server
@@ -0,0 +1,176 @@
+import threading
+import zlib
+
+import numpy as np
+
+from search_index import tokenize
+from scopes import document_key
+
+
+class HashingEmbedder:
+    """Offline text embedder using the hashing trick.
+
+    Each text is turned into word unigrams plus character trigrams of every
+    word, hashed with a signed CRC32 into a fixed number of buckets, weighted
+    with sublinear term frequency and L2-normalised. No vocabulary or network
+    access is needed, so the same text always maps to the same vector.
+    """
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def _features(self, text):
+        features = {}
+        for word in tokenize(text):
+            features[word] = features.get(word, 0) + 1
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                trigram = padded[i:i + 3]
+                features[trigram] = features.get(trigram, 0) + 1
+        return features
+
+    def embed(self, text):
+        """Embed a single text as a float32 vector"""
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts):
+        """Embed several texts into one (len(texts), dimensions) float32 matrix"""
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dimensions] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+
+
+class VectorIndex:
+    """Top-k cosine search over chunk embeddings held in one contiguous float32 matrix"""
+
+    # Attributes holding the indexed chunks, as set by clear()
+    _STATE = ("_matrix", "_chunk_ids", "_rows", "_document_rows")
+
+    def __init__(self, embedder=None, initial_capacity=1024):
+        self.embedder = embedder or HashingEmbedder()
+        self._lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self.clear()
+
+    def clear(self):
+        """Drop every indexed chunk"""
+        with self._lock:
+            self._matrix = np.zeros((self._initial_capacity, self.embedder.dimensions), dtype=np.float32)
+            self._chunk_ids = []   # matrix row -> chunk id
+            self._rows = {}        # chunk id -> matrix row
+            self._document_rows = {}   # document key -> matrix rows of its chunks
+
+    def replace_with(self, other):
+        """Take over, in place, the chunks indexed by other (built with the same embedder)"""
+        with self._lock, other._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(other, name))
+
+    def __len__(self):
+        return len(self._chunk_ids)
+
+    def chunk_ids(self):
+        """Ids of the indexed chunks"""
+        with self._lock:
+            return list(self._chunk_ids)
+
+    def add_chunks(self, rows):
+        """Index chunk rows ({"id", "text", optional "embedding"}), replacing existing ids"""
+        rows = list(rows)
+        if not rows:
+            return
+        missing = [row["text"] for row in rows if row.get("embedding") is None]
+        computed = iter(self.embedder.embed_batch(missing)) if missing else iter(())
+        with self._lock:
+            for row in rows:
+                embedding = row.get("embedding")
+                vector = next(computed) if embedding is None else np.asarray(embedding, dtype=np.float32)
+                position = self._rows.get(row["id"])
+                if position is None:
+                    position = len(self._chunk_ids)
+                    self._grow(position + 1)
+                    self._chunk_ids.append(row["id"])
+                    self._rows[row["id"]] = position
+                    self._document_rows.setdefault(document_key(row["id"]), set()).add(position)
+                self._matrix[position] = vector
+
+    def remove_chunks(self, chunk_ids):
+        """Remove chunks, moving the last row into each hole to keep the matrix dense"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                position = self._rows.pop(chunk_id, None)
+                if position is None:
+                    continue
+                last = len(self._chunk_ids) - 1
+                last_id = self._chunk_ids.pop()
+                self._forget_row(chunk_id, position)
+                if position != last:
+                    self._matrix[position] = self._matrix[last]
+                    self._chunk_ids[position] = last_id
+                    self._rows[last_id] = position
+                    self._forget_row(last_id, last)
+                    self._document_rows.setdefault(document_key(last_id), set()).add(position)
+
+    def _forget_row(self, chunk_id, position):
+        rows = self._document_rows.get(document_key(chunk_id))
+        if rows is not None:
+            rows.discard(position)
+            if not rows:
+                del self._document_rows[document_key(chunk_id)]
+
+    def _grow(self, size):
+        capacity = len(self._matrix)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.embedder.dimensions), dtype=np.float32)
+        matrix[:len(self._chunk_ids)] = self._matrix[:len(self._chunk_ids)]
+        self._matrix = matrix
+
+    def search(self, query_text, k=5, documents=None, min_score=0.05):
+        """Return up to k (chunk_id, score) pairs ranked by cosine similarity"""
+        return self.search_many([query_text], k=k, documents=documents, min_score=min_score)[0]
+
+    def search_many(self, query_texts, k=5, documents=None, min_score=0.05):
+        """Rank chunks for several queries with a single matrix product
+
+        documents, a set of document keys (see scopes.document_key), limits
+        the product to those documents' rows.
+        """
+        queries = self.embedder.embed_batch(query_texts)
+        with self._lock:
+            if documents is None:
+                scores = self._matrix[:len(self._chunk_ids)] @ queries.T      # (chunks, queries)
+                chunk_ids = list(self._chunk_ids)
+            else:
+                rows = sorted(row for key in documents for row in self._document_rows.get(key, ()))
+                scores = self._matrix[rows] @ queries.T
+                chunk_ids = [self._chunk_ids[row] for row in rows]
+            n = len(chunk_ids)
+            if n == 0:
+                return [[] for _ in query_texts]
+
+        k = min(k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        else:
+            top = np.broadcast_to(np.arange(n)[:, None], scores.shape)
+
+        results = []
+        for column in range(len(query_texts)):
+            candidates = top[:, column]
+            ranked = candidates[np.argsort(-scores[candidates, column])]
+            results.append([
+                (chunk_ids[i], float(scores[i, column]))
+                for i in ranked
+                if scores[i, column] >= min_score
+            ])
+        return results